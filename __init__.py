@@ -32,6 +32,15 @@ JWT_TOKEN_NAME = os.environ.get('JWT_TOKEN_NAME') or 'jwt_python_flask'
 app.config['SECRET_KEY'] = SECRET_KEY
 app.config['SESSION_COOKIE_NAME'] = SESSION_COOKIE_NAME 
 app.config['JWT_TOKEN_NAME'] = JWT_TOKEN_NAME 
+# Short-lived access tokens, renewed with a refresh token (see model/tokens.py)
+app.config['JWT_REFRESH_TOKEN_NAME'] = os.environ.get('JWT_REFRESH_TOKEN_NAME') or 'jwt_refresh_python_flask'
+app.config['JWT_ACCESS_TTL'] = int(os.environ.get('JWT_ACCESS_TTL') or 15 * 60)  # seconds
+app.config['JWT_REFRESH_TTL'] = int(os.environ.get('JWT_REFRESH_TTL') or 14 * 24 * 3600)  # seconds
+# Password hashing, in a thread pool (see model/passwords.py); hashes of another method are upgraded at login
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD') or 'scrypt:32768:8:1'
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS') or 2)
+# Hashes running or waiting per process before logins answer 503, below the gunicorn --threads of the Dockerfile
+app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.environ.get('PASSWORD_HASH_MAX_PENDING') or 4)
 
 # Database settings 
 dbName = 'user_management'
@@ -51,6 +60,8 @@ else:
     dbString = 'sqlite:///volumes/'
     dbURI = dbString + dbName + '.db'
     backupURI = dbString + dbName + '_bak.db'
+# An explicit URI wins, e.g. for scripts that must not touch the development database
+dbURI = os.environ.get('SQLALCHEMY_DATABASE_URI') or dbURI
 
 app.config['DB_ENDPOINT'] = DB_ENDPOINT
 app.config['DB_USERNAME'] = DB_USERNAME
@@ -69,6 +80,18 @@ app.config['UPLOAD_EXTENSIONS'] = ['.jpg', '.png', '.gif']  # supported file typ
 app.config['UPLOAD_FOLDER'] = os.path.join(app.instance_path, 'uploads')
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Sequence upload settings, streamed FASTA/FASTQ bodies are not held in memory so they may be much larger
+app.config['SEQUENCE_STREAM_MAX_LENGTH'] = int(os.environ.get('SEQUENCE_STREAM_MAX_LENGTH') or 200 * 1024 * 1024)
+# Bulk scoring uploads (CSV/Parquet) are spooled to disk and read in chunks
+app.config['BULK_UPLOAD_MAX_LENGTH'] = int(os.environ.get('BULK_UPLOAD_MAX_LENGTH') or 500 * 1024 * 1024)
+
+# Inference settings, model predictions run in a pool of worker processes (0 workers: in the request thread)
+app.config['INFERENCE_WORKERS'] = int(os.environ.get('INFERENCE_WORKERS') or 2)
+app.config['INFERENCE_MAX_PENDING'] = int(os.environ.get('INFERENCE_MAX_PENDING') or 32)  # pending batches before 503
+app.config['INFERENCE_COALESCE_MS'] = float(os.environ.get('INFERENCE_COALESCE_MS') or 2)  # window for merging single predictions
+app.config['INFERENCE_MAX_BATCH'] = int(os.environ.get('INFERENCE_MAX_BATCH') or 256)
+app.config['INFERENCE_TIMEOUT'] = float(os.environ.get('INFERENCE_TIMEOUT') or 30)
+
 # GITHUB settings
 app.config['GITHUB_API_URL'] = 'https://api.github.com'
 app.config['GITHUB_TOKEN'] = os.environ.get('GITHUB_TOKEN') or None
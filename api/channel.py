@@ -1,5 +1,6 @@
+import json
 import jwt
-from flask import Blueprint, request, jsonify, current_app, Response, g
+from flask import Blueprint, request, jsonify, current_app, Response, g, stream_with_context
 from flask_restful import Api, Resource  # used for REST API building
 from datetime import datetime
 from __init__ import app
@@ -115,30 +116,26 @@ class ChannelAPI:
             return jsonify({'message': 'Channel deleted'})
 
     class _BULK_CRUD(Resource):
+        @token_required()
         def post(self):
             """
-            Handle bulk channel creation by sending POST requests to the single channel endpoint.
+            Handle bulk channel creation in one pass (see Channel.bulk_loader and model/bulk.py).
+            Rows that cannot be created are reported by index in 'errors'.  With stream=1 the progress is
+            streamed as NDJSON, one line after every chunk, the last one with the errors.
             """
             channels = request.get_json()
 
             if not isinstance(channels, list):
                 return {'message': 'Expected a list of channel data'}, 400
 
-            results = {'errors': [], 'success_count': 0, 'error_count': 0}
-
-            with current_app.test_client() as client:
-                for channel in channels:
-                    # Simulate a POST request to the single channel creation endpoint
-                    response = client.post('/api/channel', json=channel)
-
-                    if response.status_code == 200:
-                        results['success_count'] += 1
-                    else:
-                        results['errors'].append(response.get_json())
-                        results['error_count'] += 1
+            loader = Channel.bulk_loader()
+            if request.args.get('stream') in ('1', 'true'):
+                progress = loader.load(channels)
+                return Response(stream_with_context(json.dumps(line) + '\n' for line in progress),
+                                mimetype='application/x-ndjson')
 
             # Return the results of the bulk creation process
-            return jsonify(results)
+            return jsonify(loader.run(channels))
         
         def get(self):
             """
@@ -0,0 +1,79 @@
+import os
+from flask import Blueprint, request, jsonify, current_app, g
+from flask_restful import Api, Resource
+from api.jwt_authorize import token_required
+from model import crispr
+from model.fasta import read_chunks, read_sequences, read_reference
+
+crispr_api = Blueprint('crispr_api', __name__, url_prefix='/api')
+api = Api(crispr_api)
+
+
+def _index_dir(user):
+    # A user's index lives in their upload dir, so it moves and goes with the user's other files
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], user.uid, 'crispr')
+
+
+class CrisprAPI:
+    class _Reference(Resource):
+        @token_required()
+        def get(self):
+            """
+            The current user's indexed reference: name, version and length.
+            """
+            index = crispr.load_index(_index_dir(g.current_user))
+            if index is None:
+                return {'message': 'No reference uploaded'}, 404
+            return jsonify(index.describe())
+
+        @token_required()
+        def put(self):
+            """
+            Upload the current user's reference sequence and index it for target site searches.
+
+            The body is a FASTA/FASTQ stream, or a multipart form with a 'reference' file; only the first
+            record is used.  The index replaces the user's previous one.
+            """
+            request.max_content_length = current_app.config['SEQUENCE_STREAM_MAX_LENGTH']
+            stream = request.files['reference'].stream if 'reference' in request.files else request.stream
+            try:
+                name, sequence, _ = read_reference(read_sequences(read_chunks(stream)))
+                index = crispr.build_index(_index_dir(g.current_user), name or 'reference', sequence)
+            except ValueError as e:
+                return {'message': f'Invalid sequence data: {str(e)}'}, 400
+            return {'message': 'Reference indexed', **index.describe()}, 201
+
+        @token_required()
+        def delete(self):
+            """
+            Delete the current user's reference and its index.
+            """
+            if not crispr.delete_index(_index_dir(g.current_user)):
+                return {'message': 'No reference uploaded'}, 404
+            return {'message': 'Reference deleted'}, 200
+
+    class _Search(Resource):
+        @token_required()
+        def post(self):
+            """
+            Find the target sites of a guide in the current user's reference.
+
+            The body holds 'guide', optionally 'pam' (IUPAC, default NGG) and 'max_mismatches' (default 3).
+            The answer lists the sites on both strands, best first, with on-target and off-target counts.
+            """
+            body = request.get_json(silent=True) or {}
+            guide = body.get('guide')
+            pam = body.get('pam', 'NGG')
+            if not isinstance(guide, str) or not isinstance(pam, str):
+                return {'message': 'A guide sequence is required'}, 400
+
+            index = crispr.load_index(_index_dir(g.current_user))
+            if index is None:
+                return {'message': 'No reference uploaded, PUT one to /api/crispr/reference'}, 404
+            try:
+                return jsonify(index.search(guide, pam=pam, max_mismatches=body.get('max_mismatches', 3)))
+            except ValueError as e:
+                return {'message': str(e)}, 400
+
+api.add_resource(CrisprAPI._Reference, '/crispr/reference')
+api.add_resource(CrisprAPI._Search, '/crispr/search')
@@ -1,7 +1,13 @@
-from flask import Blueprint, request, jsonify, current_app, g
+import os
+import shutil
+import tempfile
+import time
+from flask import Blueprint, request, jsonify, current_app, g, Response, stream_with_context
 from flask_restful import Api, Resource
 from api.jwt_authorize import token_required
-from model.editing import predict_functionality
+from model.executor import get_executor, InferenceBusy
+from model.editing import read_table_chunks
+from model import telemetry
 
 editing_api = Blueprint('editing_api', __name__, url_prefix='/api')
 api = Api(editing_api)
@@ -18,10 +24,98 @@ class EditingAPI:
                 return {'message': 'Invalid input data provided'}, 400
 
             try:
-                prediction = predict_functionality(input_data)
-                return jsonify({'message': 'Prediction successful', 'prediction': prediction})
+                # Single predictions are coalesced with concurrent ones into one batch in the inference pool
+                prediction = get_executor(current_app.config).predict('editing', input_data)
+                with telemetry.timer('editing', 'serialize'):
+                    return jsonify({'message': 'Prediction successful', 'prediction': prediction})
+            except InferenceBusy as e:
+                return {'message': 'Prediction service is busy, try again later', 'error': str(e)}, 503, {'Retry-After': '1'}
             except Exception as e:
                 current_app.logger.error(f"Prediction error: {str(e)}")
                 return {'message': 'Prediction failed', 'error': str(e)}, 500
 
-api.add_resource(EditingAPI._Predict, '/editing')
\ No newline at end of file
+    class _Bulk(Resource):
+        @token_required()
+        def post(self):
+            """
+            Score a CSV or Parquet export of screens, answering with the same rows as CSV plus a 'Prediction' column.
+
+            The upload is a multipart 'file' field or the raw request body; the format comes from the 'format'
+            query parameter, the file name or the content type and defaults to CSV.  Rows are read, encoded and
+            predicted in chunks and the annotated CSV is streamed back chunk by chunk.
+            """
+            # The upload is spooled to disk and read in chunks, so a larger body than the default limit is allowed
+            request.max_content_length = current_app.config['BULK_UPLOAD_MAX_LENGTH']
+
+            if request.mimetype == 'multipart/form-data':
+                upload = request.files.get('file')
+                if not upload:
+                    return {'message': 'A file is required'}, 400
+                filename, stream = upload.filename or 'upload.csv', upload.stream
+            else:
+                filename, stream = 'upload.csv', request.stream
+            file_format = request.args.get('format') or (
+                'parquet' if filename.lower().endswith('.parquet') or 'parquet' in request.mimetype else 'csv')
+
+            # Uploaded files are closed with the request, before the response is streamed
+            spool = tempfile.TemporaryFile()
+            shutil.copyfileobj(stream, spool)
+            spool.seek(0)
+
+            executor = get_executor(current_app.config)
+
+            def predict(chunk):
+                # A long upload waits for pool capacity instead of failing halfway through the response
+                deadline = time.monotonic() + executor.timeout
+                while True:
+                    try:
+                        return executor.predict_many('editing', chunk, coerce=True)
+                    except InferenceBusy:
+                        if time.monotonic() > deadline:
+                            raise
+                        time.sleep(0.05)
+
+            # The first chunk is scored before answering, so that bad files are rejected with a status code
+            try:
+                chunks = iter(read_table_chunks(spool, file_format))
+                first = next(chunks, None)
+                if first is None or first.empty:
+                    spool.close()
+                    return {'message': 'The file has no rows'}, 400
+                first['Prediction'] = executor.predict_many('editing', first, coerce=True)
+            except InferenceBusy as e:
+                spool.close()
+                return {'message': 'Prediction service is busy, try again later', 'error': str(e)}, 503, {'Retry-After': '1'}
+            except Exception as e:
+                spool.close()
+                return {'message': f'Invalid {file_format} file: {str(e)}'}, 400
+
+            def generate():
+                rows = len(first)
+                try:
+                    yield first.to_csv(index=False)
+                    for chunk in chunks:
+                        chunk['Prediction'] = predict(chunk)
+                        rows += len(chunk)
+                        yield chunk.to_csv(index=False, header=False)
+                except Exception as e:
+                    current_app.logger.error(f"Bulk prediction error: {str(e)}")
+                    yield f"# Scoring failed after {rows} rows: {str(e)}\n"
+                finally:
+                    spool.close()
+
+            name = os.path.splitext(os.path.basename(filename))[0] or 'upload'
+            return Response(stream_with_context(generate()), mimetype='text/csv',
+                            headers={'Content-Disposition': f'attachment; filename="{name}_scored.csv"'})
+
+    class _Stats(Resource):
+        @token_required()
+        def get(self):
+            """
+            Throughput and latency counters of the batched predictors in this web worker process.
+            """
+            return jsonify(get_executor(current_app.config).stats())
+
+api.add_resource(EditingAPI._Predict, '/editing')
+api.add_resource(EditingAPI._Bulk, '/editing/bulk')
+api.add_resource(EditingAPI._Stats, '/editing/stats')
\ No newline at end of file
@@ -0,0 +1,134 @@
+import time
+from flask import Blueprint, request, jsonify, current_app, g, Response, stream_with_context
+from flask_restful import Api, Resource
+from api.jwt_authorize import token_required
+from model.jobs import Job, KINDS, PRIORITIES, FINISHED, JobLimit, submit, cancel
+from __init__ import db
+
+jobs_api = Blueprint('jobs_api', __name__, url_prefix='/api')
+api = Api(jobs_api)
+
+# Seconds a results request with follow=1 waits for new results, below the gunicorn worker timeout; the client
+# then asks again from the offset it reached
+FOLLOW_SECONDS = 20
+
+
+def _own_job(job_id):
+    # The job if the current user may see it (its owner or an admin), else None
+    job = db.session.get(Job, job_id)
+    if job is None or (job.uid != g.current_user.uid and g.current_user.role != 'Admin'):
+        return None
+    return job
+
+
+class JobsAPI:
+    class _Jobs(Resource):
+        @token_required()
+        def post(self):
+            """
+            Submit an analysis job.  Answers 202 with the job, poll /api/jobs/<id> for its state.
+
+            Query parameters: 'kind' (mutations: a FASTA/FASTQ file whose first record is the reference;
+            editing: a CSV or Parquet export of screens), 'priority' (low, normal or high; high is for admins)
+            and for editing 'format' (csv or parquet).  The input is the raw body or a multipart 'file' field.
+            """
+            kind = request.args.get('kind')
+            if kind not in KINDS:
+                return {'message': f"Unknown job kind '{kind}', choose from {sorted(KINDS)}"}, 400
+            priority = request.args.get('priority', 'normal')
+            if priority not in PRIORITIES:
+                return {'message': f"Unknown priority '{priority}', choose from {list(PRIORITIES)}"}, 400
+            if priority == 'high' and g.current_user.role != 'Admin':
+                return {'message': 'Only admins may submit high priority jobs'}, 403
+            options = {}
+            if kind == 'editing':
+                options['format'] = request.args.get('format', 'csv')
+                if options['format'] not in ('csv', 'parquet'):
+                    return {'message': 'Format must be csv or parquet'}, 400
+
+            # The input is copied to the job's directory as it arrives, it is not held in memory
+            request.max_content_length = max(current_app.config['SEQUENCE_STREAM_MAX_LENGTH'],
+                                             current_app.config['BULK_UPLOAD_MAX_LENGTH'])
+            stream = request.files['file'].stream if 'file' in request.files else request.stream
+            try:
+                job = submit(g.current_user.uid, kind, stream, PRIORITIES[priority], options)
+            except JobLimit as e:
+                return {'message': str(e)}, 429, {'Retry-After': '60'}
+            return job.read(), 202, {'Location': f'/api/jobs/{job.id}'}
+
+        @token_required()
+        def get(self):
+            """
+            The current user's jobs, newest first.
+            """
+            jobs = Job.query.filter_by(uid=g.current_user.uid).order_by(Job.id.desc()).limit(50).all()
+            return jsonify([job.read() for job in jobs])
+
+    class _Job(Resource):
+        @token_required()
+        def get(self, job_id):
+            """
+            The state of a job: status, progress, queue position and size of the results so far.
+            """
+            job = _own_job(job_id)
+            if job is None:
+                return {'message': 'Job not found'}, 404
+            return jsonify(job.read())
+
+        @token_required()
+        def delete(self, job_id):
+            """
+            Cancel a job.  A queued job is cancelled at once, a running one stops at its next checkpoint;
+            the results written until then stay readable.
+            """
+            job = _own_job(job_id)
+            if job is None:
+                return {'message': 'Job not found'}, 404
+            if not cancel(job):
+                return {'message': f'Job already {job.status}'}, 409
+            return {'message': 'Job cancelled' if job.status == 'cancelled' else 'Cancellation requested',
+                    'job': job.read()}, 202
+
+    class _Results(Resource):
+        @token_required()
+        def get(self, job_id):
+            """
+            The results of a job from byte 'offset' on (default 0), also while it runs.
+
+            Without 'follow' the results written so far are returned at once; X-Result-Offset holds the
+            offset to ask for next.  With follow=1 the results are streamed as they are written, until the job
+            finishes or for FOLLOW_SECONDS; the client then continues from offset + the bytes it received.
+            """
+            job = _own_job(job_id)
+            if job is None:
+                return {'message': 'Job not found'}, 404
+            try:
+                offset = int(request.args.get('offset', 0))
+            except ValueError:
+                return {'message': 'Offset must be an integer'}, 400
+
+            if request.args.get('follow') not in ('1', 'true'):
+                data = job.read_results(offset)
+                return Response(data, content_type=job.content_type,
+                                headers={'X-Job-Status': job.status, 'X-Result-Offset': str(offset + len(data))})
+
+            def generate(offset):
+                deadline = time.monotonic() + FOLLOW_SECONDS
+                while True:
+                    finished = job.status in FINISHED
+                    data = job.read_results(offset)
+                    while data:
+                        yield data
+                        offset += len(data)
+                        data = job.read_results(offset)
+                    if finished or time.monotonic() > deadline:
+                        return
+                    time.sleep(0.5)
+                    db.session.refresh(job)
+
+            return Response(stream_with_context(generate(offset)), content_type=job.content_type,
+                            headers={'X-Job-Status': job.status})
+
+api.add_resource(JobsAPI._Jobs, '/jobs')
+api.add_resource(JobsAPI._Job, '/jobs/<int:job_id>')
+api.add_resource(JobsAPI._Results, '/jobs/<int:job_id>/results')
@@ -3,6 +3,7 @@ from flask import current_app, g
 from functools import wraps
 import jwt
 from model.user import User
+from model import principals, tokens
 
 def token_required(roles=None):
     """
@@ -11,7 +12,8 @@ def token_required(roles=None):
     This function performs the following steps:
     
     1. Checks for the presence of a valid JWT token in the request cookie.
-    2. Decodes the token and retrieves the user data.
+    2. Decodes the token and retrieves the user data, or takes both from the principal cache (see model/principals.py).
+       Tokens must carry an expiry and a jti, and must not have been revoked (see model/tokens.py).
     3. Checks if the user data is found in the database.
     4. Checks if the user has the required role.
     5. Sets the current_user in the global context (Flask's g object).
@@ -40,14 +42,22 @@ def token_required(roles=None):
                 }, 401
 
             try:
-                data = jwt.decode(token, current_app.config["SECRET_KEY"], algorithms=["HS256"])
-                current_user = User.query.filter_by(_uid=data["_uid"]).first()
-                if not current_user:
-                    return {
-                        "message": "User not found",
-                        "error": "Unauthorized",
-                        "data": data
-                    }, 401
+                # A token verified recently is answered from the principal cache, without HMAC check or query
+                cached = principals.cache.lookup(token)
+                if cached:
+                    data, current_user = cached
+                    # A revocation takes effect before the cache entry expires
+                    tokens.check(data)
+                else:
+                    data = tokens.decode(token)
+                    current_user = User.query.filter_by(_uid=data["_uid"]).first()
+                    if not current_user:
+                        return {
+                            "message": "User not found",
+                            "error": "Unauthorized",
+                            "data": data
+                        }, 401
+                    principals.cache.store(token, data, current_user)
 
                 if roles and current_user.role not in roles:
                     return {
@@ -58,11 +68,17 @@ def token_required(roles=None):
                     
                 # Authentication succes, set the current_user in the global context (Flask's g object)
                 g.current_user = current_user
+                g.token_claims = data
             except jwt.ExpiredSignatureError:
                 return {
                     "message": "Token has expired",
                     "error": "Unauthorized"
                 }, 401
+            except tokens.TokenRevoked:
+                return {
+                    "message": "Token has been revoked",
+                    "error": "Unauthorized"
+                }, 401
             except jwt.InvalidTokenError:
                 return {
                     "message": "Invalid token",
@@ -0,0 +1,18 @@
+from flask import Blueprint, Response
+from flask_restful import Api, Resource
+from model import telemetry
+
+metrics_api = Blueprint('metrics_api', __name__, url_prefix='/api')
+api = Api(metrics_api)
+
+class MetricsAPI:
+    class _ML(Resource):
+        # No login: scraped by Prometheus, which has no session cookie
+        def get(self):
+            """
+            Prediction latency histograms, unseen category counters and input sketches of this web worker
+            process, in the Prometheus text exposition format.
+            """
+            return Response(telemetry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+api.add_resource(MetricsAPI._ML, '/metrics/ml')
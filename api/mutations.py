@@ -1,7 +1,16 @@
-from flask import Blueprint, request, jsonify, current_app, g
+import functools
+import itertools
+import json
+from flask import Blueprint, request, jsonify, current_app, g, Response, stream_with_context
 from flask_restful import Api, Resource
 from api.jwt_authorize import token_required
-from model.mutations import predict_functionality
+from model.executor import get_executor, InferenceBusy
+from model.strand import StrandEditor
+from model.codons import classify
+from model.alignment import derive_edits
+from model.sequence import SequenceFeatures, check_options
+from model import telemetry
+from model.fasta import read_chunks, read_sequences, read_reference, read_form_sequences, compare_records, score_batches
 
 mutations_api = Blueprint('mutations_api', __name__, url_prefix='/api')
 api = Api(mutations_api)
@@ -14,102 +23,155 @@ class MutationsAPI:
             body = request.get_json()
             original_strand = body.get('original_strand')
             edits = body.get('edits')
+            target_strand = body.get('edited_strand')
 
-            if not original_strand or not isinstance(edits, list):
+            # Without an edit list, the edits are derived by aligning the original and edited strands
+            derived = edits is None and isinstance(target_strand, str) and bool(target_strand)
+            if not original_strand or not (isinstance(edits, list) or derived):
                 return {'message': 'Invalid input data provided'}, 400
 
+            reading_frame = body.get('reading_frame', 0)
+            if reading_frame not in (0, 1, 2):
+                return {'message': 'Reading frame must be 0, 1 or 2'}, 400
+
+            # Optional sequence features of the original strand, e.g. {"max_k": 3} or true for the defaults
+            sequence_features = body.get('sequence_features', False)
+            if sequence_features is True:
+                sequence_features = {}
+            if sequence_features is not False:
+                if not isinstance(sequence_features, dict):
+                    return {'message': 'sequence_features must be true or an object with max_k and motifs'}, 400
+                try:
+                    check_options(sequence_features.get('max_k', 4), sequence_features.get('motifs'))
+                except ValueError as e:
+                    return {'message': f'Invalid sequence_features: {e}'}, 400
+
             try:
-                strand_list = list(original_strand)
-                mutation_records = []
-                offset = 0
+                editor = StrandEditor(original_strand)
+            except ValueError as e:
+                return {'message': str(e)}, 400
+
+            if derived:
+                try:
+                    edits = derive_edits(original_strand, target_strand)
+                except ValueError as e:
+                    return {'message': str(e)}, 400
+
+            try:
+                applied_edits = []
 
                 for edit in edits:
+                    if not isinstance(edit, dict):
+                        return {'message': 'Invalid edit, expected an object'}, 400
                     m_type = edit.get('type')
-                    pos = edit.get('position')
-                    new_base = edit.get('new_base', None)
-
-                    if m_type == "substitution":
-                        if new_base not in ['A', 'T', 'C', 'G']:
-                            return {'message': 'Invalid base in substitution'}, 400
-                        ref_base = strand_list[pos + offset]
-                        strand_list[pos + offset] = new_base
-                        mutation_type = self.get_mutation_type(ref_base, new_base, m_type)
-                        mutation_records.append({
-                            'position': pos,
-                            'mutation_type': mutation_type,
-                            'Reference_Codon': ref_base,
-                            'Query_Codon': new_base
-                        })
-
-                    elif m_type == "insertion":
-                        if new_base not in ['A', 'T', 'C', 'G']:
-                            return {'message': 'Invalid base in insertion'}, 400
-                        strand_list.insert(pos + offset, new_base)
-                        mutation_type = self.get_mutation_type("-", new_base, m_type)
-                        mutation_records.append({
-                            'position': pos,
-                            'mutation_type': mutation_type,
-                            'Reference_Codon': "-",
-                            'Query_Codon': new_base
-                        })
-                        offset += 1
-
-                    elif m_type == "deletion":
-                        ref_base = strand_list[pos + offset]
-                        del strand_list[pos + offset]
-                        mutation_type = self.get_mutation_type(ref_base, "-", m_type)
-                        mutation_records.append({
-                            'position': pos,
-                            'mutation_type': mutation_type,
-                            'Reference_Codon': ref_base,
-                            'Query_Codon': "-"
-                        })
-                        offset -= 1
-
-                    else:
-                        return {'message': 'Invalid mutation type'}, 400
-
-                edited_strand = ''.join(strand_list)
-
-                predictions = []
-                for record in mutation_records:
-                    input_data = {
-                        'Reference_Codon': record['Reference_Codon'],
-                        'Query_Codon': record['Query_Codon'],
-                        'Mutation_Type': record['mutation_type']
-                    }
-                    impact = predict_functionality(input_data)
-                    predictions.append({
-                        'position': record['position'],
-                        'mutation_type': record['mutation_type'],
-                        'impact': impact
+                    try:
+                        applied = editor.apply(edit)
+                    except ValueError as e:
+                        return {'message': f'Invalid {m_type}: {str(e)}'}, 400
+                    applied_edits.append((m_type, applied))
+
+                edited_strand = editor.edited_strand()
+
+                # Classify all edits against their codons in one pass, then keep one record per edit
+                classified = classify(editor, reading_frame)
+                mutation_records = []
+                for m_type, applied in applied_edits:
+                    pos = applied['position']
+                    # A substituted base that was deleted later is reported with its deletion
+                    codon = classified.get((m_type, pos)) or classified[('deletion', pos)]
+                    mutation_records.append({
+                        'position': pos,
+                        'edited_position': applied['edited_position'],
+                        'mutation_type': codon['mutation_type'],
+                        'Reference_Codon': codon['Reference_Codon'],
+                        'Query_Codon': codon['Query_Codon']
                     })
 
-                return jsonify({
+                # Score every mutation record with a single batched model call in the inference pool
+                impacts = get_executor(current_app.config).predict_many('mutations', [{
+                    'Reference_Codon': record['Reference_Codon'],
+                    'Query_Codon': record['Query_Codon'],
+                    'Mutation_Type': record['mutation_type']
+                } for record in mutation_records])
+                predictions = [{
+                    'position': record['position'],
+                    'edited_position': record['edited_position'],
+                    'mutation_type': record['mutation_type'],
+                    'reference_codon': record['Reference_Codon'],
+                    'query_codon': record['Query_Codon'],
+                    'impact': impact
+                } for record, impact in zip(mutation_records, impacts)]
+
+                response = {
                     'message': 'DNA editing successful',
                     'original_strand': original_strand,
                     'edited_strand': edited_strand,
                     'predictions': predictions
-                })
+                }
+                if derived:
+                    response['edits'] = edits
+                if sequence_features is not False:
+                    # One encoding of the strand serves the strand features and the context of every mutation
+                    features = SequenceFeatures(original_strand)
+                    response['sequence_features'] = features.features(max_k=sequence_features.get('max_k', 4),
+                                                                      motifs=sequence_features.get('motifs'))
+                    for prediction in predictions:
+                        prediction['context'] = features.context(prediction['position'])
+                with telemetry.timer('mutations', 'serialize'):
+                    return jsonify(response)
 
+            except InferenceBusy as e:
+                return {'message': 'Prediction service is busy, try again later', 'error': str(e)}, 503, {'Retry-After': '1'}
             except Exception as e:
                 current_app.logger.error(f"DNA editing error: {str(e)}")
                 return {'message': 'DNA editing failed', 'error': str(e)}, 500
 
-        def get_mutation_type(self, reference_base, query_base, edit_type):
-            if edit_type == "substitution":
-                if reference_base == query_base:
-                    return 'Silent Substitution'
-                elif query_base in ['TAA', 'TAG', 'TGA']:
-                    return 'Nonsense Substitution'
-                elif reference_base in ['TAA', 'TAG', 'TGA'] and query_base not in ['TAA', 'TAG', 'TGA']:
-                    return 'Read-through Substitution'
+    class _Stream(Resource):
+        @token_required()
+        def post(self):
+            """
+            Analyze FASTA/FASTQ uploads as they stream in, answering with NDJSON.
+
+            The body is either a FASTA/FASTQ stream whose first record is the reference and whose other
+            records are queries, or a multipart form with a 'reference' file followed by a 'query' file.  The
+            reference is read first; each query record is then aligned against it as it arrives (see
+            model/fasta.py) and every mutation is emitted as one JSON line with its impact, followed by a
+            summary line per record.
+            """
+            # Sequences are streamed, not buffered, so a larger body than the default limit is allowed
+            request.max_content_length = current_app.config['SEQUENCE_STREAM_MAX_LENGTH']
+
+            try:
+                if request.mimetype == 'multipart/form-data':
+                    # The form is parsed from the raw body as it arrives, not through request.files, which
+                    # would read the whole upload before the first line is sent
+                    boundary = request.mimetype_params.get('boundary')
+                    if not boundary:
+                        return {'message': 'Multipart boundary is missing'}, 400
+                    name, reference, query_chunks = read_form_sequences(read_chunks(request.stream), boundary)
+                    query_events = read_sequences(query_chunks)
                 else:
-                    return 'Missense Substitution'
-            elif edit_type == "insertion":
-                return 'In-Frame Insertion'
-            elif edit_type == "deletion":
-                return 'In-Frame Deletion'
-            return 'Missense Substitution'
-
-api.add_resource(MutationsAPI._EditDNA, '/mutations')
\ No newline at end of file
+                    events = read_sequences(read_chunks(request.stream))
+                    name, reference, next_header = read_reference(events)
+                    query_events = itertools.chain([('header', next_header)], events) if next_header else iter(())
+            except ValueError as e:
+                return {'message': f'Invalid sequence data: {str(e)}'}, 400
+
+            if not reference:
+                return {'message': 'Reference sequence is missing'}, 400
+
+            predict = functools.partial(get_executor(current_app.config).predict_many, 'mutations')
+
+            def generate():
+                yield json.dumps({'reference': name, 'length': len(reference)}) + '\n'
+                try:
+                    for record in score_batches(compare_records(query_events, reference), predict=predict):
+                        yield json.dumps(record) + '\n'
+                except Exception as e:
+                    current_app.logger.error(f"Sequence stream error: {str(e)}")
+                    yield json.dumps({'message': 'Sequence analysis failed', 'error': str(e)}) + '\n'
+
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+api.add_resource(MutationsAPI._EditDNA, '/mutations')
+api.add_resource(MutationsAPI._Stream, '/mutations/stream')
\ No newline at end of file
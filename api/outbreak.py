@@ -1,11 +1,42 @@
-from flask import Blueprint, request, jsonify, current_app, g
+import io
+import json
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from flask import Blueprint, request, jsonify, current_app, g, Response
 from flask_restful import Api, Resource
-# from api.jwt_authorize import token_required  # Uncomment if you need authentication
-from model.outbreak import predict_risk
+from api.jwt_authorize import token_required
+from model.executor import get_executor, InferenceBusy
+from model.outbreak import append_rows, schedule_update, update_status
+from model.forecast import get_store, MAX_HORIZON
+from model import registry, telemetry
 
 outbreak_api = Blueprint('outbreak_api', __name__, url_prefix='/api')
 api = Api(outbreak_api)
 
+# Serialized forecast responses by ETag, so repeated dashboard loads skip the slicing and the JSON encoding
+FORECAST_CACHE_SIZE = 256
+_forecast_cache = OrderedDict()
+_forecast_cache_lock = threading.Lock()
+
+def _json_column(values):
+    # NumPy column -> JSON list, NaN as null
+    if values.dtype.kind == 'M':
+        return [str(value) for value in values]
+    if values.dtype.kind == 'f':
+        return [None if value != value else value for value in values.tolist()]
+    return values.tolist()
+
+def _parse_date(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return np.datetime64(value, 'D')
+    except ValueError:
+        raise ValueError(f"Invalid {name} date '{value}', expected YYYY-MM-DD")
+
 class OutbreakAPI:
     class _Predict(Resource):
         # @token_required()  # Optional if using JWT
@@ -29,11 +60,115 @@ class OutbreakAPI:
                     'total_distributed': distributed
                 }
 
-                prediction = predict_risk(input_data)
-                return jsonify({'message': 'Prediction successful', 'risk': prediction})
+                # Single predictions are coalesced with concurrent ones into one batch in the inference pool
+                prediction = get_executor(current_app.config).predict('outbreak', input_data)
+                with telemetry.timer('outbreak', 'serialize'):
+                    return jsonify({'message': 'Prediction successful', 'risk': prediction})
+
+            except InferenceBusy as e:
+                return {'message': 'Prediction service is busy, try again later', 'error': str(e)}, 503, {'Retry-After': '1'}
 
             except Exception as e:
                 current_app.logger.error(f"[OutbreakAPI] Prediction error: {str(e)}")
                 return {'message': 'Prediction failed', 'error': str(e)}, 500
 
-api.add_resource(OutbreakAPI._Predict, '/predict')
\ No newline at end of file
+    class _Data(Resource):
+        @token_required("Admin")
+        def post(self):
+            """
+            Append daily vaccination rows and retrain the risk model in the background.
+
+            The body is a CSV upload (text/csv) or JSON {'rows': [...]}, each row with total_vaccinations,
+            total_distributed, people_vaccinated and daily_vaccinations (date and location are kept when given).
+            The updated model is published without a restart; workers switch to it on their next model check.
+            """
+            try:
+                if request.mimetype == 'text/csv':
+                    rows = pd.read_csv(io.BytesIO(request.get_data()))
+                else:
+                    body = request.get_json(silent=True) or {}
+                    if not isinstance(body.get('rows'), list) or not body['rows']:
+                        return {'message': 'Expected a non-empty list of rows'}, 400
+                    rows = pd.DataFrame(body['rows'])
+                appended = append_rows(rows)
+            except ValueError as e:
+                return {'message': f'Invalid vaccination data: {str(e)}'}, 400
+
+            schedule_update()
+            return {'message': 'Data appended, model update scheduled', 'rows': appended}, 202
+
+    class _Model(Resource):
+        @token_required()
+        def get(self):
+            """
+            Current outbreak model version and the state of the background update in this process.
+            """
+            try:
+                artifact = registry.load('outbreak')
+            except FileNotFoundError as e:
+                return {'message': str(e)}, 404
+            return jsonify({
+                'version': artifact.version,
+                'trees': len(artifact.estimator.estimators_),
+                'appended_rows': artifact.extras.get('appended_rows'),
+                'updates': artifact.extras.get('updates'),
+                'update': update_status,
+            })
+
+    class _Forecast(Resource):
+        def get(self):
+            """
+            Vaccination rate and risk trajectory of a state, with 7, 14 and 30 day rolling windows.
+
+            Query parameters: state (required, without it the known states are listed), start and end
+            (YYYY-MM-DD, inclusive) and horizon (days to project the vaccination rate trend, 0 to MAX_HORIZON).
+            Responses carry an ETag that only changes with the state's data; If-None-Match gets a 304.
+            """
+            try:
+                store = get_store()
+            except Exception as e:
+                current_app.logger.error(f"[OutbreakAPI] Forecast store error: {str(e)}")
+                return {'message': 'Vaccination data is not available', 'error': str(e)}, 404
+
+            state = request.args.get('state')
+            if not state:
+                return jsonify({'states': sorted(store.states)})
+            try:
+                start, end = _parse_date('start'), _parse_date('end')
+                horizon = int(request.args.get('horizon') or 0)
+            except ValueError as e:
+                return {'message': str(e)}, 400
+            if not 0 <= horizon <= MAX_HORIZON:
+                return {'message': f'horizon must be between 0 and {MAX_HORIZON} days'}, 400
+
+            etag = store.etag(state, str(start), str(end), horizon)
+            if etag is None:
+                return {'message': f"Unknown state '{state}'"}, 404
+            if etag in request.if_none_match:
+                response = Response(status=304)
+            else:
+                with _forecast_cache_lock:
+                    body = _forecast_cache.get(etag)
+                    if body is not None:
+                        _forecast_cache.move_to_end(etag)
+                if body is None:
+                    window = store.query(state, start, end, horizon)
+                    forecast = window.pop('forecast')
+                    body = json.dumps({
+                        'state': state,
+                        'series': {name: _json_column(values) for name, values in window.items()},
+                        'forecast': {name: _json_column(values) for name, values in forecast.items()},
+                    })
+                    with _forecast_cache_lock:
+                        _forecast_cache[etag] = body
+                        while len(_forecast_cache) > FORECAST_CACHE_SIZE:
+                            _forecast_cache.popitem(last=False)
+                response = Response(body, mimetype='application/json')
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'  # browsers keep it but revalidate every time
+            return response
+
+api.add_resource(OutbreakAPI._Predict, '/predict')
+api.add_resource(OutbreakAPI._Data, '/outbreak/data')
+api.add_resource(OutbreakAPI._Model, '/outbreak/model')
+api.add_resource(OutbreakAPI._Forecast, '/outbreak/forecast')
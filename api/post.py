@@ -1,5 +1,6 @@
+import json
 import jwt
-from flask import Blueprint, request, jsonify, current_app, Response, g
+from flask import Blueprint, request, jsonify, current_app, Response, g, stream_with_context
 from flask_restful import Api, Resource  # used for REST API building
 from datetime import datetime
 from __init__ import app
@@ -137,30 +138,26 @@ class PostAPI:
             return jsonify(json_ready)
 
     class _BULK_CRUD(Resource):
+        @token_required()
         def post(self):
             """
-            Handle bulk post creation by sending POST requests to the single post endpoint.
+            Handle bulk post creation in one pass (see Post.bulk_loader and model/bulk.py).
+            Rows that cannot be created are reported by index in 'errors'.  With stream=1 the progress is
+            streamed as NDJSON, one line after every chunk, the last one with the errors.
             """
             posts = request.get_json()
 
             if not isinstance(posts, list):
                 return {'message': 'Expected a list of post data'}, 400
 
-            results = {'errors': [], 'success_count': 0, 'error_count': 0}
-
-            with current_app.test_client() as client:
-                for post in posts:
-                    # Simulate a POST request to the single post creation endpoint
-                    response = client.post('/api/post', json=post)
-
-                    if response.status_code == 200:
-                        results['success_count'] += 1
-                    else:
-                        results['errors'].append(response.get_json())
-                        results['error_count'] += 1
+            loader = Post.bulk_loader(g.current_user.id)
+            if request.args.get('stream') in ('1', 'true'):
+                progress = loader.load(posts)
+                return Response(stream_with_context(json.dumps(line) + '\n' for line in progress),
+                                mimetype='application/x-ndjson')
 
             # Return the results of the bulk creation process
-            return jsonify(results)
+            return jsonify(loader.run(posts))
         
         def get(self):
             """
@@ -0,0 +1,32 @@
+from flask import Blueprint, request, jsonify
+from flask_restful import Api, Resource
+from api.jwt_authorize import token_required
+from model.sequence import SequenceFeatures, check_options
+
+sequence_api = Blueprint('sequence_api', __name__, url_prefix='/api')
+api = Api(sequence_api)
+
+class SequenceAPI:
+    class _Features(Resource):
+        @token_required()
+        def post(self):
+            """
+            Sequence-level features of a DNA strand: GC content, k-mer spectra, CpG islands and motif hits.
+
+            The body holds 'strand', optionally 'max_k' (spectra for k = 1..max_k, default 4) and 'motifs',
+            an object of name -> IUPAC motif replacing the default PAM and promoter motifs.
+            """
+            body = request.get_json(silent=True) or {}
+            strand = body.get('strand')
+            if not isinstance(strand, str) or not strand:
+                return {'message': 'A non-empty strand is required'}, 400
+            max_k = body.get('max_k', 4)
+            motifs = body.get('motifs')
+
+            try:
+                check_options(max_k, motifs)
+                return jsonify(SequenceFeatures(strand).features(max_k=max_k, motifs=motifs))
+            except ValueError as e:
+                return {'message': str(e)}, 400
+
+api.add_resource(SequenceAPI._Features, '/sequence/features')
@@ -0,0 +1,50 @@
+from flask import Blueprint, jsonify
+from flask_restful import Api, Resource
+from api.jwt_authorize import token_required
+from model import registry, shadow
+
+shadow_api = Blueprint('shadow_api', __name__, url_prefix='/api')
+api = Api(shadow_api)
+
+class ShadowAPI:
+    class _Shadow(Resource):
+        @token_required()
+        def get(self, name):
+            """
+            Shadow evaluation of the model's candidate: agreement with the served predictions, confusion counts
+            and latency of both artifacts.
+            """
+            if name not in shadow.MODELS:
+                return {'message': f"Model '{name}' has no shadow mode, choose from {sorted(shadow.MODELS)}"}, 404
+            stats = shadow.stats(name)
+            if stats is None:
+                return {'message': f"Model '{name}' has no candidate, build one with train_model.py --candidate {name}"}, 404
+            return jsonify(stats)
+
+    class _Candidate(Resource):
+        @token_required("Admin")
+        def delete(self, name):
+            """
+            Discard the model's candidate, ending its shadow evaluation.
+            """
+            if name not in shadow.MODELS or not registry.discard_candidate(name):
+                return {'message': f"Model '{name}' has no candidate"}, 404
+            return {'message': f"Candidate of model '{name}' discarded"}, 200
+
+    class _Promote(Resource):
+        @token_required("Admin")
+        def post(self, name):
+            """
+            Make the model's candidate its live version.  Workers switch on their next model check.
+            """
+            if name not in shadow.MODELS:
+                return {'message': f"Model '{name}' has no shadow mode, choose from {sorted(shadow.MODELS)}"}, 404
+            try:
+                version = registry.promote(name)
+            except FileNotFoundError as e:
+                return {'message': str(e)}, 404
+            return {'message': f"Model '{name}' promoted", 'version': version}, 200
+
+api.add_resource(ShadowAPI._Shadow, '/models/<string:name>/shadow')
+api.add_resource(ShadowAPI._Candidate, '/models/<string:name>/candidate')
+api.add_resource(ShadowAPI._Promote, '/models/<string:name>/promote')
@@ -1,10 +1,7 @@
 ## Python Titanic Sample API endpoint
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_restful import Api, Resource # used for REST API building
-from model.titanic import TitanicModel # Import the TitanicModel class from the model file
-
-# Import the TitanicModel class from the model file
-# from model.titanic import TitanicModel
+from model.executor import get_executor, InferenceBusy
 
 titanic_api = Blueprint('titanic_api', __name__,
                    url_prefix='/api')
@@ -21,16 +18,30 @@ class TitanicAPI:
             1. which can handle much larger amounts of data and data types, than URL parameters
             2. using an HTTPS request, the data is encrypted, making it more secure
             3. a JSON formated body is easy to read and write between JavaScript and Python, great for Postman testing
+
+            The body is one passenger, or a list of passengers that are scored in one batch.
             """     
             # Get the passenger data from the request
-            passenger = request.get_json()
+            passengers = request.get_json(silent=True)
+            if not isinstance(passengers, (dict, list)) or not passengers:
+                return {'message': 'Expected a passenger or a list of passengers'}, 400
 
-            # Get the singleton instance of the TitanicModel
-            titanicModel = TitanicModel.get_instance()
-            # Predict the survival probability of the passenger
-            response = titanicModel.predict(passenger)
+            try:
+                executor = get_executor(current_app.config)
+                if isinstance(passengers, list):
+                    # Predict all passengers with one predict_proba call
+                    response = executor.predict_many('titanic', passengers)
+                else:
+                    # Predict the survival probability of the passenger, coalesced with concurrent requests
+                    passenger = {key: value[0] if isinstance(value, list) else value for key, value in passengers.items()}
+                    response = executor.predict('titanic', passenger)
+            except InferenceBusy as e:
+                return {'message': 'Prediction service is busy, try again later', 'error': str(e)}, 503, {'Retry-After': '1'}
+            except ValueError as e:
+                return {'message': 'Invalid passenger data', 'error': str(e)}, 400
 
             # Return the response as JSON
             return jsonify(response)
 
-    api.add_resource(_Predict, '/predict')
\ No newline at end of file
+    # /api/predict is the outbreak model's endpoint
+    api.add_resource(_Predict, '/titanic/predict')
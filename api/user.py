@@ -1,10 +1,10 @@
 import jwt
 from flask import Blueprint, request, jsonify, current_app, Response, g
 from flask_restful import Api, Resource  # used for REST API building
-from datetime import datetime
-from __init__ import app
+from __init__ import app, db
 from api.jwt_authorize import token_required
 from model.user import User
+from model import passwords, tokens
 
 # Create a Blueprint for the user API
 user_api = Blueprint('user_api', __name__, url_prefix='/api')
@@ -13,6 +13,49 @@ user_api = Blueprint('user_api', __name__, url_prefix='/api')
 # API docs: https://flask-restful.readthedocs.io/en/latest/api.html
 api = Api(user_api)
 
+def set_token_cookies(resp, uid):
+    """
+    Sets the access and refresh token cookies of a user on a response.
+
+    Args:
+        resp (Response): The response.
+        uid (str): The uid of the user.
+    """
+    access_token, _ = tokens.issue(uid, 'access')
+    refresh_token, _ = tokens.issue(uid, 'refresh')
+    resp.set_cookie(
+        current_app.config["JWT_TOKEN_NAME"],
+        access_token,
+        max_age=current_app.config["JWT_ACCESS_TTL"],
+        secure=True,
+        httponly=True,
+        path='/',
+        samesite='None'  # This is the key part for cross-site requests
+    )
+    # The refresh token is only sent to the authentication endpoints
+    resp.set_cookie(
+        current_app.config["JWT_REFRESH_TOKEN_NAME"],
+        refresh_token,
+        max_age=current_app.config["JWT_REFRESH_TTL"],
+        secure=True,
+        httponly=True,
+        path='/api/authenticate',
+        samesite='None'
+    )
+
+
+def clear_token_cookies(resp):
+    """
+    Expires the access and refresh token cookies on a response.
+
+    Args:
+        resp (Response): The response.
+    """
+    for name, path in ((current_app.config["JWT_TOKEN_NAME"], '/'),
+                       (current_app.config["JWT_REFRESH_TOKEN_NAME"], '/api/authenticate')):
+        resp.set_cookie(name, '', max_age=0, secure=True, httponly=True, path=path, samesite='None')
+
+
 class UserAPI:
     """
     Define the API endpoints for the User model.
@@ -24,29 +67,17 @@ class UserAPI:
 
         def post(self):
             """
-            Handle bulk user creation by sending POST requests to the single user endpoint.
+            Handle bulk user creation, e.g. of a class roster, in one pass (see User.bulk_create).
+            Every user gets the default password; rows that cannot be created are reported by index in 'errors'.
             """
             users = request.get_json()
 
             if not isinstance(users, list):
                 return {'message': 'Expected a list of user data'}, 400
 
-            results = {'errors': [], 'success_count': 0, 'error_count': 0}
-
-            with current_app.test_client() as client:
-                for user in users:
-                    # Set a default password as we don't have it for bulk creation
-                    user["password"] = app.config['DEFAULT_PASSWORD']
-
-                    # Simulate a POST request to the single user creation endpoint
-                    response = client.post('/api/user', json=user)
-
-                    if response.status_code == 200:
-                        results['success_count'] += 1
-                    else:
-                        results['errors'].append(response.get_json())
-                        results['error_count'] += 1
-
+            # Set a default password as we don't have it for bulk creation
+            rows = [{**user, 'password': app.config['DEFAULT_PASSWORD']} if isinstance(user, dict) else user for user in users]
+            results = User.bulk_create(rows)
             return jsonify(results)
         
         @token_required()
@@ -177,26 +208,24 @@ class UserAPI:
                 # Find user
                 user = User.query.filter_by(_uid=uid).first()
 
-                if user is None or not user.is_password(password):
+                matches, rehashed = user.verify_password(password) if user else (False, None)
+                if not matches:
                     return {'message': "Invalid user id or password"}, 401
-
-                # Generate token
-                token = jwt.encode(
-                    {"_uid": user._uid},
-                    current_app.config["SECRET_KEY"],
-                    algorithm="HS256"
-                )
+                if rehashed:
+                    # Hashed with a former method: store it with the current one, a failure only postpones the upgrade
+                    user.set_password_hash(rehashed)
+                    try:
+                        db.session.commit()
+                    except Exception as e:
+                        db.session.rollback()
+                        current_app.logger.warning(f"Could not upgrade the password hash of {user._uid}: {e}")
+
+                # Generate a short-lived access token and a refresh token to renew it
                 resp = Response(f"Authentication for {user._uid} successful")
-                resp.set_cookie(
-                    current_app.config["JWT_TOKEN_NAME"],
-                    token,
-                    max_age=3600,
-                    secure=True,
-                    httponly=True,
-                    path='/',
-                    samesite='None'  # This is the key part for cross-site requests
-                )
+                set_token_cookies(resp, user._uid)
                 return resp
+            except passwords.HashingBusy as e:
+                return {'message': str(e)}, 503, {'Retry-After': '1'}
             except Exception as e:
                 return {
                     "error": "Something went wrong",
@@ -206,34 +235,56 @@ class UserAPI:
         @token_required()
         def delete(self):
             """
-            Invalidate the current user's token by setting its expiry to 0.
+            Log out: revoke the current access token and the refresh token on the server, then clear both cookies.
             """
-            current_user = g.current_user
             try:
-                # Generate a token with practically 0 age
-                token = jwt.encode(
-                    {"_uid": current_user._uid, "exp": datetime.utcnow()},
-                    current_app.config["SECRET_KEY"],
-                    algorithm="HS256"
-                )
+                tokens.revoke(g.token_claims)
+                refresh_token = request.cookies.get(current_app.config["JWT_REFRESH_TOKEN_NAME"])
+                if refresh_token:
+                    try:
+                        tokens.revoke(tokens.decode(refresh_token, kind='refresh'))
+                    except jwt.InvalidTokenError:
+                        pass  # expired or already revoked
 
                 # Prepare a response indicating the token has been invalidated
                 resp = Response("Token invalidated successfully")
-                resp.set_cookie(
-                    current_app.config["JWT_TOKEN_NAME"],
-                    token,
-                    max_age=0,  # Immediately expire the cookie
-                    secure=True,
-                    httponly=True,
-                    path='/',
-                    samesite='None'
-                )
+                clear_token_cookies(resp)
                 return resp
             except Exception as e:
                 return {
                     "message": "Failed to invalidate token",
                     "error": str(e)
                 }, 500
+
+    class _Refresh(Resource):
+        """
+        Renew the access token with the refresh token cookie.
+        """
+
+        def post(self):
+            """
+            Trade the refresh token for a new access token and refresh token.  The refresh token is revoked,
+            so each one can be used only once.
+            """
+            refresh_token = request.cookies.get(current_app.config["JWT_REFRESH_TOKEN_NAME"])
+            if not refresh_token:
+                return {"message": "Refresh token is missing", "error": "Unauthorized"}, 401
+            try:
+                claims = tokens.decode(refresh_token, kind='refresh')
+            except jwt.ExpiredSignatureError:
+                return {"message": "Refresh token has expired", "error": "Unauthorized"}, 401
+            except jwt.InvalidTokenError as e:
+                return {"message": f"Invalid refresh token: {str(e)}", "error": "Unauthorized"}, 401
+
+            user = User.query.filter_by(_uid=claims["_uid"]).first()
+            if user is None:
+                return {"message": "User not found", "error": "Unauthorized"}, 401
+            # Refused unless this request revoked the token, so a replayed or concurrent refresh gets nothing
+            if not tokens.revoke(claims):
+                return {"message": "Refresh token has been revoked", "error": "Unauthorized"}, 401
+            resp = Response(f"Token for {user._uid} refreshed")
+            set_token_cookies(resp, user._uid)
+            return resp
     class _ID(Resource):  # Individual identification API operation
         @token_required()
         def get(self):
@@ -246,4 +297,5 @@ class UserAPI:
 api.add_resource(UserAPI._ID, '/id')
 api.add_resource(UserAPI._BULK_CRUD, '/users')
 api.add_resource(UserAPI._CRUD, '/user')
-api.add_resource(UserAPI._Security, '/authenticate')
\ No newline at end of file
+api.add_resource(UserAPI._Security, '/authenticate')
+api.add_resource(UserAPI._Refresh, '/authenticate/refresh')
\ No newline at end of file
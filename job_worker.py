@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+""" job_worker.py
+Runs the analysis jobs submitted to /api/jobs, see model/jobs.py.
+- Starts JOB_WORKERS worker processes (default 2), separate from the web workers.
+- Each process claims queued jobs from the database, runs them and writes their results to instance/jobs/.
+- Ctrl-C or SIGTERM stops the workers once their current jobs are done; a second one stops them at once.
+
+Usage: Run from the root of the project:
+> python job_worker.py                  # JOB_WORKERS processes
+> python job_worker.py --processes 4    # 4 processes
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import sys
+
+# Add the project root to the Python path
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+
+def _work(stop):
+    # Interrupts are handled by the parent, which sets stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    from model import jobs
+    jobs.work(stop=stop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the analysis job workers')
+    parser.add_argument('--processes', type=int, default=int(os.environ.get('JOB_WORKERS') or 2),
+                        help='worker processes (default JOB_WORKERS or 2)')
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    stop = context.Event()
+    workers = [context.Process(target=_work, args=(stop,), name=f'job-worker-{i}') for i in range(args.processes)]
+
+    def shutdown(signum, frame):
+        if stop.is_set():
+            for worker in workers:
+                worker.terminate()
+        else:
+            print("Stopping job workers after their current jobs, interrupt again to stop at once")
+            stop.set()
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+    for worker in workers:
+        worker.start()
+    print(f"Started {len(workers)} job workers")
+    for worker in workers:
+        worker.join()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,6 +10,11 @@ from flask import current_app
 from werkzeug.security import generate_password_hash
 import shutil
 from api.outbreak import outbreak_api
+from api.metrics import metrics_api
+from api.shadow import shadow_api
+from api.sequence import sequence_api
+from api.crispr import crispr_api
+from api.jobs import jobs_api
 
 
 # import "objects" from "this" project
@@ -26,7 +31,7 @@ from api.nestPost import nestPost_api # Justin added this, custom format for his
 from api.messages_api import messages_api # Adi added this, messages for his website
 from api.carphoto import car_api
 from api.carChat import car_chat_api
-# from api.titanic import titanic_api
+from api.titanic import titanic_api
 from api.points import points_api
 from api.editing import editing_api
 from api.mutations import mutations_api
@@ -43,8 +48,8 @@ from model.nestPost import NestPost, initNestPosts # Justin added this, custom f
 from model.vote import Vote, initVotes
 from model.titanic import TitanicModel, initTitanic
 from model.points import Points, initPoints
-from model.editing import model
-from model.mutations import model
+from model.jobs import initJobs
+from model import registry
 # server only Views
 
 # register URIs for api endpoints
@@ -61,11 +66,16 @@ app.register_blueprint(nestPost_api)
 app.register_blueprint(nestImg_api)
 app.register_blueprint(vote_api)
 app.register_blueprint(car_api)
-# app.register_blueprint(titanic_api)
+app.register_blueprint(titanic_api)
 app.register_blueprint(points_api)
 app.register_blueprint(editing_api)
 app.register_blueprint(mutations_api)
 app.register_blueprint(outbreak_api, url_prefix='/api')
+app.register_blueprint(metrics_api)
+app.register_blueprint(shadow_api)
+app.register_blueprint(sequence_api)
+app.register_blueprint(crispr_api)
+app.register_blueprint(jobs_api)
 
 # Tell Flask-Login the view function name of your login route
 login_manager.login_view = "login"
@@ -174,6 +184,7 @@ def generate_data():
     initPosts()
     initNestPosts()
     initVotes()
+    initJobs()
     
 # Backup the old database
 def backup_database(db_uri, backup_uri):
@@ -196,8 +207,6 @@ def extract_data():
         data['points'] = [points.read() for points in Points.query.all()]
         data['channels'] = [channel.read() for channel in Channel.query.all()]
         data['posts'] = [post.read() for post in Post.query.all()]
-        data['editing'] = [editing.read() for editing in model.query.all()]
-        data['mutations'] = [mutations.read() for mutations in model.query.all()]
     return data
 
 # Save extracted data to JSON files
@@ -223,8 +232,6 @@ def restore_data(data):
         users = User.restore(data['users'])
         _ = Section.restore(data['sections'])
         _ = Points.restore(data['points'])
-        _ = model.restore(data['editing'])
-        _ = model.restore(data['mutations'])
         _ = Group.restore(data['groups'], users)
         _ = Channel.restore(data['channels'])
         _ = Post.restore(data['posts'])
@@ -243,6 +250,16 @@ def restore_data_command():
     data = load_data_from_json()
     restore_data(data)
     
+# Define a command to train the ML models and save their artifacts (same as train_model.py)
+@custom_cli.command('train_models')
+def train_models():
+    for name in registry.registered():
+        try:
+            artifact = registry.build(name)
+            print(f"Model '{name}' saved as version {artifact.version}")
+        except FileNotFoundError as e:
+            print(f"Skipped model '{name}': {e}")
+    
 # Register the custom command group with the Flask application
 app.cli.add_command(custom_cli)
 
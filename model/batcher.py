@@ -0,0 +1,169 @@
+# batcher.py
+import collections
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+"""
+Dynamic Batcher
+
+Collects items submitted concurrently by many request threads and hands them to a batch function as one
+list, so that a model runs one predict() over a matrix of inputs instead of one predict() per request.
+
+A batch is sent when max_batch_size items are waiting, or when the oldest waiting item has waited
+max_wait seconds, whichever comes first.  Under light load a request therefore pays at most max_wait of
+extra latency; under heavy load batches fill up immediately and the per-request model overhead
+(DataFrame construction, encoder lookups, the estimator's per-call setup) is shared by the whole batch.
+"""
+
+# Number of recent latencies kept for the percentiles in stats()
+LATENCY_SAMPLES = 2048
+
+
+class DynamicBatcher:
+    """
+    DynamicBatcher
+
+    Attributes:
+        run_batch (function): Called with a list of items, returns a Future of one (ok, value) outcome per item.
+        max_batch_size (int): Maximum number of items per batch.
+        max_wait (float): Seconds the oldest item waits for a batch to fill up.
+        max_queue (int): Maximum number of waiting items, further submits raise queue.Full.
+        max_in_flight (int): Maximum number of batches running at once; while they are all busy new items keep
+            collecting, so batches grow with the load instead of queueing up as many small ones.
+    """
+
+    def __init__(self, run_batch, max_batch_size=64, max_wait=0.002, max_queue=None, max_in_flight=1):
+        """
+        Constructor, 1st step in object creation.
+
+        Args:
+            run_batch (function): Called with a list of items, returns a Future of one (ok, value) outcome per item.
+            max_batch_size (int, optional): Maximum number of items per batch.
+            max_wait (float, optional): Seconds the oldest item waits for a batch to fill up.
+            max_queue (int, optional): Maximum number of waiting items, defaults to 8 batches.
+            max_in_flight (int, optional): Maximum number of batches running at once.
+        """
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self.max_queue = max_queue or 8 * self.max_batch_size
+        self.max_in_flight = max(1, max_in_flight)
+        self._in_flight = threading.Semaphore(self.max_in_flight)
+        self._waiting = collections.deque()  # (item, Future, submit time)
+        self._condition = threading.Condition()
+        self._thread = None
+
+        # Counters, updated under the condition lock
+        self._started = time.monotonic()
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._batches = 0
+        self._batched = 0
+        self._latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+
+    def submit(self, item):
+        """
+        Queues one item for the next batch.
+
+        Args:
+            item (object): The input item.
+
+        Returns:
+            Future: Resolves to the item's result, or raises the item's error.
+
+        Raises:
+            queue.Full: max_queue items are already waiting.
+        """
+        future = Future()
+        with self._condition:
+            if len(self._waiting) >= self.max_queue:
+                raise queue.Full(f"{len(self._waiting)} items waiting for a batch")
+            self._waiting.append((item, future, time.monotonic()))
+            self._submitted += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._dispatch_loop, name='dynamic-batcher', daemon=True)
+                self._thread.start()
+            if len(self._waiting) == 1 or len(self._waiting) >= self.max_batch_size:
+                self._condition.notify()
+        return future
+
+    def _next_batch(self):
+        with self._condition:
+            while not self._waiting:
+                self._condition.wait()
+            deadline = self._waiting[0][2] + self.max_wait
+            while len(self._waiting) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            size = min(len(self._waiting), self.max_batch_size)
+            self._batches += 1
+            self._batched += size
+            return [self._waiting.popleft() for _ in range(size)]
+
+    def _dispatch_loop(self):
+        while True:
+            self._in_flight.acquire()
+            batch = self._next_batch()
+            try:
+                done = self.run_batch([item for item, _, _ in batch])
+            except Exception as e:
+                self._in_flight.release()
+                self._deliver(batch, [(False, e)] * len(batch))
+                continue
+            done.add_done_callback(lambda done, batch=batch: self._collect(batch, done))
+
+    def _collect(self, batch, done):
+        self._in_flight.release()
+        try:
+            outcomes = done.result()
+        except Exception as e:
+            outcomes = [(False, e)] * len(batch)
+        self._deliver(batch, outcomes)
+
+    def _deliver(self, batch, outcomes):
+        # Scatter the outcomes back to the waiting callers
+        now = time.monotonic()
+        with self._condition:
+            for (_, _, submitted), (ok, _) in zip(batch, outcomes):
+                self._latencies.append(now - submitted)
+                if ok:
+                    self._completed += 1
+                else:
+                    self._failed += 1
+        for (_, future, _), (ok, value) in zip(batch, outcomes):
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Throughput and latency counters since the batcher was created.
+        """
+        with self._condition:
+            latencies = sorted(self._latencies)
+            elapsed = time.monotonic() - self._started
+            finished = self._completed + self._failed
+
+            def percentile(p):
+                return round(1000 * latencies[min(int(p * len(latencies)), len(latencies) - 1)], 3) if latencies else None
+
+            return {
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'failed': self._failed,
+                'waiting': len(self._waiting),
+                'batches': self._batches,
+                'mean_batch_size': round(self._batched / self._batches, 2) if self._batches else None,
+                'throughput_per_second': round(finished / elapsed, 2) if elapsed > 0 else None,
+                'latency_ms': {'p50': percentile(0.5), 'p95': percentile(0.95), 'p99': percentile(0.99),
+                               'max': round(1000 * latencies[-1], 3) if latencies else None},
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000,
+            }
@@ -0,0 +1,220 @@
+# bulk.py
+import collections
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+from __init__ import db
+
+"""
+Bulk Loader
+
+Creates many rows of a model in one pass, for the bulk endpoints (/api/users, /api/channels, /api/posts) and
+for seeding, instead of one request, one query per foreign key and one commit per row:
+
+    - Every row is validated before anything is written; invalid rows are reported by their index.
+    - Foreign keys given by name (a channel's group_name, a post's channel_name) or by id are resolved or
+      checked with one IN query per reference, LOOKUP_CHUNK_SIZE values at a time.
+    - The rows are inserted with executemany, CHUNK_SIZE rows per transaction.  When a chunk fails, it is
+      inserted again row by row, each in a savepoint, so one bad row does not abort the others.
+    - BulkLoader.load() yields the progress after every chunk, which the endpoints can stream as NDJSON.
+"""
+
+CHUNK_SIZE = 1000
+LOOKUP_CHUNK_SIZE = 500
+
+# A foreign key given in the rows as 'field', found in column 'key' of model, stored in attribute 'column'
+Reference = collections.namedtuple('Reference', ['field', 'model', 'key', 'column'])
+
+
+def coerce(column, value):
+    """
+    Converts a value given in a row to the Python type of a column, e.g. the id "7" to 7, as the single item
+    endpoints accept it.
+
+    Args:
+        column (InstrumentedAttribute): The column, e.g. Group.id.
+        value: The value.
+
+    Returns:
+        The converted value, or None when it cannot be one of the column's.
+    """
+    if isinstance(value, bool) or not isinstance(value, (str, int)):
+        return None
+    python_type = column.type.python_type
+    if isinstance(value, python_type):
+        return value
+    try:
+        return python_type(value.strip() if isinstance(value, str) else value)
+    except (TypeError, ValueError):
+        return None
+
+
+def lookup(column, values):
+    """
+    Finds the ids of the rows whose column has one of the values.
+
+    Args:
+        column (InstrumentedAttribute): The column to match, e.g. Group._name.
+        values (iterable): The values to look for.
+
+    Returns:
+        dict: value -> id, for the values found; for duplicate values the lowest id, as .first() would give.
+    """
+    model = column.class_
+    values = list(set(values))
+    ids = {}
+    for start in range(0, len(values), LOOKUP_CHUNK_SIZE):
+        query = db.session.query(column, model.id).filter(column.in_(values[start:start + LOOKUP_CHUNK_SIZE]))
+        for value, id in query.order_by(model.id.desc()):
+            ids[value] = id
+    return ids
+
+
+def insert_chunks(model, mappings, chunk_size=CHUNK_SIZE):
+    """
+    Inserts rows chunk_size at a time, one transaction per chunk.
+
+    Args:
+        model (db.Model): The model.
+        mappings (list): Dictionaries of attribute -> value.
+        chunk_size (int, optional): Rows per transaction.
+
+    Yields:
+        tuple: (rows inserted, [(position in mappings, error message), ...]) for every chunk.
+    """
+    for start in range(0, len(mappings), chunk_size):
+        chunk = mappings[start:start + chunk_size]
+        try:
+            db.session.execute(insert(model), chunk)
+            db.session.commit()
+            yield len(chunk), []
+            continue
+        except SQLAlchemyError:
+            db.session.rollback()
+        # Row by row, so that only the rows at fault are left out
+        inserted, failed = 0, []
+        for offset, mapping in enumerate(chunk):
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(insert(model), [mapping])
+                inserted += 1
+            except SQLAlchemyError as e:
+                failed.append((start + offset, str(getattr(e, 'orig', None) or e).splitlines()[0]))
+        db.session.commit()
+        yield inserted, failed
+
+
+class BulkLoader:
+    """
+    BulkLoader
+
+    Attributes:
+        model (db.Model): The model rows are created for.
+        fields (dict): Row field -> model attribute, for the fields copied as they are.
+        required (list): Fields every row must have, a tuple of fields meaning one of them.
+        references (list): Reference tuples for the foreign keys.
+        defaults (dict): Model attribute -> value, for attributes no field sets.
+        chunk_size (int): Rows per transaction.
+    """
+
+    def __init__(self, model, fields, required=(), references=(), defaults=None, chunk_size=CHUNK_SIZE):
+        """
+        Constructor, 1st step in object creation.
+
+        Args:
+            model (db.Model): The model.
+            fields (dict): Row field -> model attribute.
+            required (list, optional): Required fields.
+            references (list, optional): Reference tuples.
+            defaults (dict, optional): Model attribute -> default value.
+            chunk_size (int, optional): Rows per transaction.
+        """
+        self.model = model
+        self.fields = fields
+        self.required = required
+        self.references = references
+        self.defaults = defaults or {}
+        self.chunk_size = chunk_size
+
+    def _missing(self, row):
+        # The first required field (or set of alternatives) the row lacks, None if it has them all
+        for required in self.required:
+            alternatives = required if isinstance(required, tuple) else (required,)
+            if all(row.get(field) in (None, '') for field in alternatives):
+                return ' or '.join(alternatives)
+        return None
+
+    def load(self, rows):
+        """
+        Creates the rows.
+
+        Args:
+            rows (list): Dictionaries of field -> value.
+
+        Yields:
+            dict: The progress after validation and after every chunk: 'total', 'processed', 'success_count' and
+                'error_count'.  The last one also holds 'errors', a list of {'index', 'message'} in row order.
+        """
+        errors = []
+        valid = []  # (index, row)
+        for index, row in enumerate(rows):
+            if not isinstance(row, dict):
+                errors.append({'index': index, 'message': 'Expected an object'})
+                continue
+            missing = self._missing(row)
+            if missing:
+                errors.append({'index': index, 'message': f'{missing} is required'})
+            else:
+                valid.append((index, row))
+
+        # One query per foreign key for all rows
+        resolved = {}
+        for reference in self.references:
+            column = getattr(reference.model, reference.key)
+            values = [coerce(column, row.get(reference.field)) for _, row in valid]
+            values = [value for value in values if value is not None]
+            resolved[reference.field] = lookup(column, values) if values else {}
+
+        mappings, indexes = [], []
+        for index, row in valid:
+            mapping = dict(self.defaults)
+            mapping.update({attribute: row[field] for field, attribute in self.fields.items() if row.get(field) is not None})
+            for reference in self.references:
+                value = row.get(reference.field)
+                if value is None or reference.column in mapping:
+                    continue  # not given, or set by an earlier reference, e.g. an id before a name
+                key = coerce(getattr(reference.model, reference.key), value)
+                id = resolved[reference.field].get(key) if key is not None else None
+                if id is None:
+                    errors.append({'index': index, 'message': f"{reference.model.__name__} {value!r} not found"})
+                    break
+                mapping[reference.column] = id
+            else:
+                mappings.append(mapping)
+                indexes.append(index)
+
+        progress = {'total': len(rows), 'processed': len(rows) - len(mappings),
+                    'success_count': 0, 'error_count': len(errors)}
+        yield dict(progress)
+        for inserted, failed in insert_chunks(self.model, mappings, self.chunk_size):
+            errors.extend({'index': indexes[position], 'message': message} for position, message in failed)
+            progress['processed'] += inserted + len(failed)
+            progress['success_count'] += inserted
+            progress['error_count'] += len(failed)
+            yield dict(progress)
+
+        errors.sort(key=lambda error: error['index'])
+        yield {**progress, 'errors': errors}
+
+    def run(self, rows):
+        """
+        Creates the rows.
+
+        Args:
+            rows (list): Dictionaries of field -> value.
+
+        Returns:
+            dict: The final progress of load(), with the errors.
+        """
+        for progress in self.load(rows):
+            pass
+        return progress
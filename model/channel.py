@@ -3,6 +3,7 @@ from sqlite3 import IntegrityError
 from sqlalchemy import Text, JSON
 from __init__ import app, db
 from model.group import Group
+from model.bulk import BulkLoader, Reference
 
 class Channel(db.Model):
     """
@@ -118,6 +119,23 @@ class Channel(db.Model):
             return None
         return self
         
+    @staticmethod
+    def bulk_loader():
+        """
+        The loader for /api/channels and seeding, see model/bulk.py.
+
+        Returns:
+            BulkLoader: Creates channels from rows with 'name', 'group_id' or 'group_name', and 'attributes'.
+        """
+        return BulkLoader(
+            Channel,
+            fields={'name': '_name', 'attributes': '_attributes'},
+            required=['name', ('group_id', 'group_name')],
+            references=[Reference('group_id', Group, 'id', '_group_id'),
+                        Reference('group_name', Group, '_name', '_group_id')],
+            defaults={'_attributes': {}},
+        )
+
     @staticmethod
     def restore(data):
         channels = {}
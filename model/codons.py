@@ -0,0 +1,176 @@
+# codons.py
+import numpy as np
+
+"""
+Codon-aware mutation classification
+
+Works out the codon(s) an edit touches from the reading frame of the original strand, translates the
+reference and query codons through a precomputed genetic code table and labels the mutation the same
+way dna_mutations.csv does: Silent / Missense / Nonsense / Read-through Substitution, In-Frame or
+Frame-Shift Insertion / Deletion.  The codon strings it produces (e.g. 'TCC' -> '---' for a deleted
+codon, '-CA' -> 'GCA' for a single base insertion) are the features the mutations model is trained on.
+
+Edits are classified independently against the reference frame, the usual convention for variant
+annotation, so a substitution downstream of a frameshift is still reported in its reference codon.
+"""
+
+# Standard genetic code (NCBI table 1) with bases in TCAG order, '*' marks a stop codon
+STANDARD_CODE_TCAG = 'FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG'
+
+# Base digits used for codon indexes, index = 16 * b1 + 4 * b2 + b3 with A=0, C=1, G=2, T=3
+BASE_DIGITS = np.full(256, -1, dtype=np.int64)
+for digit, base in enumerate(b'ACGT'):
+    BASE_DIGITS[base] = digit
+
+# 64 entry genetic code indexed by codon index, plus a 65th entry 'X' for codons that cannot be translated
+GENETIC_CODE = np.full(65, ord('X'), dtype=np.uint8)
+for i, b1 in enumerate('TCAG'):
+    for j, b2 in enumerate('TCAG'):
+        for k, b3 in enumerate('TCAG'):
+            index = 16 * 'ACGT'.index(b1) + 4 * 'ACGT'.index(b2) + 'ACGT'.index(b3)
+            GENETIC_CODE[index] = ord(STANDARD_CODE_TCAG[16 * i + 4 * j + k])
+UNKNOWN_CODON = 64
+STOP = ord('*')
+
+
+def codon_indexes(codons):
+    """
+    Converts 3 letter codons to indexes into GENETIC_CODE.
+
+    Args:
+        codons (bytes): Concatenated codons, 3 bytes each.
+
+    Returns:
+        numpy.ndarray: One index per codon, UNKNOWN_CODON for codons containing anything but A, C, G, T.
+    """
+    digits = BASE_DIGITS[np.frombuffer(bytes(codons), dtype=np.uint8)].reshape(-1, 3)
+    index = digits @ np.array([16, 4, 1], dtype=np.int64)
+    return np.where((digits >= 0).all(axis=1), index, UNKNOWN_CODON)
+
+
+def translate(codons):
+    """
+    Args:
+        codons (bytes): Concatenated codons, 3 bytes each.
+
+    Returns:
+        str: The amino acid sequence, '*' for stop codons and 'X' for untranslatable codons.
+    """
+    return GENETIC_CODE[codon_indexes(codons)].tobytes().decode('ascii')
+
+
+def classify_substitutions(reference, query):
+    """
+    Labels substituted codons by comparing their translations, vectorized over all codons.
+
+    Args:
+        reference (bytes): Concatenated reference codons.
+        query (bytes): Concatenated query codons, same length as reference.
+
+    Returns:
+        list: One mutation type per codon.
+    """
+    ref_aa = GENETIC_CODE[codon_indexes(reference)]
+    query_aa = GENETIC_CODE[codon_indexes(query)]
+    labels = np.select(
+        [ref_aa == query_aa, query_aa == STOP, ref_aa == STOP],
+        ['Silent Substitution', 'Nonsense Substitution', 'Read-through Substitution'],
+        default='Missense Substitution',
+    )
+    # Untranslatable codons (N bases, end of strand) translate to 'X' on both sides, only silent if unchanged
+    changed = (np.frombuffer(bytes(reference), dtype=np.uint8).reshape(-1, 3) !=
+               np.frombuffer(bytes(query), dtype=np.uint8).reshape(-1, 3)).any(axis=1)
+    labels[(ref_aa == ord('X')) & (query_aa == ord('X')) & changed] = 'Missense Substitution'
+    return labels.tolist()
+
+
+def _codon_bases(editor, start, deleted=False):
+    # The 3 original bases of the codon at start, '-' padded past the end of the strand
+    codon = bytearray(editor.original[max(start, 0):start + 3])
+    if start < 0:
+        codon = bytearray(b'-' * -start) + codon
+    codon += b'-' * (3 - len(codon))
+    if deleted:
+        for i in range(3):
+            if start + i in editor.deleted:
+                codon[i] = ord('-')
+    return codon
+
+
+def classify(editor, frame=0):
+    """
+    Classifies every edit held by a StrandEditor in one pass over its edited positions.
+
+    Args:
+        editor (StrandEditor): The editor holding the applied edits.
+        frame (int, optional): Offset of the first codon in the original strand (0, 1 or 2). Defaults to 0.
+
+    Returns:
+        dict: Keyed by ('substitution' | 'insertion' | 'deletion', original position), each value a dict with
+            'mutation_type', 'Reference_Codon' and 'Query_Codon'.
+    """
+    results = {}
+
+    # Substitutions: one query codon per touched codon, all codons translated and labelled at once
+    codon_starts = sorted({frame + 3 * ((pos - frame) // 3) for pos in editor.substitutions})
+    reference = bytearray()
+    query = bytearray()
+    for start in codon_starts:
+        codon = _codon_bases(editor, start)
+        reference += codon
+        for i in range(3):
+            base = editor.substitutions.get(start + i)
+            if base:
+                codon[i] = ord(base)
+        query += codon
+    labels = classify_substitutions(reference, query) if codon_starts else []
+    codons = {}
+    for n, start in enumerate(codon_starts):
+        codons[start] = {
+            'mutation_type': labels[n],
+            'Reference_Codon': reference[3 * n:3 * n + 3].decode('ascii'),
+            'Query_Codon': query[3 * n:3 * n + 3].decode('ascii'),
+        }
+    for pos in editor.substitutions:
+        results[('substitution', pos)] = codons[frame + 3 * ((pos - frame) // 3)]
+
+    # Indels: adjacent insertions/deletions form one event whose net length decides the frame
+    positions = sorted(set(editor.insertions) | editor.deleted)
+    clusters = []
+    for pos in positions:
+        if clusters and pos == clusters[-1][-1] + 1 and clusters[-1][-1] in editor.deleted:
+            clusters[-1].append(pos)
+        else:
+            clusters.append([pos])
+
+    for cluster in clusters:
+        inserted = sum(len(editor.insertions.get(pos, b'')) for pos in cluster)
+        deleted = sum(1 for pos in cluster if pos in editor.deleted)
+        net = inserted - deleted
+        kind = 'Insertion' if net > 0 or (net == 0 and inserted) else 'Deletion'
+        mutation_type = f"{'Frame-Shift' if net % 3 else 'In-Frame'} {kind}"
+
+        first = cluster[0]
+        start = frame + 3 * ((first - frame) // 3)
+        if first in editor.insertions:
+            # Inserted bases shown in their codon window, '-' marks them in the reference
+            bases = bytes(editor.insertions[first])
+            before = bytes(_codon_bases(editor, start)[:first - start])
+            after = bytes(editor.original[first:first + 3])
+            ref_codon = (before + b'-' * len(bases) + after)[:3]
+            query_codon = (before + bases + after)[:3]
+        else:
+            ref_codon = bytes(_codon_bases(editor, start))
+            query_codon = bytes(_codon_bases(editor, start, deleted=True))
+        record = {
+            'mutation_type': mutation_type,
+            'Reference_Codon': ref_codon.ljust(3, b'-').decode('ascii'),
+            'Query_Codon': query_codon.ljust(3, b'-').decode('ascii'),
+        }
+        for pos in cluster:
+            if pos in editor.insertions:
+                results[('insertion', pos)] = record
+            if pos in editor.deleted:
+                results[('deletion', pos)] = record
+
+    return results
@@ -0,0 +1,334 @@
+# crispr.py
+import collections
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import numpy as np
+from model.sequence import IUPAC, encode_bytes, reverse_complement
+
+"""
+CRISPR Target Site Index
+
+Finds the sites of a reference sequence that a guide RNA can target: a protospacer within k mismatches of
+the guide, directly followed by a PAM (e.g. NGG for SpCas9), on either strand.
+
+A reference is indexed once, when it is uploaded, with a suffix array truncated to SEED_LENGTH bases: every
+position of the reference sorted by the SEED_LENGTH bases that start there, packed 3 bits per base into one
+uint64 key.  Any substring of up to SEED_LENGTH bases is then found with two binary searches on the sorted
+keys, without scanning the reference.  Mismatches are handled by the pigeonhole principle: a guide split
+into k + 1 seeds matches every site with at most k mismatches exactly in at least one seed, so the seeds are
+looked up in the index and only their hits are compared against the whole guide and the PAM.
+
+The encoded reference, the suffix array and its keys are saved as .npy files under the user's upload dir
+and memory-mapped on load, so an index is built once and every worker process shares its pages:
+
+    <directory>/<version>/reference.npy   uint8 base codes, see model.sequence.encode_bytes()
+    <directory>/<version>/suffixes.npy    int32 positions sorted by their first SEED_LENGTH bases
+    <directory>/<version>/keys.npy        uint64 packed bases of every sorted position
+    <directory>/current.json              manifest naming the version in use
+"""
+
+# Bases per suffix array key: 3 bits per base in a uint64 (0 pads past the end, A=1, C=2, G=3, T=4, unknown 5)
+SEED_LENGTH = 21
+
+# Largest reference indexed, in bases; the index takes 13 bytes per base on disk
+MAX_REFERENCE_LENGTH = int(os.environ.get('CRISPR_MAX_REFERENCE_LENGTH') or 20_000_000)
+
+# Guide lengths and mismatches allowed, more mismatches make seeds too short to be selective
+MIN_GUIDE_LENGTH = 15
+MAX_GUIDE_LENGTH = 30
+MAX_MISMATCHES = 4
+
+# Sites listed per search, the counts are always complete
+MAX_SITES = 1000
+
+# Loaded indexes kept per process
+CACHE_SIZE = 8
+
+_BASES = np.array(list('ACGTN'))
+
+
+def _keys(codes):
+    # Packs the SEED_LENGTH bases starting at every position, the first base in the highest bits
+    keys = np.zeros(len(codes), dtype=np.uint64)
+    symbols = codes.astype(np.uint64) + np.uint64(1)
+    for offset in range(SEED_LENGTH):
+        keys <<= np.uint64(3)
+        if offset < len(codes):
+            keys[:len(codes) - offset] |= symbols[offset:]
+    return keys
+
+
+def _seed_range(seed):
+    # Smallest and largest key of the positions starting with the seed's bases
+    key = 0
+    for code in seed:
+        key = (key << 3) | (int(code) + 1)
+    padding = 3 * (SEED_LENGTH - len(seed))
+    return np.uint64(key << padding), np.uint64((key << padding) | ((1 << padding) - 1))
+
+
+def _pam_table(pam):
+    # (PAM position, base code) -> whether the base is allowed there, unknown bases never are
+    table = np.zeros((len(pam), 5), dtype=bool)
+    for i, base in enumerate(pam):
+        table[i, ['ACGT'.index(b) for b in IUPAC[base]]] = True
+    return table
+
+
+def _write_json(path, data):
+    """Writes JSON to a temporary file and renames it over path, so readers never see a partial file."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class GuideIndex:
+    """
+    GuideIndex
+
+    Attributes:
+        name (str): Name of the reference, e.g. its FASTA header.
+        version (str): Digest of the reference sequence.
+        codes (numpy.ndarray): The encoded reference, memory-mapped.
+        suffixes (numpy.ndarray): Positions sorted by their first SEED_LENGTH bases, memory-mapped.
+        keys (numpy.ndarray): Packed bases of the sorted positions, memory-mapped.
+    """
+
+    def __init__(self, name, version, codes, suffixes, keys):
+        """
+        Constructor, 1st step in object creation.
+
+        Args:
+            name (str): Name of the reference.
+            version (str): Digest of the reference sequence.
+            codes (numpy.ndarray): The encoded reference.
+            suffixes (numpy.ndarray): The truncated suffix array.
+            keys (numpy.ndarray): The sorted keys of the suffix array.
+        """
+        self.name = name
+        self.version = version
+        self.codes = codes
+        self.suffixes = suffixes
+        self.keys = keys
+
+    @property
+    def length(self):
+        return len(self.codes)
+
+    def describe(self):
+        """
+        Returns:
+            dict: Name, version and length of the indexed reference.
+        """
+        return {'name': self.name, 'version': self.version, 'length': self.length}
+
+    def occurrences(self, seed):
+        """
+        Args:
+            seed (numpy.ndarray): Base codes of up to SEED_LENGTH bases, no unknown bases.
+
+        Returns:
+            numpy.ndarray: Unsorted start positions of the exact occurrences of the seed.
+        """
+        low, high = _seed_range(seed)
+        start = np.searchsorted(self.keys, low, side='left')
+        end = np.searchsorted(self.keys, high, side='right')
+        return np.asarray(self.suffixes[start:end], dtype=np.int64)
+
+    def _strand_sites(self, protospacer, pam, protospacer_offset, max_mismatches):
+        # Sites of one strand's pattern: the protospacer at protospacer_offset, the PAM around it
+        pattern_length = len(protospacer) + len(pam)
+        pam_offset = len(protospacer) if protospacer_offset == 0 else 0
+
+        # k + 1 seeds, one of them matches every site exactly; seeds longer than a key are cut to one
+        bounds = np.linspace(0, len(protospacer), max_mismatches + 2).astype(int)
+        candidates = [self.occurrences(protospacer[start:min(end, start + SEED_LENGTH)])
+                      - (protospacer_offset + start) for start, end in zip(bounds[:-1], bounds[1:])]
+        starts = np.unique(np.concatenate(candidates))
+        starts = starts[(starts >= 0) & (starts <= self.length - pattern_length)]
+
+        windows = self.codes[starts[:, None] + np.arange(pattern_length)]
+        proto_windows = windows[:, protospacer_offset:protospacer_offset + len(protospacer)]
+        mismatches = np.count_nonzero(proto_windows != protospacer, axis=1)
+        pam_windows = windows[:, pam_offset:pam_offset + len(pam)]
+        pam_ok = _pam_table(pam)[np.arange(len(pam)), pam_windows].all(axis=1)
+        keep = pam_ok & (mismatches <= max_mismatches)
+        return starts[keep], mismatches[keep], windows[keep]
+
+    def search(self, guide, pam='NGG', max_mismatches=3):
+        """
+        Finds the target sites of a guide: protospacers within max_mismatches of the guide followed by the PAM,
+        on both strands.
+
+        Args:
+            guide (str): The guide (protospacer) sequence, 5' to 3', A/C/G/T only.
+            pam (str, optional): The PAM as IUPAC codes, 3' of the protospacer.
+            max_mismatches (int, optional): Mismatches allowed between guide and protospacer, 0 to MAX_MISMATCHES.
+
+        Returns:
+            dict: The guide, PAM, on_target (perfect matches) and off_targets counts, counts per number of
+                mismatches and up to MAX_SITES sites {position, strand, mismatches, protospacer, pam}, best first.
+                Positions are 0-based starts of the site (protospacer and PAM) on the forward strand.
+
+        Raises:
+            ValueError: Invalid guide, PAM or number of mismatches.
+        """
+        guide, pam = guide.upper(), pam.upper()
+        if not MIN_GUIDE_LENGTH <= len(guide) <= MAX_GUIDE_LENGTH or set(guide) - set('ACGT'):
+            raise ValueError(f"Guide must be {MIN_GUIDE_LENGTH} to {MAX_GUIDE_LENGTH} bases of A, C, G and T")
+        if not pam or set(pam) - set(IUPAC):
+            raise ValueError(f"Invalid PAM '{pam}', use IUPAC codes")
+        if not isinstance(max_mismatches, int) or not 0 <= max_mismatches <= MAX_MISMATCHES:
+            raise ValueError(f"max_mismatches must be between 0 and {MAX_MISMATCHES}")
+
+        # The reverse strand is searched on the forward strand as the reverse complement of guide + PAM
+        reverse_guide = reverse_complement(guide)
+        strands = [
+            ('+', self._strand_sites(encode_bytes(guide.encode()), pam, 0, max_mismatches)),
+            ('-', self._strand_sites(encode_bytes(reverse_guide.encode()), reverse_complement(pam), len(pam),
+                                     max_mismatches)),
+        ]
+
+        sites = []
+        counts = np.zeros(max_mismatches + 1, dtype=np.int64)
+        for strand, (starts, mismatches, windows) in strands:
+            counts += np.bincount(mismatches, minlength=max_mismatches + 1)
+            order = np.lexsort((starts, mismatches))[:MAX_SITES]
+            for start, mismatch, window in zip(starts[order], mismatches[order], windows[order]):
+                site = _BASES[window]
+                if strand == '-':
+                    site = np.array(list(reverse_complement(''.join(site))))
+                sites.append({
+                    'position': int(start),
+                    'strand': strand,
+                    'mismatches': int(mismatch),
+                    'protospacer': ''.join(site[:len(guide)]),
+                    'pam': ''.join(site[len(guide):]),
+                })
+        sites.sort(key=lambda site: (site['mismatches'], site['position'], site['strand']))
+        return {
+            'reference': self.name,
+            'guide': guide,
+            'pam': pam,
+            'max_mismatches': max_mismatches,
+            'on_target': int(counts[0]),
+            'off_targets': int(counts[1:].sum()),
+            'counts': {str(k): int(count) for k, count in enumerate(counts)},
+            'sites': sites[:MAX_SITES],
+        }
+
+
+def build_index(directory, name, sequence):
+    """
+    Indexes a reference sequence and makes it the current index of the directory.  A reference that is
+    already indexed is not indexed again.
+
+    Args:
+        directory (str): The index directory, e.g. under the user's upload dir.
+        name (str): Name of the reference.
+        sequence (bytes): The reference bases, ASCII.
+
+    Returns:
+        GuideIndex: The index, memory-mapped.
+
+    Raises:
+        ValueError: The sequence is empty or longer than MAX_REFERENCE_LENGTH.
+    """
+    if not sequence:
+        raise ValueError('Reference sequence is empty')
+    if len(sequence) > MAX_REFERENCE_LENGTH:
+        raise ValueError(f"Reference is longer than {MAX_REFERENCE_LENGTH} bases")
+    version = hashlib.sha256(bytes(sequence)).hexdigest()[:16]
+    path = os.path.join(directory, version)
+    if not os.path.isdir(path):
+        codes = encode_bytes(bytes(sequence))
+        keys = _keys(codes)
+        suffixes = np.argsort(keys, kind='stable').astype(np.int32)
+        # Written to a temporary directory and renamed, so a reader never maps a partial index
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        os.makedirs(tmp_path, exist_ok=True)
+        np.save(os.path.join(tmp_path, 'reference.npy'), codes)
+        np.save(os.path.join(tmp_path, 'suffixes.npy'), suffixes)
+        np.save(os.path.join(tmp_path, 'keys.npy'), keys[suffixes])
+        try:
+            os.rename(tmp_path, path)
+        except OSError:  # built meanwhile by another worker
+            shutil.rmtree(tmp_path, ignore_errors=True)
+    _write_json(os.path.join(directory, 'current.json'),
+                {'name': name, 'version': version, 'length': len(sequence), 'built': time.time()})
+    _prune(directory, version)
+    return load_index(directory)
+
+
+def _prune(directory, version):
+    # Indexes of earlier references are deleted, workers that still map one keep it readable until they reload
+    for entry in os.listdir(directory):
+        path = os.path.join(directory, entry)
+        if entry != version and os.path.isdir(path) and not entry.endswith('.tmp'):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def delete_index(directory):
+    """
+    Args:
+        directory (str): The index directory.
+
+    Returns:
+        bool: Whether there was an index to delete.
+    """
+    if not os.path.exists(os.path.join(directory, 'current.json')):
+        return False
+    shutil.rmtree(directory, ignore_errors=True)
+    with _lock:
+        _cache.pop(directory, None)
+    return True
+
+
+# directory -> (manifest stat, GuideIndex), least recently used first
+_cache = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def load_index(directory):
+    """
+    Loads the current index of a directory, memory-mapped, reusing this process's copy while the manifest
+    is unchanged.
+
+    Args:
+        directory (str): The index directory.
+
+    Returns:
+        GuideIndex: The index, None if the directory has none.
+    """
+    manifest_path = os.path.join(directory, 'current.json')
+    try:
+        stat = os.stat(manifest_path)
+    except OSError:
+        return None
+    signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    with _lock:
+        cached = _cache.get(directory)
+        if cached and cached[0] == signature:
+            _cache.move_to_end(directory)
+            return cached[1]
+
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        path = os.path.join(directory, manifest['version'])
+        index = GuideIndex(manifest['name'], manifest['version'],
+                           *(np.load(os.path.join(path, f"{part}.npy"), mmap_mode='r')
+                             for part in ('reference', 'suffixes', 'keys')))
+    except (OSError, ValueError, KeyError):
+        return None
+    with _lock:
+        _cache[directory] = (signature, index)
+        _cache.move_to_end(directory)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return index
@@ -1,62 +1,175 @@
+import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.preprocessing import LabelEncoder
 import os
+from model import registry, telemetry
+from model.forest import CompiledForest, compiled_forest, COMPILED_MAX_ROWS
 
-# Load dataset
+# Dataset
 data_path = os.path.join(os.path.dirname(__file__), '..', 'gene_editing.csv')
-data = pd.read_csv(data_path)
 
-# Drop unnecessary columns if they exist
-data = data.drop(columns=['SequenceID', 'ScreenID', 'Replicate', 'Library', 'ModelConditionID'], errors='ignore')
+# Training: run by the registry build step (train_model.py), never at import time
+def train():
+    # Load dataset
+    data = pd.read_csv(data_path)
 
-# Drop missing
-data = data.dropna(subset=['PassesQC', 'ExcludeFromCRISPRCombined'])
+    # Drop unnecessary columns if they exist
+    data = data.drop(columns=['SequenceID', 'ScreenID', 'Replicate', 'Library', 'ModelConditionID'], errors='ignore')
 
-# Encode categorical columns
-label_encoders = {}
-categorical_columns = ['ScreenType', 'DrugTreated']
-for col in categorical_columns:
-    if col in data.columns:
+    # Drop missing
+    data = data.dropna(subset=['PassesQC', 'ExcludeFromCRISPRCombined'])
+
+    # Encode categorical columns
+    label_encoders = {}
+    categorical_columns = ['ScreenType', 'DrugTreated']
+    for col in categorical_columns:
+        if col in data.columns:
+            le = LabelEncoder()
+            data[col] = le.fit_transform(data[col])
+            label_encoders[col] = le
+
+    # Catch any object dtypes and encode
+    X = data.drop(columns=['PassesQC'])
+    for col in X.select_dtypes(include=['object']).columns:
         le = LabelEncoder()
         data[col] = le.fit_transform(data[col])
         label_encoders[col] = le
 
-# Catch any object dtypes and encode
-X = data.drop(columns=['PassesQC'])
-for col in X.select_dtypes(include=['object']).columns:
-    le = LabelEncoder()
-    data[col] = le.fit_transform(data[col])
-    label_encoders[col] = le
+    # Remove explicit encoding of target variable (PassesQC)
+    # Final feature/target split
+    X = data.drop(columns=['PassesQC'])
+    y = data['PassesQC']
+
+    # Train-test split
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+
+    # Train model
+    model = RandomForestClassifier(random_state=42, class_weight='balanced')
+    model.fit(X_train, y_train)
+
+    return {'estimator': model, 'encoders': label_encoders, 'features': list(X.columns),
+            'extras': {'forest': CompiledForest(model)}}
+
+registry.register('editing', [data_path], train)
+
+# Rows scored per estimator call by the bulk endpoint, bounds memory whatever the upload size
+BULK_CHUNK_SIZE = 10000
+
+# Label -> code of every encoder, per artifact version (the live one and a shadow candidate); missing values
+# (None/NaN) share one key
+_encoder_codes = {}
+
+def _missing(value):
+    return value is None or (isinstance(value, float) and value != value)
+
+def encoder_codes(artifact):
+    codes = _encoder_codes.get(artifact.version)
+    if codes is None:
+        codes = {col: {(None if _missing(label) else label): code for code, label in enumerate(le.classes_)}
+                 for col, le in artifact.encoders.items()}
+        while len(_encoder_codes) >= 2:
+            _encoder_codes.pop(next(iter(_encoder_codes)))
+        _encoder_codes[artifact.version] = codes
+    return codes
+
+def feature_matrix(artifact, records, coerce=False):
+    """
+    Encodes records into the float matrix the forest is trained on, without building a DataFrame for dicts.
+
+    Args:
+        artifact (Artifact): The editing artifact.
+        records (list or DataFrame): Input records, extra columns are ignored.
+        coerce (bool, optional): Turn unparseable numeric values into NaN instead of raising ValueError.
+
+    Returns:
+        numpy.ndarray: Shape (records, features), unseen labels encoded as -1.
+    """
+    frame = isinstance(records, pd.DataFrame)
+    present = set(records.columns) if frame else {key for record in records for key in record}
+    missing_cols = [col for col in artifact.features if col not in present]
+    if missing_cols:
+        raise ValueError(f"Missing columns in input data: {missing_cols}")
+
+    codes = encoder_codes(artifact)
+    X = np.empty((len(records), len(artifact.features)), dtype=np.float64)
+    for i, col in enumerate(artifact.features):
+        values = records[col] if frame else [record.get(col) for record in records]
+        if col in artifact.encoders:
+            if frame:
+                X[:, i] = pd.Index(artifact.encoders[col].classes_).get_indexer(values)
+            else:
+                mapping = codes[col]
+                X[:, i] = [mapping.get(None if _missing(value) else value, -1) for value in values]
+            continue
+        try:
+            if any(isinstance(value, str) for value in (values[:1] if frame else values)) and not coerce:
+                raise ValueError
+            X[:, i] = np.asarray(values, dtype=np.float64)
+        except (TypeError, ValueError):
+            if not coerce:
+                raise ValueError(f"Unexpected non-numeric column '{col}' in input data.")
+            X[:, i] = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+    return X
+
+# Drift telemetry: unseen labels of the encoded columns, value sketches of the numeric ones
+def observe_inputs(artifact, X):
+    numeric = [i for i, col in enumerate(artifact.features) if col not in artifact.encoders]
+    for i, col in enumerate(artifact.features):
+        if col in artifact.encoders:
+            telemetry.count_unseen('editing', col, X[:, i])
+    telemetry.sketch_inputs('editing', [artifact.features[i] for i in numeric], X[:, numeric])
+
+# Batch prediction: small batches are walked through the compiled forest, large ones through sklearn
+def predict_many(records, coerce=False, artifact=None):
+    """
+    Args:
+        records (list or DataFrame): Input records, extra columns are ignored.
+        coerce (bool, optional): Turn unparseable numeric values into NaN instead of raising ValueError.
+        artifact (Artifact, optional): The artifact to predict with, e.g. a shadow candidate; defaults to the live one.
+
+    Returns:
+        list: "Functional" or "Not Functional" per record.
+    """
+    if len(records) == 0:
+        return []
+    artifact = artifact or registry.load('editing')
+    with telemetry.timer('editing', 'encode'):
+        X = feature_matrix(artifact, records, coerce)
+    observe_inputs(artifact, X)
+    with telemetry.timer('editing', 'predict'):
+        if len(X) <= COMPILED_MAX_ROWS:
+            predictions = compiled_forest(artifact).predict(X)
+        else:
+            predictions = artifact.estimator.predict(pd.DataFrame(X, columns=artifact.features))
+    telemetry.count_predictions('editing', len(X))
+    return ["Functional" if prediction == 1 else "Not Functional" for prediction in predictions]
 
-# Remove explicit encoding of target variable (PassesQC)
-# Final feature/target split
-X = data.drop(columns=['PassesQC'])
-y = data['PassesQC']
+# Bulk scoring: uploads are read in chunks of rows so memory does not grow with the file
+def read_table_chunks(file, file_format='csv', chunk_size=BULK_CHUNK_SIZE):
+    """
+    Args:
+        file (file): A binary, seekable file holding the upload.
+        file_format (str, optional): 'csv' or 'parquet'.
+        chunk_size (int, optional): Rows per chunk.
 
-# Train-test split
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    Returns:
+        iterator: DataFrames of at most chunk_size rows.
 
-# Train model
-model = RandomForestClassifier(random_state=42, class_weight='balanced')
-model.fit(X_train, y_train)
+    Raises:
+        ValueError: The format is unknown, or Parquet support (pyarrow) is not installed.
+    """
+    if file_format == 'csv':
+        return pd.read_csv(file, chunksize=chunk_size)
+    if file_format == 'parquet':
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Parquet uploads require the pyarrow package")
+        return (batch.to_pandas() for batch in pq.ParquetFile(file).iter_batches(batch_size=chunk_size))
+    raise ValueError(f"Unsupported file format '{file_format}'")
 
 # Prediction interface
 def predict_functionality(input_data: dict):
-    input_df = pd.DataFrame([input_data])
-
-    # Apply all encoders
-    for col, le in label_encoders.items():
-        if col in input_df.columns:
-            try:
-                input_df[col] = le.transform(input_df[col])
-            except ValueError:
-                input_df[col] = input_df[col].apply(lambda x: -1 if x not in le.classes_ else le.transform([x])[0])
-
-    # Encode any remaining object columns
-    for col in input_df.select_dtypes(include=['object']).columns:
-        raise ValueError(f"Unexpected non-numeric column '{col}' in input data.")
-
-    prediction = model.predict(input_df)[0]
-    return "Functional" if prediction == 1 else "Not Functional"
\ No newline at end of file
+    return predict_many([input_data])[0]
@@ -0,0 +1,274 @@
+# executor.py
+import atexit
+import importlib
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+from model import registry, shadow, telemetry
+from model.batcher import DynamicBatcher
+
+"""
+Inference Executor
+
+Runs model predictions in a pool of worker processes instead of the request thread, so that a heavy
+prediction batch does not hold up a web worker for every other route (login, posts, ...).
+
+    - Every pool process imports the model modules and loads their artifacts once, when it starts.
+    - The number of batches waiting for or running in the pool is bounded; when the bound is reached,
+      new work is refused with InferenceBusy straight away (the APIs answer 503) instead of queueing.
+    - Concurrent single predictions for the same model are coalesced by a DynamicBatcher: they wait at most
+      INFERENCE_COALESCE_MS for others to arrive and are all sent to the pool as one batched call.
+
+Each model module provides predict_many(records) -> list, which is what runs in the pool.  The telemetry
+counters a batch records in a pool process are sent back with its result and merged into the web worker's.
+While a model has a candidate artifact, every finished batch is also copied to the shadow evaluator.
+"""
+
+# Registry name -> module with a predict_many(records) function
+MODELS = {
+    'mutations': 'model.mutations',
+    'editing': 'model.editing',
+    'outbreak': 'model.outbreak',
+    'titanic': 'model.titanic',
+}
+
+
+class InferenceBusy(Exception):
+    """Raised when the executor already holds as many pending batches as it allows."""
+
+
+def _init_worker(names):
+    # Runs once in every pool process: import the model modules and load their published artifacts; missing
+    # ones are built by the first prediction that needs them, not by every starting worker
+    for name in names:
+        importlib.import_module(MODELS[name])
+        if not registry.published(name):
+            continue
+        try:
+            registry.load(name)
+        except Exception as e:
+            # A missing dataset must not break the pool, the error is raised again by the prediction
+            print(f"Inference worker could not load model '{name}': {e}")
+
+
+def _run_batch(name, records, options=None):
+    return importlib.import_module(MODELS[name]).predict_many(records, **(options or {}))
+
+
+def _with_telemetry(function, name, records, *args):
+    # Runs in a pool process: the result travels back with the telemetry counters recorded for it
+    return function(name, records, *args), telemetry.drain()
+
+
+def _merge_telemetry(pool_future):
+    # Future of the result alone, merging the counters that came back with it into this process
+    future = Future()
+
+    def done(pool_future):
+        try:
+            result, counters = pool_future.result()
+        except BaseException as e:
+            future.set_exception(e)
+            return
+        telemetry.merge(counters)
+        future.set_result(result)
+
+    pool_future.add_done_callback(done)
+    return future
+
+
+def _run_isolated(name, records):
+    # Coalesced records come from different requests, so one bad record must not fail the others
+    try:
+        return [(True, result) for result in _run_batch(name, records)]
+    except Exception:
+        if len(records) == 1:
+            raise
+    outcomes = []
+    for record in records:
+        try:
+            outcomes.append((True, _run_batch(name, [record])[0]))
+        except Exception as e:
+            outcomes.append((False, e))
+    return outcomes
+
+
+class InferenceExecutor:
+    """
+    InferenceExecutor
+
+    Attributes:
+        workers (int): Number of pool processes, 0 runs predictions in the calling thread.
+        max_pending (int): Maximum number of batches submitted and not finished yet.
+        coalesce_window (float): Seconds a single prediction waits for others to join its batch, 0 disables batching.
+        max_batch (int): Maximum number of coalesced records per batch.
+        timeout (float): Seconds a caller waits for its result.
+    """
+
+    def __init__(self, workers=2, max_pending=32, coalesce_window=0.002, max_batch=256, timeout=30.0):
+        """
+        Constructor, 1st step in object creation.
+
+        Args:
+            workers (int, optional): Number of pool processes, 0 runs predictions in the calling thread.
+            max_pending (int, optional): Maximum number of batches submitted and not finished yet.
+            coalesce_window (float, optional): Seconds a single prediction waits for others to join its batch.
+            max_batch (int, optional): Maximum number of coalesced records per batch.
+            timeout (float, optional): Seconds a caller waits for its result.
+        """
+        self.workers = workers
+        self.max_pending = max_pending
+        self.coalesce_window = coalesce_window
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._batchers = {}  # model name -> DynamicBatcher collecting single predictions
+        self._pool = None
+        if workers:
+            # spawn, not fork: the web worker has threads and open database connections
+            self._pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(list(MODELS),),
+            )
+
+    def _submit(self, function, name, records, *args):
+        # Takes a pending slot or refuses the work, the slot is given back when the batch finishes
+        if not self._slots.acquire(blocking=False):
+            raise InferenceBusy(f"Inference queue is full ({self.max_pending} pending batches)")
+        try:
+            if self._pool is None:
+                future = Future()
+                try:
+                    future.set_result(function(name, records, *args))
+                except Exception as e:
+                    future.set_exception(e)
+            else:
+                future = _merge_telemetry(self._pool.submit(_with_telemetry, function, name, records, *args))
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def predict_many(self, name, records, **options):
+        """
+        Runs one batch of predictions in the pool.
+
+        Args:
+            name (str): The registry name of the model.
+            records (list or DataFrame): The input records, in any form the model's predict_many accepts.
+            **options: Keyword arguments for the model's predict_many.
+
+        Returns:
+            list: One prediction per record.
+
+        Raises:
+            InferenceBusy: Too many batches are pending.
+            TimeoutError: The batch did not finish within the timeout.
+        """
+        if len(records) == 0:
+            return []
+        with telemetry.timer(name, 'inference'):
+            results = self._result(self._submit(_run_batch, name, records, options))
+        shadow.mirror(name, records, results, options)
+        return results
+
+    def predict(self, name, record):
+        """
+        Runs a single prediction, batched with concurrent single predictions for the same model.
+
+        Args:
+            name (str): The registry name of the model.
+            record (dict): The input record.
+
+        Returns:
+            object: The prediction.
+
+        Raises:
+            InferenceBusy: Too many batches are pending.
+            TimeoutError: The prediction did not finish within the timeout.
+        """
+        if self.coalesce_window <= 0:
+            return self.predict_many(name, [record])[0]
+        with telemetry.timer(name, 'inference'):
+            try:
+                future = self._batcher(name).submit(record)
+            except queue.Full as e:
+                raise InferenceBusy(f"Inference queue is full ({e})")
+            result = self._result(future)
+        shadow.mirror(name, [record], [result])
+        return result
+
+    def _batcher(self, name):
+        batcher = self._batchers.get(name)
+        if batcher is None:
+            with self._lock:
+                batcher = self._batchers.get(name)
+                if batcher is None:
+                    batcher = DynamicBatcher(
+                        lambda records: self._submit(_run_isolated, name, records),
+                        max_batch_size=self.max_batch,
+                        max_wait=self.coalesce_window,
+                        max_in_flight=self.workers or 1,
+                    )
+                    self._batchers[name] = batcher
+        return batcher
+
+    def stats(self):
+        """
+        Returns:
+            dict: Pool settings and the throughput and latency counters of every model's batcher.
+        """
+        return {
+            'workers': self.workers,
+            'max_pending': self.max_pending,
+            'models': {name: batcher.stats() for name, batcher in sorted(self._batchers.items())},
+        }
+
+    def _result(self, future):
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            raise TimeoutError(f"Inference did not finish within {self.timeout} seconds")
+
+    def shutdown(self):
+        """Stops the pool processes."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+# One executor per web worker process, created on first use so that it is not inherited by forked workers
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor(config=None):
+    """
+    Gets the process wide executor, creating it from the app configuration on first use.
+
+    Args:
+        config (dict, optional): Configuration with the INFERENCE_* settings, e.g. current_app.config.
+
+    Returns:
+        InferenceExecutor: The shared executor.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                config = config or {}
+                _executor = InferenceExecutor(
+                    workers=int(config.get('INFERENCE_WORKERS', 2)),
+                    max_pending=int(config.get('INFERENCE_MAX_PENDING', 32)),
+                    coalesce_window=float(config.get('INFERENCE_COALESCE_MS', 2)) / 1000,
+                    max_batch=int(config.get('INFERENCE_MAX_BATCH', 256)),
+                    timeout=float(config.get('INFERENCE_TIMEOUT', 30)),
+                )
+                atexit.register(_executor.shutdown)
+    return _executor
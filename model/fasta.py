@@ -0,0 +1,504 @@
+# fasta.py
+import numpy as np
+from werkzeug.sansio.multipart import MultipartDecoder, Data, Field, File, NeedData, Epilogue
+from model.alignment import derive_edits
+from model.codons import classify
+from model.strand import StrandEditor
+from model.mutations import predict_many
+
+"""
+Streaming FASTA/FASTQ analysis
+
+Reads FASTA or FASTQ data chunk by chunk as it arrives, compares every query record against a reference
+sequence and produces mutation records through a generator pipeline:
+
+    chunks -> read_sequences() -> compare_records() -> score_batches() -> NDJSON lines
+
+Only the reference sequence is held in memory.  Query records are aligned against it window by window as
+their bytes arrive.  A window ends on a seed: ALIGN_SEED query bases, about ALIGN_WINDOW bases into the
+window, that occur exactly once in the reference within ALIGN_MAX_INDEL bases of where the offset carried
+over from the previous window puts them.  Both ends of the window are then exact matches, so aligning it
+(model/alignment.py) gives the edits aligning the whole strands would, for any indel up to ALIGN_MAX_INDEL
+bases, and the next window starts from the seed with the new offset.  A window where no seed matches (a
+stretch too divergent, or an indel longer than that) is compared base by base with the offset unchanged, and
+the next window seeds again.  The edits are classified per codon like /api/mutations does and scored in
+batches with the mutations model.  Query bases beyond the end of the reference, or reference bases beyond
+the end of the query, are reported as one trailing insertion or deletion.
+"""
+
+# Number of mutation records scored per predict_many call
+BATCH_SIZE = 512
+# Bytes read from an upload stream at a time
+CHUNK_SIZE = 64 * 1024
+
+# Query bases per window before its seed, bases of a seed, and the longest insertion or deletion that the
+# seed search reaches across, which is also how far past the end of the reference query bases are aligned
+ALIGN_WINDOW = 2048
+ALIGN_SEED = 24
+ALIGN_MAX_INDEL = 4096
+
+# Upper-case bases (RNA U read as T) and drop anything that is not a letter (whitespace, digits, gaps, '*')
+_SEQUENCE_TABLE = bytes.maketrans(b'abcdefghijklmnopqrstuvwxyzU', b'ABCDEFGHIJKLMNOPQRSTTVWXYZT')
+_DROP = bytes(c for c in range(256) if not (65 <= c <= 90 or 97 <= c <= 122))
+# Ambiguity codes (R, Y, ...) of upper-case sequences become N, a no-call
+_BASE_TABLE = bytes(c if c in b'ACGTN' else ord('N') for c in range(256))
+
+
+def read_chunks(stream, chunk_size=CHUNK_SIZE):
+    """
+    Args:
+        stream (file): A binary stream, e.g. request.stream or an uploaded file.
+        chunk_size (int, optional): Bytes per read.
+
+    Returns:
+        iterator: The chunks read from the stream until it is exhausted.
+    """
+    return iter(lambda: stream.read(chunk_size), b'')
+
+
+def read_sequences(chunks):
+    """
+    Parses FASTA or FASTQ records from an iterable of byte chunks without buffering whole records.
+
+    Args:
+        chunks (iterable): Byte chunks, e.g. read from a request stream.
+
+    Yields:
+        tuple: ('header', name) when a record starts, then ('sequence', bytes) for each piece of its sequence.
+
+    Raises:
+        ValueError: The data is not FASTA or FASTQ.
+    """
+    state = 'start'  # start | header | sequence | plus | quality
+    header = bytearray()
+    record_length = 0
+    quality_left = 0
+    at_line_start = True
+
+    for chunk in chunks:
+        pos = 0
+        size = len(chunk)
+        while pos < size:
+            if state == 'header':
+                end = chunk.find(b'\n', pos)
+                header += chunk[pos:] if end < 0 else chunk[pos:end]
+                if end < 0:
+                    break
+                yield 'header', header.decode('utf-8', 'replace').strip()
+                header = bytearray()
+                record_length = 0
+                state, pos, at_line_start = 'sequence', end + 1, True
+            elif state == 'plus':
+                end = chunk.find(b'\n', pos)
+                if end < 0:
+                    break
+                state, pos, quality_left = 'quality', end + 1, record_length
+            elif state == 'quality':
+                # Quality strings may start with '@', so they are skipped by length, not by content
+                end = chunk.find(b'\n', pos)
+                line = chunk[pos:] if end < 0 else chunk[pos:end]
+                quality_left -= len(line.strip())
+                pos = size if end < 0 else end + 1
+                if end >= 0 and quality_left <= 0:
+                    state, at_line_start = 'start', True
+            elif at_line_start and chunk[pos:pos + 1] in (b'>', b'@', b'+'):
+                marker = chunk[pos:pos + 1]
+                if marker == b'+' and state == 'sequence':
+                    state, pos = 'plus', pos + 1
+                elif marker != b'+':
+                    state, pos = 'header', pos + 1
+                else:
+                    raise ValueError('Unexpected "+" line outside of a FASTQ record')
+            elif state == 'start':
+                # Only blank lines are allowed between records
+                end = chunk.find(b'\n', pos)
+                line = chunk[pos:] if end < 0 else chunk[pos:end]
+                if line.strip():
+                    raise ValueError('Expected a FASTA (">") or FASTQ ("@") header')
+                pos, at_line_start = (size, False) if end < 0 else (end + 1, True)
+            else:
+                end = chunk.find(b'\n', pos)
+                line = chunk[pos:] if end < 0 else chunk[pos:end]
+                bases = bytes(line).translate(_SEQUENCE_TABLE, _DROP)
+                if bases:
+                    record_length += len(bases)
+                    yield 'sequence', bases
+                pos, at_line_start = (size, False) if end < 0 else (end + 1, True)
+
+    if state == 'header' and header:
+        yield 'header', header.decode('utf-8', 'replace').strip()
+
+
+def read_reference(events):
+    """
+    Collects the first record of a read_sequences() event stream.
+
+    Args:
+        events (iterator): Events from read_sequences().
+
+    Returns:
+        tuple: (name, bytearray sequence, next header or None); the events iterator is left positioned
+            just after the header of the next record.
+    """
+    name, sequence = None, bytearray()
+    for kind, value in events:
+        if kind == 'header':
+            if name is not None:
+                return name, sequence, value
+            name = value
+        else:
+            sequence += value
+    return name, sequence, None
+
+
+def read_multipart(chunks, boundary):
+    """
+    Parses a multipart/form-data body as it arrives, without spooling uploaded files.
+
+    Args:
+        chunks (iterable): Byte chunks of the body.
+        boundary (str): The boundary of the Content-Type header.
+
+    Yields:
+        tuple: (field name, bytes) for each piece of the parts' content.
+    """
+    decoder = MultipartDecoder(boundary.encode('latin-1'))
+    name = None
+    for chunk in chunks:
+        decoder.receive_data(chunk)
+        event = decoder.next_event()
+        while not isinstance(event, (NeedData, Epilogue)):
+            if isinstance(event, (Field, File)):
+                name = event.name
+            elif isinstance(event, Data) and event.data:
+                yield name, event.data
+            event = decoder.next_event()
+        if isinstance(event, Epilogue):
+            return
+
+
+def read_form_sequences(chunks, boundary):
+    """
+    Reads the reference of a multipart upload with 'reference' and 'query' files, in that order, and
+    leaves the query to be read as it arrives.
+
+    Args:
+        chunks (iterable): Byte chunks of the body.
+        boundary (str): The boundary of the Content-Type header.
+
+    Returns:
+        tuple: (reference name, bytearray reference sequence, iterator of query byte chunks).
+
+    Raises:
+        ValueError: A file is missing, or the query comes first.
+    """
+    parts = read_multipart(chunks, boundary)
+    first_query = []
+
+    def reference_chunks():
+        for field, data in parts:
+            if field == 'query':
+                first_query.append(data)
+                return
+            if field == 'reference':
+                yield data
+
+    reference_data = reference_chunks()
+    name, reference, _ = read_reference(read_sequences(reference_data))
+    if not reference and first_query:
+        raise ValueError('The reference file must come before the query file')
+    # Skip the reference's other records, up to the start of the query
+    for _ in reference_data:
+        pass
+    if not first_query:
+        raise ValueError('Both reference and query files are required')
+
+    def query_chunks():
+        yield first_query[0]
+        for field, data in parts:
+            if field == 'query':
+                yield data
+
+    return name, reference, query_chunks()
+
+
+def _compare_bases(reference, query):
+    # Edits turning the reference window into the query window base by base, without gaps
+    size = min(len(reference), len(query))
+    differs = np.flatnonzero(np.frombuffer(reference[:size], dtype=np.uint8) !=
+                             np.frombuffer(query[:size], dtype=np.uint8))
+    edits = [{'type': 'substitution', 'position': int(pos), 'new_base': chr(query[pos])} for pos in differs]
+    edits += [{'type': 'deletion', 'position': pos} for pos in range(size, len(reference))]
+    edits += [{'type': 'insertion', 'position': size, 'new_base': chr(base)} for base in query[size:]]
+    return edits
+
+
+def _window_edits(reference, query):
+    # Edits turning the reference window into the query window; windows too divergent to align within
+    # MAX_EDIT_DISTANCE are compared base by base instead
+    try:
+        return derive_edits(reference.decode('ascii'), query.decode('ascii'))
+    except ValueError:
+        return _compare_bases(reference, query)
+
+
+def _anchor(reference, start, query, positions):
+    """
+    Finds a seed of the query in the reference.  QueryComparison.finish() also calls it the other way round, to
+    find the last seed of the reference in the query.
+
+    Args:
+        reference (bytes): The whole reference sequence.
+        start (int): Reference position the query window starts at.
+        query (bytearray): The query window.
+        positions (iterable): Query positions to try a seed at, in order of preference.
+
+    Returns:
+        tuple: (reference position, query position) of the first seed found, relative to the window, or None.
+            A seed is found when it occurs exactly once within ALIGN_MAX_INDEL of its position in the query.
+    """
+    for y in positions:
+        seed = bytes(query[y:y + ALIGN_SEED])
+        if b'N' in seed:
+            continue
+        low = start + max(y - ALIGN_MAX_INDEL, 0)
+        high = min(start + y + ALIGN_MAX_INDEL + ALIGN_SEED, len(reference))
+        x = reference.find(seed, low, high)
+        if x >= 0 and reference.find(seed, x + 1, high) < 0:
+            return x - start, y
+    return None
+
+
+def _edit_records(name, reference, start, edits):
+    """
+    Classifies the edits of one window by codon.
+
+    Args:
+        name (str): The query record name.
+        reference (bytes): The whole reference sequence.
+        start (int): Reference position the window's edit positions are relative to.
+        edits (list): Edits in the mutations API format.
+
+    Returns:
+        list: One mutation record per substituted codon and per indel, in strand order.
+    """
+    # N in the query is a no-call, not a mutation
+    edits = [edit for edit in edits if edit.get('new_base', 'A') != 'N']
+    if not edits:
+        return []
+    # The edited part of the reference from its first codon to one codon past its last edit
+    first = min(start + edits[0]['position'], len(reference) - 1)
+    last = start + max(edit['position'] for edit in edits)
+    segment_start = first - first % 3
+    editor = StrandEditor(bytes(reference[segment_start:last + 3]).decode('ascii'))
+    shift = start - segment_start
+    applied = [(edit['type'], editor.apply({**edit, 'position': edit['position'] + shift})['position']) for edit in edits]
+    classified = classify(editor)
+    records, seen = [], set()
+    for m_type, pos in applied:
+        codon = classified.get((m_type, pos)) or classified[('deletion', pos)]
+        # Edits of one codon or one indel share their record
+        if id(codon) in seen:
+            continue
+        seen.add(id(codon))
+        records.append({
+            'record': name,
+            'position': segment_start + pos,
+            'mutation_type': codon['mutation_type'],
+            'reference_codon': codon['Reference_Codon'],
+            'query_codon': codon['Query_Codon'],
+        })
+    return records
+
+
+class QueryComparison:
+    """
+    QueryComparison
+
+    Aligns one query record against the reference window by window, as its bases arrive.
+
+    Attributes:
+        name (str): The query record name.
+        reference (bytes): The reference sequence.
+        aligned (int): Reference bases aligned so far.
+        pending (bytearray): Query bases received but not aligned yet.
+        length (int): Number of query bases received.
+        extra (int): Query bases beyond what can be aligned to the rest of the reference, not kept.
+        tail (bytearray): The first of those extra bases.
+        mutations (int): Number of mutation records produced.
+    """
+
+    def __init__(self, name, reference):
+        self.name = name
+        self.reference = reference
+        self.aligned = 0
+        self.pending = bytearray()
+        self.length = 0
+        self.extra = 0
+        self.tail = bytearray()
+        self.mutations = 0
+
+    def feed(self, bases):
+        """
+        Args:
+            bases (bytes): The next bases of the query.
+
+        Returns:
+            list: Mutation records for the windows completed by these bases.
+        """
+        self.length += len(bases)
+        bases = bytes(bases).translate(_BASE_TABLE)
+        # Past the end of the reference only the first bases are kept, for the trailing insertion record
+        room = max(len(self.reference) - self.aligned + ALIGN_MAX_INDEL - len(self.pending), 0)
+        self.pending += bases[:room]
+        if len(bases) > room:
+            self.extra += len(bases) - room
+            self.tail += bases[room:room + 3 - len(self.tail)]
+
+        records = []
+        # A window needs room for its seed past an indel of ALIGN_MAX_INDEL bases on either side
+        size = ALIGN_WINDOW + ALIGN_MAX_INDEL + ALIGN_SEED
+        while len(self.pending) >= size and len(self.reference) - self.aligned >= size:
+            start = self.aligned
+            anchor = _anchor(self.reference, start, self.pending,
+                             range(ALIGN_WINDOW, size - ALIGN_SEED + 1, ALIGN_SEED))
+            if anchor is None:
+                # No seed within reach: compare base by base with the offset unchanged, the next window seeds again
+                reference_cut = query_cut = ALIGN_WINDOW - (start + ALIGN_WINDOW) % 3
+                edits = _compare_bases(self.reference[start:start + reference_cut], self.pending[:query_cut])
+            else:
+                # Cut at the first codon boundary in the seed, so that no codon spans two windows
+                x, y = anchor
+                reference_cut = x + -(start + x) % 3
+                query_cut = y + reference_cut - x
+                edits = _window_edits(self.reference[start:start + reference_cut], bytes(self.pending[:query_cut]))
+            records.extend(_edit_records(self.name, self.reference, start, edits))
+            self.aligned += reference_cut
+            del self.pending[:query_cut]
+        self.mutations += len(records)
+        return records
+
+    def finish(self):
+        """
+        Returns:
+            list: Mutation records for the rest of the query and a trailing insertion or deletion.
+        """
+        start = end = self.aligned
+        edits = []
+        if self.pending:
+            rest = len(self.reference) - start
+            if rest <= len(self.pending) + ALIGN_MAX_INDEL:
+                # The query reaches the end of the reference, both are aligned to their ends.  When it runs past
+                # it, the last seed of the reference is looked for in the query instead, and the query bases past
+                # the end of the reference join the trailing insertion
+                end = len(self.reference)
+                anchor = _anchor(bytes(self.pending), 0, self.reference[start:],
+                                 range(rest - ALIGN_SEED, -1, -ALIGN_SEED)) if len(self.pending) > rest else None
+                if anchor:
+                    y, x = anchor
+                    overhang = bytes(self.pending[y + rest - x:])
+                    del self.pending[y + rest - x:]
+                    self.extra += len(overhang)
+                    self.tail = bytearray((overhang + self.tail)[:3])
+            else:
+                # The query ended before the reference: it is aligned up to its last seed and base by base
+                # after it, the rest of the reference is the trailing deletion
+                anchor = _anchor(self.reference, start, self.pending,
+                                 range(len(self.pending) - ALIGN_SEED, -1, -ALIGN_SEED))
+                x, y = anchor or (0, 0)
+                end = start + x + len(self.pending) - y
+            edits = _window_edits(self.reference[start:end], bytes(self.pending))
+        tail = bytes(self.tail)
+        if self.extra:
+            # Insertions at the end of the reference join the extra bases in the trailing insertion
+            while edits and edits[-1]['type'] == 'insertion' and start + edits[-1]['position'] == end:
+                tail = edits.pop()['new_base'].encode('ascii') + tail
+                self.extra += 1
+        records = _edit_records(self.name, self.reference, start, edits)
+
+        net = self.extra if self.extra else end - len(self.reference)
+        if net:
+            # Shown in the codon the indel starts in, like codons.classify does
+            before = bytes(self.reference[end - end % 3:end])
+            if net > 0:
+                ref_codon, query_codon = (before + b'---')[:3], (before + tail)[:3]
+            else:
+                ref_codon, query_codon = bytes(self.reference[end - end % 3:end - end % 3 + 3]), before
+            ref_codon, query_codon = ref_codon.decode('ascii').ljust(3, '-'), query_codon.decode('ascii').ljust(3, '-')
+            records.append({
+                'record': self.name,
+                'position': end,
+                'mutation_type': f"{'Frame-Shift' if net % 3 else 'In-Frame'} {'Insertion' if net > 0 else 'Deletion'}",
+                'reference_codon': ref_codon,
+                'query_codon': query_codon,
+            })
+        self.mutations += len(records)
+        return records
+
+    def summary(self):
+        """
+        Returns:
+            dict: The end of record summary line.
+        """
+        return {'record': self.name, 'length': self.length, 'mutations': self.mutations, 'done': True}
+
+
+def compare_records(events, reference):
+    """
+    Aligns every query record of an event stream against the reference as its bases arrive.
+
+    Args:
+        events (iterator): Events from read_sequences(), starting at the first query header.
+        reference (bytearray): The reference sequence.
+
+    Yields:
+        dict: Mutation records ('record', 'position', 'mutation_type', 'reference_codon', 'query_codon'),
+            and after each query record its summary().
+    """
+    reference = bytes(reference).translate(_BASE_TABLE)
+    comparison = None
+    for kind, value in events:
+        if kind == 'header':
+            if comparison is not None:
+                yield from comparison.finish()
+                yield comparison.summary()
+            comparison = QueryComparison(value, reference)
+        elif comparison is not None:
+            yield from comparison.feed(value)
+    if comparison is not None:
+        yield from comparison.finish()
+        yield comparison.summary()
+
+
+def score_batches(records, batch_size=BATCH_SIZE, predict=predict_many):
+    """
+    Scores mutation records with the mutations model in batches, passing summaries through.
+
+    Args:
+        records (iterator): Records from compare_records().
+        batch_size (int, optional): Number of mutation records per model call.
+        predict (function, optional): Batch prediction function, defaults to model.mutations.predict_many.
+
+    Yields:
+        dict: The records with an added 'impact', in their original order.
+    """
+    batch = []
+
+    def flush():
+        impacts = iter(predict([{
+            'Reference_Codon': record['reference_codon'],
+            'Query_Codon': record['query_codon'],
+            'Mutation_Type': record['mutation_type'],
+        } for record in batch if 'mutation_type' in record]))
+        for record in batch:
+            if 'mutation_type' in record:
+                record['impact'] = next(impacts)
+            yield record
+        batch.clear()
+
+    for record in records:
+        batch.append(record)
+        # Flush full batches, and at the end of every query record so that summaries are not held back
+        if len(batch) >= batch_size or record.get('done'):
+            yield from flush()
+    yield from flush()
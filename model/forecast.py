@@ -0,0 +1,233 @@
+# forecast.py
+import hashlib
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+from model import outbreak
+
+"""
+Outbreak Forecast Store
+
+A columnar, in-memory store of every state's vaccination time series, built once from the vaccination
+dataset (base CSV plus the appended daily rows) and kept per process.
+
+For every state the store holds one NumPy array per column, sorted by date, with the trailing 7, 14 and
+30 day windows precomputed from cumulative sums: the mean daily vaccinations and the change of the
+vaccination rate over the window.  A query for a state and a date range is two binary searches on the
+state's date array and a slice of each column, so it never scans the dataset.
+
+When daily rows are appended (see outbreak.append_rows), refresh() reads only the rows it has not seen and
+rebuilds the arrays of the states they belong to.
+"""
+
+# Trailing windows, in days
+WINDOWS = (7, 14, 30)
+
+# Window whose vaccination rate trend is extrapolated for forecasts, and the longest forecast allowed
+TREND_WINDOW = 14
+MAX_HORIZON = 90
+
+# Seconds between checks of the appended data file for new rows
+CHECK_INTERVAL = float(os.environ.get('FORECAST_CHECK_INTERVAL') or 5)
+
+# Raw columns kept per state
+_COLUMNS = ['total_vaccinations', 'total_distributed', 'people_vaccinated', 'daily_vaccinations']
+
+
+def _state_series(rows):
+    """
+    Builds the columns of one state.
+
+    Args:
+        rows (DataFrame): All rows of the state, any order, with a datetime64 'date' column.
+
+    Returns:
+        dict: 'date' (datetime64[D]) and one float64 array per raw column, vacc_rate, daily_avg_<w>,
+            rate_change_<w>, plus a 'fingerprint' of the content.
+    """
+    rows = rows.sort_values('date', kind='stable').drop_duplicates('date', keep='last')
+    series = {'date': rows['date'].to_numpy(dtype='datetime64[D]')}
+    for col in _COLUMNS:
+        series[col] = rows[col].to_numpy(dtype=np.float64, na_value=np.nan)
+    series['vacc_rate'] = series['people_vaccinated'] / (series['total_distributed'] + 1)
+
+    # Trailing windows over dates, not rows, so gaps in the reporting do not stretch a window
+    dates = series['date'].astype(np.int64)
+    daily = series['daily_vaccinations']
+    daily_sum = np.concatenate([[0.0], np.cumsum(np.nan_to_num(daily))])
+    daily_count = np.concatenate([[0], np.cumsum(~np.isnan(daily))])
+    index = np.arange(len(dates))
+    for window in WINDOWS:
+        start = np.searchsorted(dates, dates - (window - 1), side='left')
+        count = daily_count[index + 1] - daily_count[start]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            series[f'daily_avg_{window}'] = np.where(count > 0, (daily_sum[index + 1] - daily_sum[start]) / count, np.nan)
+        series[f'rate_change_{window}'] = series['vacc_rate'] - series['vacc_rate'][start]
+
+    digest = hashlib.sha1()
+    for name in sorted(series):
+        digest.update(name.encode())
+        digest.update(np.ascontiguousarray(series[name]).tobytes())
+    series['fingerprint'] = digest.hexdigest()[:16]
+    return series
+
+
+def _prepare(rows):
+    rows = rows.reindex(columns=outbreak.data_columns)
+    rows = rows.dropna(subset=['date', 'location'])
+    rows['date'] = pd.to_datetime(rows['date'], errors='coerce')
+    rows = rows.dropna(subset=['date'])
+    for col in _COLUMNS:
+        rows[col] = pd.to_numeric(rows[col], errors='coerce')
+    return rows
+
+
+class ForecastStore:
+    """
+    ForecastStore
+
+    Attributes:
+        states (dict): State name -> columns built by _state_series().
+        appended_rows (int): Number of appended data rows already in the store.
+    """
+
+    def __init__(self):
+        """
+        Constructor, 1st step in object creation.  The store is empty until load() is called.
+        """
+        self.states = {}
+        self.appended_rows = 0
+        self._raw = {}  # state -> DataFrame of its raw rows, for incremental rebuilds
+        self._lock = threading.Lock()
+        self._checked = 0.0
+        self._appended_stat = None
+
+    def load(self):
+        """
+        Builds the store from the base dataset and every appended row.
+        """
+        frames = []
+        if os.path.exists(outbreak.data_path):
+            frames.append(pd.read_csv(outbreak.data_path))
+        with outbreak.data_lock():
+            appended = outbreak.read_appended()
+            self._appended_stat = self._stat()
+        frames.append(appended)
+        rows = _prepare(pd.concat(frames, ignore_index=True))
+        self._raw = {state: group for state, group in rows.groupby('location', sort=False)}
+        self.states = {state: _state_series(group) for state, group in self._raw.items()}
+        self.appended_rows = len(appended)
+        self._checked = time.monotonic()
+
+    def _stat(self):
+        try:
+            stat = os.stat(outbreak.appended_path)
+            return stat.st_size, stat.st_mtime_ns
+        except OSError:
+            return None
+
+    def refresh(self):
+        """
+        Adds appended rows the store has not seen, rebuilding only the states they belong to.
+        Checks the appended data file at most every CHECK_INTERVAL seconds.
+
+        Returns:
+            list: Names of the states that changed.
+        """
+        now = time.monotonic()
+        if now - self._checked < CHECK_INTERVAL:
+            return []
+        with self._lock:
+            self._checked = now
+            if self._stat() == self._appended_stat:
+                return []
+            with outbreak.data_lock():
+                new_rows = outbreak.read_appended(self.appended_rows)
+                self._appended_stat = self._stat()
+            self.appended_rows += len(new_rows)
+            changed = []
+            for state, group in _prepare(new_rows).groupby('location', sort=False):
+                raw = pd.concat([self._raw[state], group], ignore_index=True) if state in self._raw else group
+                self._raw[state] = raw
+                # Replace the state's columns in one assignment, readers see either the old or the new ones
+                self.states = {**self.states, state: _state_series(raw)}
+                changed.append(state)
+            return changed
+
+    def etag(self, state, *params):
+        """
+        Args:
+            state (str): The state name.
+            *params: Query parameters that shape the response.
+
+        Returns:
+            str: A tag that changes whenever the state's data or the parameters change, or None for unknown states.
+        """
+        series = self.states.get(state)
+        if series is None:
+            return None
+        return hashlib.sha1(repr((series['fingerprint'],) + params).encode()).hexdigest()[:20]
+
+    def query(self, state, start=None, end=None, horizon=0):
+        """
+        Slices a state's series and extrapolates the vaccination rate trend.
+
+        Args:
+            state (str): The state name.
+            start (numpy.datetime64, optional): First date, inclusive.
+            end (numpy.datetime64, optional): Last date, inclusive.
+            horizon (int, optional): Days to forecast past the last date of the state.
+
+        Returns:
+            dict: Columns of the slice ('date', 'vacc_rate', 'risk', 'daily_avg_<w>', 'rate_change_<w>', ...)
+                and a 'forecast' with 'date', 'vacc_rate' and 'risk' per day of the horizon.
+
+        Raises:
+            KeyError: The state is unknown.
+        """
+        series = self.states[state]
+        dates = series['date']
+        lo = 0 if start is None else np.searchsorted(dates, start, side='left')
+        hi = len(dates) if end is None else np.searchsorted(dates, end, side='right')
+        window = {name: values[lo:hi] for name, values in series.items() if name != 'fingerprint'}
+        window['risk'] = outbreak.risk_level(window['vacc_rate'])
+
+        forecast = {'date': dates[:0], 'vacc_rate': np.empty(0), 'risk': np.empty(0, dtype=str)}
+        if horizon and len(dates):
+            # Linear trend of the vaccination rate over the trailing window ending at the last date
+            rate = series['vacc_rate']
+            first = np.searchsorted(dates, dates[-1] - np.timedelta64(TREND_WINDOW - 1, 'D'), side='left')
+            span = (dates[-1] - dates[first]).astype(np.int64)
+            slope = (rate[-1] - rate[first]) / span if span > 0 else 0.0
+            steps = np.arange(1, horizon + 1)
+            projected = np.maximum(rate[-1] + slope * steps, 0.0)
+            forecast = {
+                'date': dates[-1] + steps.astype('timedelta64[D]'),
+                'vacc_rate': projected,
+                'risk': outbreak.risk_level(projected),
+            }
+        window['forecast'] = forecast
+        return window
+
+
+# One store per process, built on first use
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """
+    Returns:
+        ForecastStore: The process wide store, loaded on first use and refreshed with appended rows.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = ForecastStore()
+                store.load()
+                _store = store
+    _store.refresh()
+    return _store
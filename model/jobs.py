@@ -0,0 +1,441 @@
+# jobs.py
+import itertools
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+from __init__ import app, db
+
+"""
+Analysis Jobs
+
+Long-running analyses (a whole FASTA file of mutations, a bulk editing CSV) run as jobs in separate worker
+processes (see job_worker.py) instead of inside a web worker, where they would hold it until the request
+timeout.  Job state is kept in the application database (MySQL in production, SQLite locally), so every web
+worker and every job worker sees the same queue:
+
+    pending -> queued -> running -> succeeded | failed | cancelled
+
+A job's input upload and its results are files in JOB_DIR/<id>/.  Results are appended line by line while
+the job runs, so clients can read partial results before it finishes.
+
+Scheduling: a worker claims the queued job with the highest priority, oldest first, among the users that run
+fewer than USER_CONCURRENCY jobs, so one user's long jobs never take every worker.  A user may also have at
+most USER_MAX_QUEUED jobs waiting.  Running jobs save their progress every CHECKPOINT_INTERVAL seconds, which
+is also when they notice a cancellation.  A thread of the worker beats the job's heartbeat every
+HEARTBEAT_INTERVAL seconds however long the job goes without writing a result; a job whose heartbeat stopped
+for STALE_SECONDS is failed, and a worker finishing a job that was failed meanwhile leaves it failed.
+"""
+
+# Input and result files of the jobs, in the instance folder (the persistent volume in docker-compose)
+JOB_DIR = os.environ.get('JOB_DIR') or os.path.join(app.instance_path, 'jobs')
+
+# Jobs a user may run at the same time, and keep waiting in the queue
+USER_CONCURRENCY = int(os.environ.get('JOB_USER_CONCURRENCY') or 1)
+USER_MAX_QUEUED = int(os.environ.get('JOB_USER_MAX_QUEUED') or 10)
+
+# Seconds between progress saves (and cancellation checks) of a running job, between heartbeats of its worker,
+# and without a heartbeat before it is failed
+CHECKPOINT_INTERVAL = float(os.environ.get('JOB_CHECKPOINT_INTERVAL') or 1)
+HEARTBEAT_INTERVAL = float(os.environ.get('JOB_HEARTBEAT_INTERVAL') or 10)
+STALE_SECONDS = float(os.environ.get('JOB_STALE_SECONDS') or 300)
+
+# Seconds an idle worker waits before looking for queued jobs again
+POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL') or 1)
+
+# Finished jobs and their files are deleted after this many days
+RETENTION_DAYS = float(os.environ.get('JOB_RETENTION_DAYS') or 7)
+
+# Priority name -> value, higher runs first; 'high' is reserved for admins
+PRIORITIES = {'low': 0, 'normal': 1, 'high': 2}
+
+FINISHED = ('succeeded', 'failed', 'cancelled')
+
+
+class JobLimit(Exception):
+    """Raised when a user already has USER_MAX_QUEUED jobs waiting."""
+
+
+class JobCancelled(Exception):
+    """Raised in a running job when its cancellation was requested."""
+
+
+def _run_mutations(job, input_file, output, checkpoint):
+    # A FASTA/FASTQ file whose first record is the reference, the same format as /api/mutations/stream
+    from model.fasta import read_chunks, read_sequences, read_reference, compare_records, score_batches
+    events = read_sequences(read_chunks(input_file))
+    name, reference, next_header = read_reference(events)
+    if not reference:
+        raise ValueError('Reference sequence is missing')
+    output.write(json.dumps({'reference': name, 'length': len(reference)}) + '\n')
+    query_events = itertools.chain([('header', next_header)], events) if next_header else iter(())
+    for count, record in enumerate(score_batches(compare_records(query_events, reference)), 1):
+        output.write(json.dumps(record) + '\n')
+        checkpoint(count)
+
+
+def _run_editing(job, input_file, output, checkpoint):
+    # A CSV or Parquet export of screens, answered as CSV with a 'Prediction' column like /api/editing/bulk
+    from model.editing import read_table_chunks, predict_many
+    rows = 0
+    for chunk in read_table_chunks(input_file, job.options.get('format', 'csv')):
+        chunk['Prediction'] = predict_many(chunk, coerce=True)
+        output.write(chunk.to_csv(index=False, header=rows == 0))
+        rows += len(chunk)
+        checkpoint(rows)
+
+
+# Job kind -> (function(job, input file, output, checkpoint), content type of the results)
+KINDS = {
+    'mutations': (_run_mutations, 'application/x-ndjson'),
+    'editing': (_run_editing, 'text/csv'),
+}
+
+
+class Job(db.Model):
+    """
+    Job Model
+
+    An analysis submitted by a user and run by a job worker.
+
+    Attributes:
+        id (db.Column): The primary key, also the name of the job's directory in JOB_DIR.
+        uid (db.Column): The uid of the user who submitted the job.
+        kind (db.Column): The analysis, a key of KINDS.
+        priority (db.Column): A value of PRIORITIES, higher runs first.
+        status (db.Column): pending, queued, running, succeeded, failed or cancelled.
+        params (db.Column): JSON of the job's options, e.g. the file format.
+        progress (db.Column): Results written so far (records or rows).
+        error (db.Column): Why the job failed.
+        cancel_requested (db.Column): Set to stop a running job at its next checkpoint.
+        worker (db.Column): The worker running or that ran the job.
+        created, started, finished, heartbeat (db.Column): Epoch seconds; heartbeat is the last sign of life of
+            the worker running the job.
+    """
+    __tablename__ = 'jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    uid = db.Column(db.String(255), nullable=False, index=True)
+    kind = db.Column(db.String(32), nullable=False)
+    priority = db.Column(db.Integer, nullable=False, default=PRIORITIES['normal'])
+    status = db.Column(db.String(16), nullable=False, index=True, default='pending')
+    params = db.Column(db.Text, nullable=True)
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    worker = db.Column(db.String(255), nullable=True)
+    created = db.Column(db.Float, nullable=False)
+    started = db.Column(db.Float, nullable=True)
+    finished = db.Column(db.Float, nullable=True)
+    heartbeat = db.Column(db.Float, nullable=True)
+
+    def __init__(self, uid, kind, priority=PRIORITIES['normal'], options=None):
+        """
+        Constructor, 1st step in object creation.
+
+        Args:
+            uid (str): The uid of the user submitting the job.
+            kind (str): The analysis, a key of KINDS.
+            priority (int, optional): A value of PRIORITIES.
+            options (dict, optional): Options of the analysis, e.g. {'format': 'parquet'}.
+        """
+        self.uid = uid
+        self.kind = kind
+        self.priority = priority
+        self.status = 'pending'
+        self.params = json.dumps(options or {})
+        self.progress = 0
+        self.cancel_requested = False
+        self.created = time.time()
+
+    def __repr__(self):
+        return f"Job(id={self.id}, uid={self.uid}, kind={self.kind}, status={self.status})"
+
+    @property
+    def options(self):
+        return json.loads(self.params or '{}')
+
+    @property
+    def directory(self):
+        return os.path.join(JOB_DIR, str(self.id))
+
+    @property
+    def result_path(self):
+        return os.path.join(self.directory, 'result')
+
+    @property
+    def content_type(self):
+        return KINDS[self.kind][1]
+
+    def queue_position(self):
+        """
+        Returns:
+            int: Number of queued jobs that run before this one, None when the job is not queued.
+        """
+        if self.status != 'queued':
+            return None
+        return Job.query.filter(Job.status == 'queued').filter(
+            (Job.priority > self.priority) | ((Job.priority == self.priority) & (Job.id < self.id))).count()
+
+    def read(self):
+        """
+        Returns:
+            dict: The job's state, for the API.
+        """
+        priority = next((name for name, value in PRIORITIES.items() if value == self.priority), self.priority)
+        return {
+            'id': self.id,
+            'uid': self.uid,
+            'kind': self.kind,
+            'priority': priority,
+            'status': self.status,
+            'progress': self.progress,
+            'queue_position': self.queue_position(),
+            'cancel_requested': self.cancel_requested,
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'result_bytes': os.path.getsize(self.result_path) if os.path.exists(self.result_path) else 0,
+        }
+
+    def read_results(self, offset=0, limit=1024 * 1024):
+        """
+        Reads complete result lines written so far.
+
+        Args:
+            offset (int, optional): Byte offset to start at, the end of the previous read.
+            limit (int, optional): Maximum number of bytes to read.
+
+        Returns:
+            bytes: Whole lines from offset on, empty when nothing new was written.
+        """
+        try:
+            with open(self.result_path, 'rb') as f:
+                f.seek(offset)
+                data = f.read(limit)
+        except OSError:
+            return b''
+        # A line the worker is still writing is left for the next read
+        return data[:data.rfind(b'\n') + 1]
+
+
+def submit(uid, kind, stream, priority=PRIORITIES['normal'], options=None):
+    """
+    Saves an upload as the input of a new job and queues the job.
+
+    Args:
+        uid (str): The uid of the submitting user.
+        kind (str): The analysis, a key of KINDS.
+        stream (file): The input upload, read to the end.
+        priority (int, optional): A value of PRIORITIES.
+        options (dict, optional): Options of the analysis.
+
+    Returns:
+        Job: The queued job.
+
+    Raises:
+        JobLimit: The user already has USER_MAX_QUEUED jobs waiting.
+    """
+    waiting = Job.query.filter(Job.uid == uid, Job.status.in_(('pending', 'queued'))).count()
+    if waiting >= USER_MAX_QUEUED:
+        raise JobLimit(f"You already have {waiting} jobs waiting, the limit is {USER_MAX_QUEUED}")
+
+    # Pending until its input is on disk, so that no worker claims it before
+    job = Job(uid, kind, priority, options)
+    db.session.add(job)
+    db.session.commit()
+    try:
+        os.makedirs(job.directory, exist_ok=True)
+        with open(os.path.join(job.directory, 'input'), 'wb') as f:
+            shutil.copyfileobj(stream, f)
+    except Exception:
+        db.session.delete(job)
+        db.session.commit()
+        shutil.rmtree(job.directory, ignore_errors=True)
+        raise
+    job.status = 'queued'
+    db.session.commit()
+    return job
+
+
+def cancel(job):
+    """
+    Cancels a queued job at once, or asks a running job to stop at its next checkpoint.
+
+    Args:
+        job (Job): The job.
+
+    Returns:
+        bool: False if the job had already finished.
+    """
+    # Conditional updates, a worker may claim or finish the job meanwhile
+    if Job.query.filter(Job.id == job.id, Job.status.in_(('pending', 'queued'))).update(
+            {'status': 'cancelled', 'finished': time.time()}, synchronize_session=False):
+        db.session.commit()
+        db.session.refresh(job)
+        return True
+    updated = Job.query.filter(Job.id == job.id, Job.status == 'running').update(
+        {'cancel_requested': True}, synchronize_session=False)
+    db.session.commit()
+    db.session.refresh(job)
+    return bool(updated)
+
+
+def claim(worker):
+    """
+    Takes the next job to run: the highest priority, oldest queued job of a user under USER_CONCURRENCY.
+
+    Args:
+        worker (str): Name of the claiming worker.
+
+    Returns:
+        Job: The claimed job, now running, or None if no job can run.
+    """
+    busy = db.session.query(Job.uid).filter(Job.status == 'running').group_by(Job.uid).having(
+        db.func.count(Job.id) >= USER_CONCURRENCY)
+    for job in Job.query.filter(Job.status == 'queued', ~Job.uid.in_(busy)).order_by(
+            Job.priority.desc(), Job.id).limit(20).all():
+        now = time.time()
+        # Only one worker wins the update of a queued job
+        claimed = Job.query.filter(Job.id == job.id, Job.status == 'queued').update(
+            {'status': 'running', 'worker': worker, 'started': now, 'heartbeat': now}, synchronize_session=False)
+        db.session.commit()
+        if not claimed:
+            continue
+        # Workers claiming jobs of the same user at the same time can exceed the limit; the latest claims step back
+        running = [row.id for row in Job.query.filter(Job.uid == job.uid, Job.status == 'running').order_by(
+            Job.started, Job.id).limit(USER_CONCURRENCY).all()]
+        if job.id not in running:
+            Job.query.filter(Job.id == job.id, Job.status == 'running').update(
+                {'status': 'queued', 'worker': None, 'started': None, 'heartbeat': None}, synchronize_session=False)
+            db.session.commit()
+            continue
+        db.session.refresh(job)
+        return job
+    return None
+
+
+def _beat(engine, job_id, worker, stop):
+    # Runs in a thread while the job runs, with its own connection: the job's session belongs to the job
+    jobs = Job.__table__
+    while not stop.wait(HEARTBEAT_INTERVAL):
+        try:
+            with engine.begin() as connection:
+                connection.execute(jobs.update().where(jobs.c.id == job_id, jobs.c.status == 'running',
+                                                       jobs.c.worker == worker).values(heartbeat=time.time()))
+        except Exception as e:
+            # A busy database is tried again at the next beat, STALE_SECONDS leaves room for several
+            print(f"Heartbeat of job {job_id} failed: {e}")
+
+
+def run(job):
+    """
+    Runs a claimed job to the end, writing its results and recording how it finished.
+
+    Args:
+        job (Job): A job returned by claim().
+    """
+    function, _ = KINDS[job.kind]
+    state = {'progress': 0, 'checkpoint': time.monotonic()}
+    # Only the row of this run is updated: a job failed as stale meanwhile stays failed
+    this_run = (Job.id == job.id, Job.status == 'running', Job.worker == job.worker)
+
+    def checkpoint(progress):
+        # Saves the progress and looks for a cancellation at most every CHECKPOINT_INTERVAL seconds
+        state['progress'] = progress
+        now = time.monotonic()
+        if now - state['checkpoint'] < CHECKPOINT_INTERVAL:
+            return
+        state['checkpoint'] = now
+        output.flush()
+        Job.query.filter(*this_run).update({'progress': progress}, synchronize_session=False)
+        db.session.commit()
+        if db.session.query(Job.cancel_requested).filter(Job.id == job.id).scalar():
+            raise JobCancelled()
+
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_beat, args=(db.engine, job.id, job.worker, stop),
+                                 name=f'job-{job.id}-heartbeat', daemon=True)
+    heartbeat.start()
+    status, error = 'succeeded', None
+    try:
+        with open(os.path.join(job.directory, 'input'), 'rb') as input_file, \
+                open(job.result_path, 'w', buffering=64 * 1024) as output:
+            function(job, input_file, output, checkpoint)
+    except JobCancelled:
+        status = 'cancelled'
+    except Exception as e:
+        db.session.rollback()
+        status, error = 'failed', f"{type(e).__name__}: {e}"
+    finally:
+        stop.set()
+        heartbeat.join()
+    now = time.time()
+    finished = Job.query.filter(*this_run).update({'status': status, 'error': error, 'progress': state['progress'],
+                                                   'finished': now, 'heartbeat': now}, synchronize_session=False)
+    db.session.commit()
+    if not finished:
+        print(f"Job {job.id} was no longer running on {job.worker}, its {status} result is not recorded")
+
+
+def fail_stale():
+    """
+    Fails running jobs whose heartbeat stopped, e.g. because their worker was killed.
+
+    Returns:
+        int: Number of jobs failed.
+    """
+    failed = Job.query.filter(Job.status == 'running', Job.heartbeat < time.time() - STALE_SECONDS).update(
+        {'status': 'failed', 'error': 'The job worker stopped responding', 'finished': time.time()},
+        synchronize_session=False)
+    db.session.commit()
+    return failed
+
+
+def prune():
+    """
+    Deletes finished jobs older than RETENTION_DAYS with their files.
+    """
+    for job in Job.query.filter(Job.status.in_(FINISHED), Job.finished < time.time() - RETENTION_DAYS * 86400).all():
+        shutil.rmtree(job.directory, ignore_errors=True)
+        db.session.delete(job)
+    db.session.commit()
+
+
+def work(name=None, stop=None):
+    """
+    The job worker loop: claims and runs jobs until stop is set.
+
+    Args:
+        name (str, optional): Name of the worker, defaults to host and process id.
+        stop (multiprocessing.Event, optional): Set to stop once the current job is done.
+    """
+    name = name or f"{socket.gethostname()}:{os.getpid()}"
+    with app.app_context():
+        db.create_all()
+        last_cleanup = 0
+        while stop is None or not stop.is_set():
+            if time.monotonic() - last_cleanup > STALE_SECONDS:
+                fail_stale()
+                prune()
+                last_cleanup = time.monotonic()
+            job = claim(name)
+            if job is None:
+                db.session.remove()
+                (stop.wait if stop is not None else time.sleep)(POLL_INTERVAL)
+                continue
+            print(f"Worker {name} running job {job.id} ({job.kind})")
+            run(job)
+            db.session.remove()
+
+
+def initJobs():
+    """
+    The initJobs function creates the Job table.
+    """
+    with app.app_context():
+        """Create database and tables"""
+        db.create_all()
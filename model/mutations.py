@@ -1,15 +1,18 @@
+from functools import lru_cache
+import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.preprocessing import LabelEncoder
 import os
+from model import registry, telemetry
 
-# Load dataset
+# Dataset
 data_path = os.path.join(os.path.dirname(__file__), '..', 'dna_mutations.csv')
-data = pd.read_csv(data_path)
 
-# Drop 'Position' if not needed
-data = data.drop(columns=['Position'], errors='ignore')
+# Encoded columns and the full feature list, in training order
+categorical_columns = ['Reference_Codon', 'Query_Codon', 'Mutation_Type']
+features = ['Reference_Codon', 'Query_Codon', 'Mutation_Type', 'Bio_Impact']
 
 # Define biological impact scores
 bio_impact_map = {
@@ -18,30 +21,43 @@ bio_impact_map = {
     'In-Frame Deletion': 0.6,
     'In-Frame Insertion': 0.6,
     'Frame-Shift Insertion': 1.0,
+    'Frame-Shift Deletion': 1.0,
     'Nonsense Substitution': 1.0,
     'Read-through Substitution': 0.8
 }
 
-# Apply biological impact scores
-data['Bio_Impact'] = data['Mutation_Type'].map(bio_impact_map)
-data['Classification'] = data['Bio_Impact'].apply(lambda x: 0 if x == 0.0 else 1)
-data = data.dropna(subset=['Reference_Codon', 'Query_Codon', 'Mutation_Type', 'Bio_Impact', 'Classification'])
+# Training: run by the registry build step (train_model.py), never at import time
+def train():
+    # Load dataset
+    data = pd.read_csv(data_path)
 
-# Encode features
-label_encoders = {}
-for col in ['Reference_Codon', 'Query_Codon', 'Mutation_Type']:
-    le = LabelEncoder()
-    data[col] = le.fit_transform(data[col])
-    label_encoders[col] = le
+    # Drop 'Position' if not needed
+    data = data.drop(columns=['Position'], errors='ignore')
 
-# Prepare features and target
-X = data[['Reference_Codon', 'Query_Codon', 'Mutation_Type', 'Bio_Impact']]
-y = data['Classification']
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    # Apply biological impact scores
+    data['Bio_Impact'] = data['Mutation_Type'].map(bio_impact_map)
+    data['Classification'] = data['Bio_Impact'].apply(lambda x: 0 if x == 0.0 else 1)
+    data = data.dropna(subset=['Reference_Codon', 'Query_Codon', 'Mutation_Type', 'Bio_Impact', 'Classification'])
 
-# Train the model
-model = RandomForestClassifier(random_state=42, class_weight='balanced')
-model.fit(X_train, y_train)
+    # Encode features
+    label_encoders = {}
+    for col in categorical_columns:
+        le = LabelEncoder()
+        data[col] = le.fit_transform(data[col])
+        label_encoders[col] = le
+
+    # Prepare features and target
+    X = data[features]
+    y = data['Classification']
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+
+    # Train the model
+    model = RandomForestClassifier(random_state=42, class_weight='balanced')
+    model.fit(X_train, y_train)
+
+    return {'estimator': model, 'encoders': label_encoders, 'features': features}
+
+registry.register('mutations', [data_path], train)
 
 # Helper: Map severity
 def map_severity(bio_impact):
@@ -56,28 +72,126 @@ def map_severity(bio_impact):
     else:
         return "Severely Harmful"
 
-# Prediction function
-def predict_functionality(input_data: dict):
-    input_df = pd.DataFrame([input_data])
-
-    for col in ['Reference_Codon', 'Query_Codon', 'Mutation_Type']:
-        le = label_encoders.get(col)
-        if le:
-            try:
-                input_df[col] = le.transform(input_df[col])
-            except ValueError:
-                input_df[col] = input_df[col].apply(
-                    lambda x: -1 if x not in le.classes_ else le.transform([x])[0]
-                )
+# Codon lookup tables: a codon over the alphabet A, C, G, T, '-' is read as a base-5 number,
+# which indexes a 125 entry table holding the LabelEncoder code of that codon (or -1 if unseen)
+codon_alphabet = b'ACGT-'
+base_digits = np.full(256, -1, dtype=np.int64)
+for digit, base in enumerate(codon_alphabet):
+    base_digits[base] = digit
+codon_weights = np.array([25, 5, 1], dtype=np.int64)
 
-    mutation_type = input_data.get('Mutation_Type')
-    bio_impact = bio_impact_map.get(mutation_type, 0.5)
-    input_df['Bio_Impact'] = bio_impact
+def build_codon_table(le):
+    table = np.full(len(codon_alphabet) ** 3, -1, dtype=np.int64)
+    for code, codon in enumerate(le.classes_):
+        digits = base_digits[np.frombuffer(str(codon).encode('ascii', 'replace'), dtype=np.uint8)]
+        if len(digits) == 3 and (digits >= 0).all():
+            table[digits @ codon_weights] = code
+    return table
 
-    prediction = model.predict(input_df[['Reference_Codon', 'Query_Codon', 'Mutation_Type', 'Bio_Impact']])[0]
+def encode_codons(codons, table):
+    # Anything that is not a 3 letter codon becomes '???', which maps to -1 like an unseen label
+    text = ''.join(c if isinstance(c, str) and len(c) == 3 else '???' for c in codons)
+    digits = base_digits[np.frombuffer(text.encode('ascii', 'replace'), dtype=np.uint8)].reshape(-1, 3)
+    valid = (digits >= 0).all(axis=1)
+    return np.where(valid, table[np.where(valid, digits @ codon_weights, 0)], -1)
 
+def describe_impact(prediction, bio_impact):
     if prediction == 1:
         severity = map_severity(bio_impact)
         return f"Harmful: {severity}"
     else:
-        return "Neutral"
\ No newline at end of file
+        return "Neutral"
+
+def build_prediction_table(artifact):
+    # The model only ever sees encoded inputs: reference and query codon codes (-1 for unseen) and one
+    # (type code, Bio_Impact) pair per mutation type, so it is evaluated once on that whole grid
+    le_type = artifact.encoders['Mutation_Type']
+    type_codes = {label: code for code, label in enumerate(le_type.classes_)}
+    slot_inputs = [(-1, 0.5)]  # slot 0: unknown mutation type
+    type_slots = {}
+    for label in list(le_type.classes_) + list(bio_impact_map):
+        slot_input = (type_codes.get(label, -1), bio_impact_map.get(label, 0.5))
+        if slot_input not in slot_inputs:
+            slot_inputs.append(slot_input)
+        type_slots[label] = slot_inputs.index(slot_input)
+
+    ref_codes = np.arange(-1, len(artifact.encoders['Reference_Codon'].classes_))
+    query_codes = np.arange(-1, len(artifact.encoders['Query_Codon'].classes_))
+    slots = np.arange(len(slot_inputs))
+    ref_grid, query_grid, slot_grid = (grid.ravel() for grid in np.meshgrid(ref_codes, query_codes, slots, indexing='ij'))
+    slot_array = np.array(slot_inputs)
+    grid = pd.DataFrame({
+        'Reference_Codon': ref_grid,
+        'Query_Codon': query_grid,
+        'Mutation_Type': slot_array[slot_grid, 0].astype(np.int64),
+        'Bio_Impact': slot_array[slot_grid, 1],
+    }, columns=artifact.features)
+    predictions = artifact.estimator.predict(grid).reshape(len(ref_codes), len(query_codes), len(slots))
+
+    # Impact text per slot, indexed by the 0/1 prediction
+    impacts = [(describe_impact(0, bio), describe_impact(1, bio)) for _, bio in slot_inputs]
+    return predictions.astype(np.int8), type_slots, impacts
+
+# Lookup tables per artifact version: the live one and, in shadow mode, the candidate
+lookup_tables = {}
+
+def get_lookup_tables(artifact):
+    tables = lookup_tables.get(artifact.version)
+    if tables is None:
+        predictions, type_slots, impacts = build_prediction_table(artifact)
+        tables = {
+            'version': artifact.version,
+            'Reference_Codon': build_codon_table(artifact.encoders['Reference_Codon']),
+            'Query_Codon': build_codon_table(artifact.encoders['Query_Codon']),
+            'type_slots': type_slots,
+            'predictions': predictions,
+            'impacts': impacts,
+        }
+        if len(lookup_tables) >= 2:
+            lookup_tables.pop(next(iter(lookup_tables)))
+            cached_prediction.cache_clear()
+        lookup_tables[artifact.version] = tables
+    return tables
+
+# Batch prediction: encodes all records in one vectorized pass and reads the precomputed prediction table,
+# no sklearn call is made once the table is built
+def predict_many(records: list, artifact=None):
+    if not records:
+        return []
+    # artifact: the artifact to predict with, e.g. a shadow candidate; defaults to the live one
+    artifact = artifact or registry.load('mutations')
+    tables = get_lookup_tables(artifact)
+
+    with telemetry.timer('mutations', 'encode'):
+        type_slots = tables['type_slots']
+        slots = np.array([type_slots.get(m, 0) if isinstance(m, str) else 0
+                          for m in (record.get('Mutation_Type') for record in records)], dtype=np.int64)
+        # Codon codes are shifted by one so that unseen codons (-1) land in row/column 0
+        ref = encode_codons([record.get('Reference_Codon') for record in records], tables['Reference_Codon']) + 1
+        query = encode_codons([record.get('Query_Codon') for record in records], tables['Query_Codon']) + 1
+    telemetry.count_unseen('mutations', 'Reference_Codon', ref - 1)
+    telemetry.count_unseen('mutations', 'Query_Codon', query - 1)
+    telemetry.count_unseen('mutations', 'Mutation_Type', slots - 1)  # slot 0 is the unknown mutation type
+
+    with telemetry.timer('mutations', 'predict'):
+        predictions = tables['predictions'][ref, query, slots]
+        impacts = tables['impacts']
+        results = [impacts[slot][prediction] for slot, prediction in zip(slots.tolist(), predictions.tolist())]
+    telemetry.count_predictions('mutations', len(results))
+    return results
+
+# LRU cache for single predictions, keyed on the raw strings and the artifact version
+@lru_cache(maxsize=4096)
+def cached_prediction(reference_codon, query_codon, mutation_type, version):
+    return predict_many([{
+        'Reference_Codon': reference_codon,
+        'Query_Codon': query_codon,
+        'Mutation_Type': mutation_type,
+    }])[0]
+
+# Prediction function
+def predict_functionality(input_data: dict):
+    key = (input_data.get('Reference_Codon'), input_data.get('Query_Codon'), input_data.get('Mutation_Type'))
+    if not all(value is None or isinstance(value, str) for value in key):
+        return predict_many([input_data])[0]
+    return cached_prediction(*key, registry.load('mutations').version)
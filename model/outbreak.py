@@ -1,18 +1,40 @@
+import fcntl
+import threading
+import time
+import warnings
+from contextlib import contextmanager
+import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.preprocessing import LabelEncoder
 import os
+from model import registry, telemetry
+from model.forest import CompiledForest, compiled_forest, COMPILED_MAX_ROWS
 
-# Load dataset
+# Dataset
 data_path = os.path.join(os.path.dirname(__file__), '..', 'us_state_vaccinations.csv')
-data = pd.read_csv(data_path)
 
-# Drop missing values
-data = data.dropna(subset=['total_vaccinations', 'total_distributed', 'people_vaccinated', 'daily_vaccinations'])
+# Daily rows appended after deployment, kept in the instance folder (the persistent volume in docker-compose)
+DATA_DIR = os.environ.get('OUTBREAK_DATA_DIR') or os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..', 'instance', 'data'))
+appended_path = os.path.join(DATA_DIR, 'us_state_vaccinations_daily.csv')
 
-# Engineer a feature
-data['vacc_rate'] = data['people_vaccinated'] / (data['total_distributed'] + 1)
+# Columns of appended rows, the raw inputs the features are engineered from
+data_columns = ['date', 'location', 'total_vaccinations', 'total_distributed', 'people_vaccinated', 'daily_vaccinations']
+input_columns = ['total_vaccinations', 'total_distributed', 'people_vaccinated', 'daily_vaccinations']
+
+# Model features, in training order
+features = ['total_vaccinations', 'people_vaccinated', 'daily_vaccinations', 'vacc_rate']
+
+# Risk levels, all of them are encoded even if the training data lacks one, so that codes never change
+risk_levels = ['low', 'moderate', 'high', 'extreme']
+
+# Incremental updates: trees added per update, trees kept (oldest dropped first) and size of the rehearsal sample
+# of past rows that is trained along with the new rows, so every update sees every risk level
+TREES_PER_UPDATE = 20
+MAX_TREES = 300
+RESERVOIR_SIZE = 4000
 
 # Define risk levels (same as before)
 def classify_risk(row):
@@ -25,38 +47,230 @@ def classify_risk(row):
     else:
         return 'extreme'
 
-data['RiskLevel'] = data.apply(classify_risk, axis=1)
+# Vectorized classify_risk over a whole column
+def risk_level(vacc_rate):
+    vacc_rate = np.asarray(vacc_rate, dtype=np.float64)
+    return np.select([vacc_rate > 0.7, vacc_rate > 0.5, vacc_rate > 0.3], risk_levels[:3], default='extreme')
 
-# Encode categorical target
-label_encoder = LabelEncoder()
-data['RiskLevel_encoded'] = label_encoder.fit_transform(data['RiskLevel'])
+# Drops incomplete rows and engineers the features and the target, vectorized
+def prepare(data):
+    data = data.dropna(subset=input_columns).copy()
+    data['vacc_rate'] = data['people_vaccinated'] / (data['total_distributed'] + 1)
+    data['RiskLevel'] = risk_level(data['vacc_rate'])
+    return data
 
-# Select features and target
-X = data[['total_vaccinations', 'people_vaccinated', 'daily_vaccinations', 'vacc_rate']]
-y = data['RiskLevel_encoded']
+def risk_encoder():
+    label_encoder = LabelEncoder()
+    label_encoder.fit(risk_levels)
+    return label_encoder
 
-# Train-test split
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+# Stratified sample of past rows (features and encoded target) kept with the artifact for incremental updates
+def rehearsal_sample(data, seed=42):
+    per_level = RESERVOIR_SIZE // len(risk_levels)
+    shuffled = data.sample(frac=1, random_state=seed)
+    keep = shuffled.groupby('RiskLevel_encoded').cumcount() < per_level
+    return shuffled.loc[keep, features + ['RiskLevel_encoded']].reset_index(drop=True)
 
-# Train model
-model = RandomForestClassifier(random_state=42, class_weight='balanced')
-model.fit(X_train, y_train)
+@contextmanager
+def data_lock():
+    # Serializes appends and reads of the appended data file across processes
+    os.makedirs(DATA_DIR, exist_ok=True)
+    with open(os.path.join(DATA_DIR, '.outbreak.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
 
-# Prediction interface
-def predict_risk(input_data: dict):
-    input_df = pd.DataFrame([input_data])
+def read_appended(start=0):
+    """
+    Args:
+        start (int, optional): Number of appended rows to skip.
+
+    Returns:
+        DataFrame: The appended rows from start on, empty if there are none.
+    """
+    if not os.path.exists(appended_path):
+        return pd.DataFrame(columns=data_columns)
+    return pd.read_csv(appended_path, skiprows=range(1, start + 1))
+
+def append_rows(rows):
+    """
+    Appends daily vaccination rows to the appended data file.
+
+    Args:
+        rows (DataFrame): Rows with at least the input columns; 'date' and 'location' are kept when present.
+
+    Returns:
+        int: Number of rows appended.
+
+    Raises:
+        ValueError: Input columns are missing or not numeric.
+    """
+    missing_cols = [col for col in input_columns if col not in rows.columns]
+    if missing_cols:
+        raise ValueError(f"Missing columns in input data: {missing_cols}")
+    rows = rows.reindex(columns=data_columns)
+    for col in input_columns:
+        converted = pd.to_numeric(rows[col], errors='coerce')
+        bad = rows[col][converted.isna() & rows[col].notna()]
+        if len(bad):
+            raise ValueError(f"Non-numeric values in column '{col}': {bad.head(3).tolist()}")
+        rows[col] = converted
+    with data_lock():
+        exists = os.path.exists(appended_path)
+        rows.to_csv(appended_path, mode='a', header=not exists, index=False)
+    return len(rows)
+
+# Training: run by the registry build step (train_model.py), never at import time
+def train():
+    # Load dataset, base CSV plus every appended daily row
+    with data_lock():
+        appended = read_appended()
+    data = prepare(pd.concat([pd.read_csv(data_path), appended], ignore_index=True))
+
+    # Encode categorical target
+    label_encoder = risk_encoder()
+    data['RiskLevel_encoded'] = label_encoder.transform(data['RiskLevel'])
+
+    # Select features and target
+    X = data[features]
+    y = data['RiskLevel_encoded']
+
+    # Train-test split
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+
+    # Train model
+    model = RandomForestClassifier(random_state=42, class_weight='balanced')
+    model.fit(X_train, y_train)
 
-    # Feature engineering (vacc_rate must be created for new input)
-    input_df['vacc_rate'] = input_df['people_vaccinated'] / (input_df['total_distributed'] + 1)
+    return {'estimator': model, 'encoders': {'RiskLevel': label_encoder}, 'features': features,
+            'extras': {'forest': CompiledForest(model), 'appended_rows': len(appended), 'updates': 0,
+                       'rehearsal': rehearsal_sample(data)}}
+
+registry.register('outbreak', [data_path], train, optional=[appended_path])
+
+def update():
+    """
+    Brings the outbreak model up to date with the appended rows it has not seen yet.
+
+    The current forest is warm-started: TREES_PER_UPDATE new trees are fitted on the new rows plus the
+    rehearsal sample of past rows, the oldest trees beyond MAX_TREES are dropped, and the result is
+    published as a new artifact version.  Artifacts without incremental state get a full rebuild.
+
+    Returns:
+        Artifact: The current artifact after the update.
+    """
+    registry.load('outbreak')  # builds the first artifact if there is none, outside the build lock
+    with registry.build_lock('outbreak'):
+        artifact = registry.current('outbreak')
+        start = artifact.extras.get('appended_rows')
+        if start is None or 'rehearsal' not in artifact.extras:
+            return registry.build('outbreak')
+
+        with data_lock():
+            new_rows = read_appended(start)
+            data_hash = registry.data_hash(registry.datasets('outbreak'))
+        if new_rows.empty:
+            return artifact
+
+        label_encoder = artifact.encoders['RiskLevel']
+        new_data = prepare(new_rows)
+        new_data['RiskLevel_encoded'] = label_encoder.transform(new_data['RiskLevel'])
+        batch = pd.concat([new_data[features + ['RiskLevel_encoded']], artifact.extras['rehearsal']], ignore_index=True)
+
+        model = artifact.estimator
+        if not np.array_equal(np.unique(batch['RiskLevel_encoded']), model.classes_):
+            # New trees must vote over the same classes as the old ones
+            return registry.build('outbreak')
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', UserWarning)  # 'balanced' class weights with warm_start
+            model.set_params(warm_start=True, n_estimators=len(model.estimators_) + TREES_PER_UPDATE)
+            model.fit(batch[features], batch['RiskLevel_encoded'])
+        model.estimators_ = model.estimators_[-MAX_TREES:]
+        model.set_params(warm_start=False, n_estimators=len(model.estimators_))
+
+        updates = artifact.extras.get('updates', 0) + 1
+        return registry.publish(registry.Artifact(
+            'outbreak',
+            model,
+            encoders=artifact.encoders,
+            features=artifact.features,
+            data_hash=data_hash,
+            extras={
+                'forest': CompiledForest(model),
+                'appended_rows': start + len(new_rows),
+                'updates': updates,
+                'rehearsal': rehearsal_sample(pd.concat([artifact.extras['rehearsal'], new_data], ignore_index=True)),
+            },
+            revision=f"u{updates}",
+        ))
+
+# Background updates: one thread per process; updates requested while one runs are folded into one more run
+update_status = {'state': 'idle', 'version': None, 'error': None, 'finished': None}
+_update_lock = threading.Lock()
+_update_requested = False
+
+def _run_updates():
+    global _update_requested
+    while True:
+        with _update_lock:
+            if not _update_requested:
+                update_status['state'] = 'idle'
+                return
+            _update_requested = False
+        try:
+            artifact = update()
+            update_status.update(version=artifact.version, error=None, finished=time.time())
+        except Exception as e:
+            update_status.update(error=str(e), finished=time.time())
+            print(f"Outbreak model update failed: {e}")
+
+def schedule_update():
+    """
+    Starts a background update of the outbreak model, or queues one more run if an update is running.
+
+    Returns:
+        bool: True if a new background thread was started.
+    """
+    global _update_requested
+    with _update_lock:
+        _update_requested = True
+        if update_status['state'] == 'running':
+            return False
+        update_status['state'] = 'running'
+    threading.Thread(target=_run_updates, name='outbreak-update', daemon=True).start()
+    return True
+
+# Batch prediction: small batches are walked through the compiled forest, large ones through sklearn
+def predict_many(records: list):
+    if len(records) == 0:
+        return []
+    artifact = registry.load('outbreak')
+    inputs = ['total_vaccinations', 'people_vaccinated', 'daily_vaccinations', 'total_distributed']
 
     # Make sure all columns exist
-    required_cols = ['total_vaccinations', 'people_vaccinated', 'daily_vaccinations', 'vacc_rate']
-    missing_cols = [col for col in required_cols if col not in input_df.columns]
+    missing_cols = [col for col in inputs if not any(col in record for record in records)]
     if missing_cols:
         raise ValueError(f"Missing columns in input data: {missing_cols}")
+    with telemetry.timer('outbreak', 'encode'):
+        columns = {col: np.array([record.get(col, np.nan) for record in records], dtype=np.float64) for col in inputs}
 
-    prediction = model.predict(input_df[required_cols])[0]
+        # Feature engineering (vacc_rate must be created for new input)
+        columns['vacc_rate'] = columns['people_vaccinated'] / (columns['total_distributed'] + 1)
+        X = np.column_stack([columns[col] for col in artifact.features])
+    telemetry.sketch_inputs('outbreak', artifact.features, X)
 
-    # Map encoded output back to readable label
-    risk_labels = label_encoder.inverse_transform([prediction])[0]
-    return risk_labels
\ No newline at end of file
+    with telemetry.timer('outbreak', 'predict'):
+        if len(X) <= COMPILED_MAX_ROWS:
+            predictions = compiled_forest(artifact).predict(X)
+        else:
+            predictions = artifact.estimator.predict(pd.DataFrame(X, columns=artifact.features))
+    telemetry.count_predictions('outbreak', len(X))
+
+    # Map encoded output back to readable labels
+    return artifact.encoders['RiskLevel'].inverse_transform(predictions).tolist()
+
+# Prediction interface
+def predict_risk(input_data: dict):
+    return predict_many([input_data])[0]
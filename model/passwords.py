@@ -0,0 +1,136 @@
+# passwords.py
+import functools
+import hmac
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+from __init__ import app
+
+"""
+Password Hashing
+
+Hashes and checks the users' passwords with PASSWORD_HASH_METHOD, scrypt by default, in a small pool of
+threads instead of the request thread:
+
+    - The KDFs of hashlib release the GIL, so a hash computed in the pool does not hold up the other threads
+      of a web worker, and at most PASSWORD_HASH_WORKERS of them run at once per process however many logins
+      arrive together.  A login that finds PASSWORD_HASH_MAX_PENDING hashes running or waiting gets
+      HashingBusy straight away (it answers 503) instead of queueing.  This needs threaded web workers: the
+      Dockerfile runs gunicorn with gthread workers, and MAX_PENDING stays below their --threads so that a
+      login storm leaves threads free for every other route.  With sync workers a process only ever has
+      one hash in flight and the bound never applies.
+    - A password hashed with another method (the former pbkdf2:sha256) is checked as before and, when it
+      matches, hashed again with the current method: verify() returns the new hash for the caller to store.
+    - The hash of DEFAULT_PASSWORD is derived once per process and reused, so creating many users with the
+      default password costs one KDF.  Such users share that hash, which reveals nothing: the default
+      password is the same for all of them anyway.
+"""
+
+METHOD = app.config['PASSWORD_HASH_METHOD']
+WORKERS = app.config['PASSWORD_HASH_WORKERS']
+MAX_PENDING = app.config['PASSWORD_HASH_MAX_PENDING']
+
+
+class HashingBusy(Exception):
+    """Raised when as many hashes as allowed are already waiting for the pool."""
+
+
+_pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='password-hash')
+_slots = threading.BoundedSemaphore(MAX_PENDING)
+
+
+def _submit(function, *args, block=False):
+    # Runs function in the pool, holding one of the MAX_PENDING slots until it is done
+    if not _slots.acquire(blocking=block):
+        raise HashingBusy("Too many passwords are being hashed, try again shortly")
+    try:
+        future = _pool.submit(function, *args)
+    except BaseException:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    return future
+
+
+@functools.lru_cache(maxsize=4)
+def _memoized(password, method):
+    return generate_password_hash(password, method)
+
+
+def _method(pwhash):
+    return pwhash.split('$', 1)[0]
+
+
+def needs_rehash(pwhash):
+    """
+    Args:
+        pwhash (str): A stored password hash.
+
+    Returns:
+        bool: Whether the hash was made with another method than PASSWORD_HASH_METHOD.
+    """
+    return _method(pwhash) != METHOD
+
+
+def hash_password(password, block=False):
+    """
+    Hashes a password with PASSWORD_HASH_METHOD in the pool.
+
+    Args:
+        password (str): The password.
+        block (bool, optional): Wait for a free slot instead of raising HashingBusy.
+
+    Returns:
+        str: The hash, in werkzeug's format.
+    """
+    if password == app.config['DEFAULT_PASSWORD']:
+        return _memoized(password, METHOD)
+    return _submit(generate_password_hash, password, METHOD, block=block).result()
+
+
+def hash_many(passwords):
+    """
+    Hashes passwords for bulk imports, PASSWORD_HASH_WORKERS at a time so that logins still get their turn.
+
+    Args:
+        passwords (list): The passwords.
+
+    Returns:
+        list: Their hashes, in the same order.
+    """
+    hashes = [None] * len(passwords)
+    running = deque()
+    for i, password in enumerate(passwords):
+        if password == app.config['DEFAULT_PASSWORD']:
+            hashes[i] = _memoized(password, METHOD)
+            continue
+        if len(running) >= WORKERS:
+            j, future = running.popleft()
+            hashes[j] = future.result()
+        running.append((i, _submit(generate_password_hash, password, METHOD, block=True)))
+    for j, future in running:
+        hashes[j] = future.result()
+    return hashes
+
+
+def verify(pwhash, password):
+    """
+    Checks a password against its stored hash in the pool.
+
+    Args:
+        pwhash (str): The stored hash.
+        password (str): The password to check.
+
+    Returns:
+        tuple: (matches, new hash to store or None); a new hash is given when the stored one was made with
+            another method.
+    """
+    default = app.config['DEFAULT_PASSWORD']
+    if hmac.compare_digest(password.encode(), default.encode()) and \
+            hmac.compare_digest(pwhash.encode(), _memoized(default, METHOD).encode()):
+        # The shared hash of the default password, no need to derive it again
+        return True, None
+    if not _submit(check_password_hash, pwhash, password).result():
+        return False, None
+    return True, hash_password(password, block=True) if needs_rehash(pwhash) else None
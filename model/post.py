@@ -6,6 +6,7 @@ from sqlalchemy.exc import IntegrityError
 from __init__ import app, db
 from model.user import User
 from model.channel import Channel
+from model.bulk import BulkLoader, Reference
 
 class Post(db.Model):
     """
@@ -163,6 +164,26 @@ class Post(db.Model):
             db.session.rollback()
             raise e
         
+    @staticmethod
+    def bulk_loader(user_id):
+        """
+        The loader for /api/posts and seeding, see model/bulk.py.
+
+        Args:
+            user_id (int): The author of the posts.
+
+        Returns:
+            BulkLoader: Creates posts from rows with 'title', 'comment', 'channel_id' or 'channel_name', and 'content'.
+        """
+        return BulkLoader(
+            Post,
+            fields={'title': '_title', 'comment': '_comment', 'content': '_content'},
+            required=['title', 'comment', ('channel_id', 'channel_name')],
+            references=[Reference('channel_id', Channel, 'id', '_channel_id'),
+                        Reference('channel_name', Channel, '_name', '_channel_id')],
+            defaults={'_content': {}, '_user_id': user_id},
+        )
+
     @staticmethod
     def restore(data):
         for post_data in data:
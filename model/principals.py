@@ -0,0 +1,165 @@
+# principals.py
+import collections
+import os
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached, object_session
+from __init__ import app, db
+from model.user import User
+
+"""
+Principal Cache
+
+token_required (api/jwt_authorize.py) authenticates every guarded request by verifying the JWT's HMAC
+signature and loading the user from the database.  This per-process cache remembers, for AUTH_CACHE_TTL
+seconds, the decoded claims of every token it has verified together with a snapshot of its user's columns,
+so a repeated token costs a dictionary lookup instead of a signature check and a query:
+
+    - Entries are keyed by the token itself: a token seen before has had its signature verified already,
+      and any change to the token misses the cache.  A token's 'exp' claim still ends its entry.
+    - The snapshot is merged into the request's session without loading (Session.merge(load=False)), so the
+      endpoint gets a normal User it can update, and relationships still load on access.
+    - Any update or delete of a user, a role change included, empties the cache of this process when it is
+      flushed, and of every other process (gunicorn workers, job workers) through the modification time of
+      a stamp file in the instance folder, which is checked with one stat() per lookup.  The TTL bounds what
+      a change made behind the ORM's back (raw SQL, another application) can leave stale.
+"""
+
+TTL = float(os.environ.get('AUTH_CACHE_TTL') or 60)
+MAX_ENTRIES = int(os.environ.get('AUTH_CACHE_SIZE') or 10000)
+
+# Touched whenever a user changes, shared by all processes that use the instance folder
+STAMP_PATH = os.path.join(app.instance_path, 'principals.stamp')
+
+# Mapped attributes are named like their columns; read from the table so the mappers need not be configured yet
+_COLUMNS = [column.key for column in User.__table__.columns]
+
+
+def _stamp():
+    try:
+        return os.stat(STAMP_PATH).st_mtime_ns
+    except OSError:
+        return None
+
+
+class PrincipalCache:
+    """
+    PrincipalCache
+
+    Attributes:
+        ttl (float): Seconds an entry is used before the token is verified and its user loaded again.
+        max_entries (int): Entries kept, least recently used ones are dropped first.
+        hits (int): Lookups answered from the cache.
+        misses (int): Lookups that were not.
+    """
+
+    def __init__(self, ttl=TTL, max_entries=MAX_ENTRIES):
+        """
+        Constructor, 1st step in object creation.
+
+        Args:
+            ttl (float, optional): Seconds an entry is used.
+            max_entries (int, optional): Entries kept.
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()  # token -> (claims, detached user snapshot, expiry)
+        self._lock = threading.Lock()
+        self._stamp = _stamp()
+
+    def lookup(self, token):
+        """
+        Args:
+            token (str): The JWT of the request.
+
+        Returns:
+            tuple: (claims, User attached to the current session), or None when the token is not cached.
+        """
+        if self.ttl <= 0:
+            return None
+        stamp = _stamp()
+        with self._lock:
+            if stamp != self._stamp:
+                # A user changed in another process
+                self._entries.clear()
+                self._stamp = stamp
+            entry = self._entries.get(token)
+            if entry is None or entry[2] <= time.time():
+                if entry is not None:
+                    del self._entries[token]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+        claims, snapshot, _ = entry
+        # merge() copies the snapshot's state into an instance of this session, the snapshot stays detached
+        return claims, db.session.merge(snapshot, load=False)
+
+    def store(self, token, claims, user):
+        """
+        Args:
+            token (str): A JWT whose signature was verified.
+            claims (dict): Its decoded claims.
+            user (User): The user it authenticates, as loaded from the database.
+        """
+        if self.ttl <= 0:
+            return
+        expiry = time.time() + self.ttl
+        if isinstance(claims.get('exp'), (int, float)):
+            expiry = min(expiry, claims['exp'])
+        # A detached copy of the columns only: the request's instance is expired by its commits and closed with it
+        snapshot = User.__mapper__.class_manager.new_instance()
+        for key in _COLUMNS:
+            setattr(snapshot, key, getattr(user, key))
+        make_transient_to_detached(snapshot)
+        with self._lock:
+            self._entries[token] = (claims, snapshot, expiry)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Empties the cache of this process.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+# One cache per process
+cache = PrincipalCache()
+
+
+def invalidate():
+    """
+    Empties the principal cache of every process, e.g. after users were changed with raw SQL.
+    """
+    cache.clear()
+    try:
+        with open(STAMP_PATH, 'a'):
+            os.utime(STAMP_PATH)
+    except OSError as e:
+        print(f"Could not touch the principal cache stamp {STAMP_PATH}: {e}")
+    cache._stamp = _stamp()
+
+
+def _user_changed(mapper, connection, target):
+    # Emptied at flush, so the rest of the request already sees the change, and again after the commit, so
+    # that a lookup between the two cannot cache the old row
+    invalidate()
+    session = object_session(target)
+    if session is not None:
+        session.info['principals_changed'] = True
+
+
+for _event in ('after_update', 'after_delete'):
+    event.listen(User, _event, _user_changed)
+
+
+@event.listens_for(Session, 'after_commit')
+def _after_commit(session):
+    if session.info.pop('principals_changed', False):
+        invalidate()
@@ -0,0 +1,453 @@
+# registry.py
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import joblib
+
+"""
+Model Registry
+
+Trained ML models are built once by an offline step (see train_model.py) and saved as versioned
+artifact files.  Web workers and CLI commands load the artifact lazily, the first time a prediction
+is requested, instead of fitting a RandomForest every time a module is imported.
+
+Layout of the artifact directory:
+    <ARTIFACT_DIR>/<name>/<version>.joblib   the pickled Artifact (estimator, encoders, features, ...)
+    <ARTIFACT_DIR>/<name>/current.json       manifest naming the version that workers should load
+    <ARTIFACT_DIR>/<name>/candidate.json     manifest of a candidate version evaluated in shadow mode (optional),
+                                             promote() renames it over current.json
+"""
+
+# Artifacts live in the instance folder, which is the persistent volume in docker-compose
+ARTIFACT_DIR = os.environ.get('MODEL_ARTIFACT_DIR') or os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..', 'instance', 'models'))
+
+# Bump when the Artifact layout changes, so that stale artifacts are rebuilt instead of loaded
+FORMAT_VERSION = 1
+
+# Seconds between checks of a model's manifest for a newly published artifact
+CHECK_INTERVAL = float(os.environ.get('MODEL_CHECK_INTERVAL') or 5)
+
+# Number of published artifact files kept per model, older ones are deleted (workers that still map one keep it
+# readable until they swap, the file is only unlinked)
+KEEP_VERSIONS = 3
+
+# Large numpy arrays in an artifact (e.g. forest node tables) are memory-mapped read-only on load,
+# so every worker process shares the same pages of the artifact file
+MMAP_MODE = 'r'
+
+
+class Artifact:
+    """
+    Artifact
+
+    A trained model together with everything needed to turn raw input into a prediction.
+
+    Attributes:
+        name (str): The registry name of the model, e.g. 'mutations'.
+        estimator (object): The fitted scikit-learn estimator.
+        encoders (dict): Fitted LabelEncoders keyed by column name.
+        features (list): The ordered list of feature columns the estimator was trained on.
+        data_hash (str): SHA-256 of the training data the estimator was fitted from.
+        version (str): Version string of the artifact, derived from the format and data hash.
+        extras (dict): Any additional model specific objects.
+        revision (str): Tells apart artifacts trained from the same data, e.g. incremental updates.
+    """
+
+    def __init__(self, name, estimator, encoders=None, features=None, data_hash='', extras=None, revision=''):
+        """
+        Constructor, 1st step in object creation.
+
+        Args:
+            name (str): The registry name of the model.
+            estimator (object): The fitted scikit-learn estimator.
+            encoders (dict, optional): Fitted LabelEncoders keyed by column name.
+            features (list, optional): Ordered feature columns.
+            data_hash (str, optional): SHA-256 of the training data.
+            extras (dict, optional): Additional model specific objects.
+            revision (str, optional): Suffix of the version for artifacts trained from the same data.
+        """
+        self.name = name
+        self.estimator = estimator
+        self.encoders = encoders or {}
+        self.features = list(features or [])
+        self.data_hash = data_hash
+        self.extras = extras or {}
+        self.revision = revision
+        self.version = f"{FORMAT_VERSION}-{data_hash[:12]}" + (f"-{revision}" if revision else '')
+
+    def __repr__(self):
+        """
+        Returns:
+            str: A text representation of the artifact.
+        """
+        return f"Artifact(name={self.name}, version={self.version}, features={self.features})"
+
+
+# name -> (datasets, train function, optional datasets), filled in by each model module at import time
+_trainers = {}
+# name -> loaded Artifact, one per process
+_loaded = {}
+# name -> time of the last manifest check
+_checked = {}
+# name -> (loaded candidate Artifact or None, time of the last candidate manifest check)
+_candidates = {}
+_lock = threading.Lock()
+
+
+def register(name, datasets, train, optional=None):
+    """
+    Registers a model so that it can be built and loaded through the registry.
+
+    Args:
+        name (str): The registry name of the model.
+        datasets (list): Paths of the files the model is trained from, used for the training-data hash.
+        train (function): Zero argument function returning a dict with 'estimator' and optionally
+            'encoders', 'features' and 'extras'.
+        optional (list, optional): Paths of training files that may not exist yet (e.g. appended data),
+            part of the training-data hash when they do.
+    """
+    _trainers[name] = (list(datasets), train, list(optional or []))
+
+
+def datasets(name):
+    """
+    Args:
+        name (str): The registry name of the model.
+
+    Returns:
+        list: Paths of all training files of the model, required and optional.
+    """
+    required, _, optional = _trainers[name]
+    return required + optional
+
+
+def data_hash(datasets):
+    """
+    Computes the SHA-256 of the training data files.
+
+    Args:
+        datasets (list): Paths of the training data files.
+
+    Returns:
+        str: The hex digest over the contents of all existing files.
+    """
+    digest = hashlib.sha256()
+    for path in datasets:
+        if not os.path.exists(path):
+            continue
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def _model_dir(name):
+    return os.path.join(ARTIFACT_DIR, name)
+
+
+def _manifest_path(name):
+    return os.path.join(_model_dir(name), 'current.json')
+
+
+def _candidate_path(name):
+    return os.path.join(_model_dir(name), 'candidate.json')
+
+
+def _read_manifest(name, path=None):
+    try:
+        with open(path or _manifest_path(name)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('format') != FORMAT_VERSION:
+        return None
+    return manifest
+
+
+def _write_json(path, data):
+    """Writes JSON to a temporary file and renames it over path, so readers never see a partial file."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def build(name, candidate=False):
+    """
+    Trains a registered model and saves it as the current artifact.
+
+    Args:
+        name (str): The registry name of the model.
+        candidate (bool, optional): Save it as the candidate artifact instead, evaluated in shadow mode
+            until it is promoted.
+
+    Returns:
+        Artifact: The freshly trained artifact.
+
+    Raises:
+        KeyError: The model is not registered.
+        FileNotFoundError: A training data file is missing.
+    """
+    required, train, _ = _trainers[name]
+    missing = [path for path in required if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(f"Training data for '{name}' not found: {missing}")
+
+    payload = train()
+    artifact = Artifact(
+        name,
+        payload['estimator'],
+        encoders=payload.get('encoders'),
+        features=payload.get('features'),
+        data_hash=data_hash(datasets(name)),
+        extras=payload.get('extras'),
+        # A candidate trained from the same data as the current artifact must not overwrite its file
+        revision=f"c{int(time.time())}" if candidate else '',
+    )
+    return publish(artifact, candidate=candidate)
+
+
+def publish(artifact, candidate=False):
+    """
+    Saves an artifact and makes it the current version of its model.
+
+    The artifact file is written first and the manifest is swapped in afterwards, so workers keep
+    loading the previous version until the new one is complete; they pick it up on their next
+    manifest check without a restart.
+
+    Args:
+        artifact (Artifact): The artifact to publish.
+        candidate (bool, optional): Make it the candidate version instead of the current one.
+
+    Returns:
+        Artifact: The published artifact.
+    """
+    name = artifact.name
+    os.makedirs(_model_dir(name), exist_ok=True)
+    path = os.path.join(_model_dir(name), f"{artifact.version}.joblib")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    # No compression, compressed pickles cannot be memory-mapped
+    joblib.dump(artifact, tmp_path)
+    os.replace(tmp_path, path)
+    _write_json(_candidate_path(name) if candidate else _manifest_path(name), {
+        'name': name,
+        'format': FORMAT_VERSION,
+        'version': artifact.version,
+        'data_hash': artifact.data_hash,
+        'features': artifact.features,
+        'file': os.path.basename(path),
+    })
+    _prune(name)
+    return artifact
+
+
+def _prune(name):
+    # Versions named by the manifests are kept whatever their age
+    manifests = [_read_manifest(name), _read_manifest(name, _candidate_path(name))]
+    keep = {manifest['file'] for manifest in manifests if manifest}
+    files = sorted((os.path.join(_model_dir(name), f) for f in os.listdir(_model_dir(name))
+                    if f.endswith('.joblib') and f not in keep),
+                   key=os.path.getmtime, reverse=True)
+    for path in files[max(KEEP_VERSIONS - len(keep), 0):]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+@contextmanager
+def build_lock(name):
+    """
+    Holds the model's build lock, shared by all processes, while building or replacing its artifact.
+    The lock is not reentrant: do not call load() for a model without an artifact while holding it.
+
+    Args:
+        name (str): The registry name of the model.
+    """
+    os.makedirs(_model_dir(name), exist_ok=True)
+    with open(os.path.join(_model_dir(name), '.build.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def published(name):
+    """
+    Args:
+        name (str): The registry name of the model.
+
+    Returns:
+        bool: Whether the model has a usable artifact on disk.
+    """
+    return _read_manifest(name) is not None
+
+
+def current(name):
+    """
+    Reads the current artifact of a model from disk, bypassing this process's loaded copy.
+
+    Args:
+        name (str): The registry name of the model.
+
+    Returns:
+        Artifact: The artifact named by the manifest, or None if there is none.
+    """
+    manifest = _read_manifest(name)
+    if manifest is None:
+        return None
+    return joblib.load(os.path.join(_model_dir(name), manifest['file']), mmap_mode=MMAP_MODE)
+
+
+def candidate_version(name):
+    """
+    Args:
+        name (str): The registry name of the model.
+
+    Returns:
+        str: The version named by the candidate manifest, or None if the model has no candidate.
+    """
+    manifest = _read_manifest(name, _candidate_path(name))
+    return manifest['version'] if manifest else None
+
+
+def load_candidate(name):
+    """
+    Gets the candidate artifact of a model, re-reading its manifest every CHECK_INTERVAL seconds.
+
+    Args:
+        name (str): The registry name of the model.
+
+    Returns:
+        Artifact: The candidate artifact, or None if the model has no candidate.
+    """
+    artifact, checked = _candidates.get(name, (None, None))
+    now = time.monotonic()
+    if checked is not None and now - checked < CHECK_INTERVAL:
+        return artifact
+    manifest = _read_manifest(name, _candidate_path(name))
+    if manifest is None:
+        artifact = None
+    elif artifact is None or artifact.version != manifest['version']:
+        try:
+            artifact = joblib.load(os.path.join(_model_dir(name), manifest['file']), mmap_mode=MMAP_MODE)
+        except OSError:
+            artifact = None  # promoted or discarded meanwhile
+    _candidates[name] = (artifact, now)
+    return artifact
+
+
+def promote(name):
+    """
+    Makes the candidate artifact of a model its current version.  The candidate manifest is renamed over
+    the current one, a single atomic step; workers switch on their next manifest check.
+
+    Args:
+        name (str): The registry name of the model.
+
+    Returns:
+        str: The promoted version.
+
+    Raises:
+        FileNotFoundError: The model has no candidate.
+    """
+    with build_lock(name):
+        manifest = _read_manifest(name, _candidate_path(name))
+        if manifest is None:
+            raise FileNotFoundError(f"No candidate artifact for model '{name}'")
+        os.replace(_candidate_path(name), _manifest_path(name))
+    reload(name)
+    _candidates.pop(name, None)
+    return manifest['version']
+
+
+def discard_candidate(name):
+    """
+    Drops the candidate artifact of a model, ending its shadow evaluation.
+
+    Args:
+        name (str): The registry name of the model.
+
+    Returns:
+        bool: Whether there was a candidate.
+    """
+    with build_lock(name):
+        try:
+            os.remove(_candidate_path(name))
+        except FileNotFoundError:
+            return False
+        _prune(name)
+    _candidates.pop(name, None)
+    return True
+
+
+def _load_or_build(name):
+    """Loads the current artifact, building it first if no usable artifact exists."""
+    artifact = current(name)
+    if artifact is None:
+        # Only one process builds a missing artifact, the others wait and then load it
+        with build_lock(name):
+            artifact = current(name)
+            if artifact is None:
+                print(f"No artifact for model '{name}', training it now (run train_model.py to prebuild)")
+                artifact = build(name)
+    return artifact
+
+
+def load(name):
+    """
+    Gets the artifact for a model, loading it on first use in this process.
+
+    Every CHECK_INTERVAL seconds the manifest is re-read; when it names a different version
+    (a retrained model was published) the new artifact is loaded and swapped in, so that
+    callers comparing artifact.version can drop anything derived from the old one.
+
+    Args:
+        name (str): The registry name of the model.
+
+    Returns:
+        Artifact: The loaded artifact.
+    """
+    artifact = _loaded.get(name)
+    now = time.monotonic()
+    if artifact is not None:
+        if now - _checked.get(name, now) < CHECK_INTERVAL:
+            return artifact
+        _checked[name] = now
+        manifest = _read_manifest(name)
+        if manifest is None or manifest['version'] == artifact.version:
+            return artifact
+    with _lock:
+        current = _loaded.get(name)
+        if current is None or current is artifact:
+            current = _load_or_build(name)
+            _loaded[name] = current
+            _checked[name] = now
+    return current
+
+
+def reload(name):
+    """
+    Drops the cached artifact of a model so that the next load() reads the current one from disk.
+
+    Args:
+        name (str): The registry name of the model.
+    """
+    with _lock:
+        _loaded.pop(name, None)
+        _checked.pop(name, None)
+
+
+def registered():
+    """
+    Returns:
+        list: The names of all registered models.
+    """
+    return sorted(_trainers)
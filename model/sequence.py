@@ -0,0 +1,386 @@
+# sequence.py
+from fractions import Fraction
+from functools import lru_cache
+import math
+import numpy as np
+
+"""
+Sequence Features
+
+Vectorized features of a DNA strand: GC content, k-mer frequency spectra (k = 1..6), CpG islands and
+motif / PAM site hits on both strands.
+
+The strand is encoded once into a uint8 array (A=0, C=1, G=2, T=3, anything else 4) and every feature
+is computed from array operations over it: the base-4 index of every k-mer is built from the (k-1)-mer
+indexes with one shift-and-add over offset views, the 6-mers are counted with bincount and shorter
+k-mer counts are folded from the longer ones, window sums come from cumulative sums, motifs are matched
+by AND-ing shifted views of per-base masks.  No Python loop runs over the bases, so a 1 Mbp strand takes
+well under 100 ms.
+
+SequenceFeatures keeps the encoding and the k-mer indexes of one strand, so the API features and the
+mutation context of the same request share them; encode() also keeps the last few strands encoded.
+"""
+
+MAX_K = 6
+
+# CpG island criteria (Gardiner-Garden & Frommer): 200 bp windows with GC > 50% and observed/expected CpG > 0.6
+CPG_WINDOW = 200
+CPG_MIN_GC = 0.5
+CPG_MIN_RATIO = 0.6
+
+# Motifs searched when the caller names none, IUPAC codes
+DEFAULT_MOTIFS = {
+    'SpCas9_PAM': 'NGG',
+    'SaCas9_PAM': 'NNGRRT',
+    'Cas12a_PAM': 'TTTV',
+    'TATA_box': 'TATAWAW',
+}
+# Positions reported per motif and strand, counts are always complete
+MAX_HITS = 1000
+
+# ASCII -> base code
+_CODES = np.full(256, 4, dtype=np.uint8)
+for _code, _base in enumerate(b'ACGT'):
+    _CODES[_base] = _code
+    _CODES[_base + 32] = _code  # lower case
+
+# IUPAC code -> allowed bases, unknown bases never match
+IUPAC = {
+    'A': 'A', 'C': 'C', 'G': 'G', 'T': 'T', 'U': 'T',
+    'R': 'AG', 'Y': 'CT', 'S': 'CG', 'W': 'AT', 'K': 'GT', 'M': 'AC',
+    'B': 'CGT', 'D': 'AGT', 'H': 'ACT', 'V': 'ACG', 'N': 'ACGT',
+}
+_COMPLEMENT = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A', 'U': 'A', 'R': 'Y', 'Y': 'R', 'S': 'S', 'W': 'W',
+               'K': 'M', 'M': 'K', 'B': 'V', 'V': 'B', 'D': 'H', 'H': 'D', 'N': 'N'}
+
+
+def encode_bytes(data):
+    """
+    Args:
+        data (bytes): A DNA sequence as ASCII bytes, e.g. read from a FASTA file.
+
+    Returns:
+        numpy.ndarray: uint8 codes, A=0, C=1, G=2, T=3, anything else 4.
+    """
+    return _CODES[np.frombuffer(data, dtype=np.uint8)]
+
+
+@lru_cache(maxsize=4)
+def encode(strand):
+    """
+    Args:
+        strand (str): The DNA strand.
+
+    Returns:
+        numpy.ndarray: Read-only uint8 codes, see encode_bytes().
+    """
+    codes = encode_bytes(strand.encode('ascii', 'replace'))
+    codes.flags.writeable = False
+    return codes
+
+
+def kmer_labels(k):
+    """
+    Args:
+        k (int): The k-mer length.
+
+    Returns:
+        list: All 4**k k-mers in index order (AA..A, AA..C, ...), the order of the spectra.
+    """
+    labels = np.array([''])
+    for _ in range(k):
+        labels = np.char.add(labels[:, None], np.array(list('ACGT'))[None, :]).ravel()
+    return labels.tolist()
+
+
+def reverse_complement(motif):
+    """
+    Args:
+        motif (str): An IUPAC motif.
+
+    Returns:
+        str: The motif of the opposite strand.
+    """
+    return ''.join(_COMPLEMENT[base] for base in reversed(motif.upper()))
+
+
+def _motif_bases(motif):
+    # Allowed bases at every position of an IUPAC motif
+    if not isinstance(motif, str) or not motif or any(base not in IUPAC for base in motif.upper()):
+        raise ValueError(f"Invalid motif '{motif}', use IUPAC codes")
+    return [IUPAC[base] for base in motif.upper()]
+
+
+def check_options(max_k, motifs):
+    """
+    Checks the feature options of a request body, shared by /api/sequence/features and /api/mutations.
+
+    Args:
+        max_k: Spectra are computed for k = 1..max_k.
+        motifs: Motif name -> IUPAC motif, or None for DEFAULT_MOTIFS.
+
+    Raises:
+        ValueError: max_k is not an integer between 1 and MAX_K, or motifs is not an object of name -> IUPAC motif.
+    """
+    if not isinstance(max_k, int) or isinstance(max_k, bool) or not 1 <= max_k <= MAX_K:
+        raise ValueError(f'max_k must be an integer between 1 and {MAX_K}')
+    if motifs is not None and (not isinstance(motifs, dict) or
+                               not all(isinstance(motif, str) for motif in motifs.values())):
+        raise ValueError('motifs must be an object of name -> IUPAC motif')
+    for motif in (motifs or {}).values():
+        _motif_bases(motif)
+
+
+class SequenceFeatures:
+    """
+    SequenceFeatures
+
+    Attributes:
+        codes (numpy.ndarray): The encoded strand, see encode().
+        length (int): Number of bases.
+    """
+
+    def __init__(self, strand):
+        """
+        Constructor, 1st step in object creation.
+
+        Args:
+            strand (str): The DNA strand.
+        """
+        self.codes = encode(strand)
+        self.length = len(self.codes)
+        self._kmers = {}
+        self._counts = {}
+        self._masks = {}
+        self._bits = None
+        self._cumulative = None
+        self._islands = None
+        self._unknown = None
+
+    def _unknown_starts(self, k):
+        # Start positions of the k-mers that contain an unknown base, usually none
+        if self._unknown is None:
+            self._unknown = np.flatnonzero(self.codes == 4)
+        if not len(self._unknown):
+            return self._unknown
+        starts = (self._unknown[:, None] - np.arange(k)).ravel()
+        return np.unique(starts[(starts >= 0) & (starts <= self.length - k)])
+
+    def _mask(self, allowed):
+        # Boolean array of the positions holding one of the allowed bases, per set of bases.  Every base is
+        # a bit (A=1, C=2, G=4, T=8, unknown 16), so a set of bases is tested with one AND
+        mask = self._masks.get(allowed)
+        if mask is None:
+            if self._bits is None:
+                self._bits = np.left_shift(np.uint8(1), self.codes)
+            mask = self._masks[allowed] = (self._bits & sum(1 << 'ACGT'.index(base) for base in allowed)) != 0
+        return mask
+
+    def kmer_indexes(self, k):
+        """
+        Args:
+            k (int): The k-mer length.
+
+        Returns:
+            numpy.ndarray: Base-4 index of the k-mer starting at every position, -1 where it has an unknown base.
+        """
+        indexes = self._kmers.get(k)
+        if indexes is None:
+            if self.length < k:
+                indexes = np.empty(0, dtype=np.int16)
+            elif k == 1:
+                indexes = (self.codes & 3).astype(np.int16)  # 4**MAX_K indexes fit, half the memory traffic of int32
+            else:
+                # index of the k-mer at i = 4 * index of the (k-1)-mer at i + base at i + k - 1
+                indexes = self._raw_indexes(k - 1)[:-1] * 4
+                indexes += self.codes[k - 1:] & 3
+            self._kmers[k] = indexes
+        unknown = self._unknown_starts(k)
+        if len(unknown):
+            indexes = indexes.copy()
+            indexes[unknown] = -1
+        return indexes
+
+    def _raw_indexes(self, k):
+        # Indexes with unknown bases read as A, masked by kmer_indexes()
+        if k not in self._kmers:
+            self.kmer_indexes(k)
+        return self._kmers[k]
+
+    def kmer_counts(self, k):
+        """
+        Args:
+            k (int): The k-mer length, 1 to MAX_K.
+
+        Returns:
+            numpy.ndarray: Occurrences of every k-mer in kmer_labels(k) order, k-mers with unknown bases left out.
+        """
+        unknown = self._unknown_starts(k)
+        if len(unknown):
+            # k-mers with unknown bases were counted as if those were A
+            return self._raw_counts(k) - np.bincount(self._raw_indexes(k)[unknown], minlength=4 ** k)
+        return self._raw_counts(k)
+
+    def _raw_counts(self, k):
+        counts = self._counts.get(k)
+        if counts is None:
+            if k < MAX_K and self.length > k:
+                # The k-mers are the prefixes of the (k+1)-mers, except the last one: fold the (k+1)-mer counts
+                # over their last base instead of counting again
+                counts = self._raw_counts(k + 1).reshape(-1, 4).sum(axis=1)
+                counts[self._raw_indexes(k)[-1]] += 1
+            else:
+                counts = np.bincount(self._raw_indexes(k), minlength=4 ** k)
+            self._counts[k] = counts
+        return counts
+
+    def spectrum(self, k):
+        """
+        Args:
+            k (int): The k-mer length, 1 to MAX_K.
+
+        Returns:
+            numpy.ndarray: Frequency of every k-mer in kmer_labels(k) order, k-mers with unknown bases left out.
+        """
+        counts = self.kmer_counts(k)
+        total = counts.sum()
+        return counts / total if total else counts.astype(np.float64)
+
+    def _sums(self):
+        # Cumulative counts of C+G and of CpG dinucleotides, for window sums in O(1)
+        if self._cumulative is None:
+            c = self._mask('C')
+            g = self._mask('G')
+            cpg = np.zeros(self.length, dtype=bool)
+            np.logical_and(c[:-1], g[1:], out=cpg[:-1])
+            sums = {}
+            for name, values in (('c', c), ('g', g), ('cpg', cpg)):
+                sums[name] = np.zeros(self.length + 1, dtype=np.int32)
+                np.cumsum(values, dtype=np.int32, out=sums[name][1:])
+            sums['gc'] = sums['c'] + sums['g']
+            self._cumulative = sums
+        return self._cumulative
+
+    def gc_content(self, start=0, end=None):
+        """
+        Args:
+            start (int, optional): First position.
+            end (int, optional): Position after the last one, defaults to the end of the strand.
+
+        Returns:
+            float: Fraction of G and C among the bases of the range.
+        """
+        end = self.length if end is None else end
+        start, end = max(start, 0), min(end, self.length)
+        if end <= start:
+            return 0.0
+        gc = self._sums()['gc']
+        return float(gc[end] - gc[start]) / (end - start)
+
+    def cpg_islands(self, window=CPG_WINDOW, min_gc=CPG_MIN_GC, min_ratio=CPG_MIN_RATIO):
+        """
+        Finds CpG islands: runs of overlapping windows that all pass the GC and observed/expected CpG criteria.
+
+        Args:
+            window (int, optional): Window length.
+            min_gc (float, optional): Minimum GC fraction of a window.
+            min_ratio (float, optional): Minimum observed/expected CpG ratio of a window.
+
+        Returns:
+            list: [start, end) pairs of the islands.
+        """
+        if self.length < window:
+            return []
+        sums = self._sums()
+        def window_sums(name):
+            return sums[name][window:] - sums[name][:-window]
+        gc, c, g = window_sums('gc'), window_sums('c'), window_sums('g')
+        # The last base of a window has no CpG partner inside it
+        cpg = sums['cpg'][window - 1:-1] - sums['cpg'][:-window]
+        # observed/expected = cpg * window / (c * g) > min_ratio, compared in integers without dividing
+        ratio = Fraction(min_ratio).limit_denominator(1000)
+        if window * window * ratio.denominator >= 2 ** 31:
+            cpg, c = cpg.astype(np.int64), c.astype(np.int64)
+        passing = gc > math.floor(min_gc * window)
+        passing &= cpg * (window * ratio.denominator) > (c * g) * ratio.numerator
+        passing &= cpg > 0
+
+        # Runs of passing window starts [first, last] cover [first, last + window); runs closer than a window overlap
+        edges = np.flatnonzero(np.diff(np.concatenate([[False], passing, [False]]).view(np.int8)))
+        if not len(edges):
+            return []
+        firsts, ends = edges[0::2], edges[1::2] - 1 + window
+        separate = np.concatenate([[True], firsts[1:] > ends[:-1]])
+        last_of_island = np.concatenate([separate[1:], [True]])
+        return np.column_stack([firsts[separate], ends[last_of_island]]).tolist()
+
+    def motif_hits(self, motif):
+        """
+        Args:
+            motif (str): An IUPAC motif, e.g. 'NGG'.
+
+        Returns:
+            dict: Start positions of the hits on the forward strand ('+') and of the reverse complement ('-'),
+                both in forward strand coordinates.
+        """
+        _motif_bases(motif)  # validates before the reverse complement
+        hits = {}
+        for strand, pattern in (('+', motif), ('-', reverse_complement(motif))):
+            positions = self.length - len(pattern) + 1
+            if positions <= 0:
+                hits[strand] = np.empty(0, dtype=np.int64)
+                continue
+            match = np.ones(positions, dtype=bool)
+            for i, allowed in enumerate(_motif_bases(pattern)):
+                # Shifted view of the mask of the bases allowed at motif position i
+                match &= self._mask(allowed)[i:i + positions]
+            hits[strand] = np.flatnonzero(match)
+        return hits
+
+    def features(self, max_k=MAX_K, motifs=None):
+        """
+        Args:
+            max_k (int, optional): Spectra are computed for k = 1..max_k.
+            motifs (dict, optional): Motif name -> IUPAC motif, defaults to DEFAULT_MOTIFS.
+
+        Returns:
+            dict: length, gc_content, spectra {k: {kmer: frequency}}, cpg_islands and motifs
+                {name: {'motif', 'count', '+', '-'}} with at most MAX_HITS positions per strand.
+        """
+        if not 1 <= max_k <= MAX_K:
+            raise ValueError(f"k must be between 1 and {MAX_K}")
+        motif_results = {}
+        for name, motif in (DEFAULT_MOTIFS if motifs is None else motifs).items():
+            hits = self.motif_hits(motif)
+            motif_results[name] = {
+                'motif': motif.upper(),
+                'count': {strand: int(len(positions)) for strand, positions in hits.items()},
+                **{strand: positions[:MAX_HITS].tolist() for strand, positions in hits.items()},
+            }
+        return {
+            'length': self.length,
+            'gc_content': self.gc_content(),
+            'spectra': {str(k): dict(zip(kmer_labels(k), self.spectrum(k).tolist())) for k in range(1, max_k + 1)},
+            'cpg_islands': self.cpg_islands(),
+            'motifs': motif_results,
+        }
+
+    def context(self, position, flank=50):
+        """
+        Local sequence context of a position, e.g. of a mutation.
+
+        Args:
+            position (int): Position in the strand.
+            flank (int, optional): Bases on each side included in the local GC content.
+
+        Returns:
+            dict: local_gc_content and whether the position lies in a CpG island.
+        """
+        if self._islands is None:
+            self._islands = np.array(self.cpg_islands(), dtype=np.int64).reshape(-1, 2)
+        islands = self._islands
+        i = np.searchsorted(islands[:, 0], position, side='right') - 1
+        return {
+            'local_gc_content': self.gc_content(position - flank, position + flank + 1),
+            'in_cpg_island': bool(i >= 0 and position < islands[i, 1]),
+        }
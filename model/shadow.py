@@ -0,0 +1,284 @@
+# shadow.py
+import atexit
+import collections
+import importlib
+import multiprocessing
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from model import registry, telemetry
+
+"""
+Shadow Evaluation
+
+While a model has a candidate artifact (see registry.build(name, candidate=True)), every production
+prediction batch is copied to a background queue after its result was returned.  The batch is run
+through the candidate and the live artifact, and per (live version, candidate version) are recorded:
+
+    - the confusion counts of served prediction against candidate prediction (agreement is the diagonal),
+    - the time both artifacts took for the same batches, in the same process.
+
+The predictions run in a shadow process of their own, started on the first mirrored batch at the lowest
+CPU priority (SHADOW_NICE), so they neither compete with request threads for the web worker's GIL nor take
+a slot of the inference pool; only the queue and a daemon thread waiting on that process stay in the web
+worker, which never loads a candidate artifact.  The counts are kept in a SQLite file next to the model's
+artifacts, shared by all web workers, so the comparison survives restarts.  Users never wait for the
+candidate: when the queue is full, batches are dropped and counted instead.  registry.promote() then makes
+the candidate the live version atomically.
+"""
+
+# Models that can be evaluated in shadow mode: registry name -> module whose predict_many takes artifact=
+MODELS = {
+    'mutations': 'model.mutations',
+    'editing': 'model.editing',
+}
+
+# Batches waiting for evaluation per process, further batches are dropped
+QUEUE_SIZE = int(os.environ.get('SHADOW_QUEUE_SIZE') or 256)
+# Niceness added to the shadow process, 19 gives it only the CPU time production work leaves over
+NICE = int(os.environ.get('SHADOW_NICE') or 19)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS confusion (
+    live_version TEXT, candidate_version TEXT, served TEXT, candidate TEXT, records INTEGER,
+    PRIMARY KEY (live_version, candidate_version, served, candidate)
+);
+CREATE TABLE IF NOT EXISTS latency (
+    live_version TEXT, candidate_version TEXT, batches INTEGER, records INTEGER,
+    live_seconds REAL, candidate_seconds REAL, dropped INTEGER,
+    PRIMARY KEY (live_version, candidate_version)
+);
+"""
+
+
+def _connect(name):
+    os.makedirs(os.path.join(registry.ARTIFACT_DIR, name), exist_ok=True)
+    connection = sqlite3.connect(os.path.join(registry.ARTIFACT_DIR, name, 'shadow.sqlite'), timeout=30)
+    connection.executescript(_SCHEMA)
+    return connection
+
+
+def _store(name, live_version, candidate_version, pairs, records, live_seconds, candidate_seconds, dropped):
+    connection = _connect(name)
+    try:
+        with connection:
+            connection.executemany(
+                "INSERT INTO confusion VALUES (?, ?, ?, ?, ?) ON CONFLICT DO UPDATE SET records = records + excluded.records",
+                [(live_version, candidate_version, str(served), str(candidate), count)
+                 for (served, candidate), count in pairs.items()])
+            connection.execute(
+                "INSERT INTO latency VALUES (?, ?, 1, ?, ?, ?, ?) ON CONFLICT DO UPDATE SET "
+                "batches = batches + 1, records = records + excluded.records, "
+                "live_seconds = live_seconds + excluded.live_seconds, "
+                "candidate_seconds = candidate_seconds + excluded.candidate_seconds, "
+                "dropped = dropped + excluded.dropped",
+                (live_version, candidate_version, records, live_seconds, candidate_seconds, dropped))
+    finally:
+        connection.close()
+
+
+def _init_worker():
+    # Runs once in the shadow process
+    if NICE and hasattr(os, 'nice'):
+        os.nice(NICE)
+
+
+def _compare(name, records, options):
+    # Runs in the shadow process: the batch through the live and the candidate artifact, with their timings
+    candidate = registry.load_candidate(name)
+    if candidate is None:
+        return None
+    live = registry.load(name)
+    predict_many = importlib.import_module(MODELS[name]).predict_many
+    # Not production traffic, kept out of the prediction telemetry
+    with telemetry.suspended():
+        start = time.perf_counter()
+        predict_many(records, artifact=live, **options)
+        live_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        predicted = predict_many(records, artifact=candidate, **options)
+        candidate_seconds = time.perf_counter() - start
+    return live.version, candidate.version, predicted, live_seconds, candidate_seconds
+
+
+def stats(name):
+    """
+    Shadow evaluation results of a model's current candidate.
+
+    Args:
+        name (str): The registry name of the model.
+
+    Returns:
+        dict: Versions, records compared, agreement rate, milliseconds per record of both artifacts, batches
+            dropped and the confusion counts {served: {candidate: records}}; None without a candidate.
+    """
+    candidate_version = registry.candidate_version(name)
+    if candidate_version is None:
+        return None
+    connection = _connect(name)
+    try:
+        confusion = connection.execute(
+            "SELECT live_version, served, candidate, records FROM confusion WHERE candidate_version = ?",
+            (candidate_version,)).fetchall()
+        latency = connection.execute(
+            "SELECT live_version, batches, records, live_seconds, candidate_seconds, dropped FROM latency "
+            "WHERE candidate_version = ?", (candidate_version,)).fetchall()
+    finally:
+        connection.close()
+
+    matrix = collections.defaultdict(dict)
+    agreed = total = 0
+    for _, served, predicted, count in confusion:
+        matrix[served][predicted] = matrix[served].get(predicted, 0) + count
+        total += count
+        agreed += count if served == predicted else 0
+    batches = sum(row[1] for row in latency)
+    records = sum(row[2] for row in latency)
+    return {
+        'candidate_version': candidate_version,
+        'live_versions': sorted({row[0] for row in latency}),
+        'records': total,
+        'batches': batches,
+        'dropped_batches': sum(row[5] for row in latency) + _evaluator.dropped.get(name, 0),
+        'agreement': round(agreed / total, 6) if total else None,
+        'latency_ms_per_record': {
+            'live': round(1000 * sum(row[3] for row in latency) / records, 6) if records else None,
+            'candidate': round(1000 * sum(row[4] for row in latency) / records, 6) if records else None,
+        },
+        'confusion': dict(matrix),
+    }
+
+
+class ShadowEvaluator:
+    """
+    ShadowEvaluator
+
+    Attributes:
+        max_queue (int): Maximum number of batches waiting for evaluation.
+        dropped (dict): Model name -> batches dropped since the last stored evaluation, because the queue was full.
+    """
+
+    def __init__(self, max_queue=QUEUE_SIZE):
+        """
+        Constructor, 1st step in object creation.
+
+        Args:
+            max_queue (int, optional): Maximum number of batches waiting for evaluation.
+        """
+        self.max_queue = max_queue
+        self.dropped = {}
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._pool = None
+        self._lock = threading.Lock()
+        self._checked = {}  # name -> (candidate manifest exists, time of the check)
+
+    def _shadowed(self, name):
+        # Only the small manifest is read on the request thread, the candidate is loaded by the evaluator
+        shadowed, checked = self._checked.get(name, (False, None))
+        now = time.monotonic()
+        if checked is None or now - checked >= registry.CHECK_INTERVAL:
+            shadowed = registry.candidate_version(name) is not None
+            self._checked[name] = (shadowed, now)
+        return shadowed
+
+    def mirror(self, name, records, served, options=None):
+        """
+        Queues a copy of a production batch for the candidate, if the model has one.  Never blocks.
+
+        Args:
+            name (str): The registry name of the model.
+            records (list or DataFrame): The production inputs.
+            served (list): The predictions returned to the user, one per record.
+            options (dict, optional): Keyword arguments the production predict_many was called with.
+        """
+        if name not in MODELS or not self._shadowed(name):
+            return
+        try:
+            self._queue.put_nowait((name, records, served, options or {}))
+        except queue.Full:
+            with self._lock:
+                self.dropped[name] = self.dropped.get(name, 0) + 1
+            return
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='shadow-evaluator', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            # Everything queued meanwhile is evaluated together: single predictions are merged into one batch
+            # per model, which also keeps the SQLite writes to one per batch
+            pending = [self._queue.get()]
+            while len(pending) < self.max_queue:
+                try:
+                    pending.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            merged = {}
+            for name, records, served, options in pending:
+                key = (name, tuple(sorted(options.items())))
+                if isinstance(records, list) and key in merged:
+                    merged[key][0].extend(records)
+                    merged[key][1].extend(served)
+                elif isinstance(records, list):
+                    merged[key] = (list(records), list(served), options)
+                else:
+                    self._evaluate_logged(name, records, served, options)
+            for (name, _), (records, served, options) in merged.items():
+                self._evaluate_logged(name, records, served, options)
+
+    def _evaluate_logged(self, name, records, served, options):
+        try:
+            self.evaluate(name, records, served, options)
+        except BrokenProcessPool as e:
+            # The shadow process died, e.g. killed for memory; the next batch starts a new one
+            self._pool = None
+            print(f"Shadow evaluation of model '{name}' failed: {e}")
+        except Exception as e:
+            print(f"Shadow evaluation of model '{name}' failed: {e}")
+
+    def _process(self):
+        # The shadow process, started on first use; spawn, not fork, like the inference pool
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'),
+                                             initializer=_init_worker)
+            atexit.register(self._pool.shutdown, wait=False, cancel_futures=True)
+        return self._pool
+
+    def evaluate(self, name, records, served, options=None):
+        """
+        Runs one production batch through the candidate and the live artifact in the shadow process and stores
+        the comparison.
+
+        Args:
+            name (str): The registry name of the model.
+            records (list or DataFrame): The production inputs.
+            served (list): The predictions returned to the user, one per record.
+            options (dict, optional): Keyword arguments for the model's predict_many.
+        """
+        compared = self._process().submit(_compare, name, records, options or {}).result()
+        if compared is None:
+            return
+        live_version, candidate_version, predicted, live_seconds, candidate_seconds = compared
+
+        with self._lock:
+            dropped = self.dropped.pop(name, 0)
+        _store(name, live_version, candidate_version, collections.Counter(zip(served, predicted)),
+               len(served), live_seconds, candidate_seconds, dropped)
+
+
+# One evaluator per web worker process
+_evaluator = ShadowEvaluator()
+
+
+def mirror(name, records, served, options=None):
+    """
+    Queues a copy of a production batch for shadow evaluation, see ShadowEvaluator.mirror().
+    """
+    _evaluator.mirror(name, records, served, options)
@@ -0,0 +1,230 @@
+# strand.py
+from array import array
+
+"""
+Strand Editor
+
+Applies substitutions, insertions and deletions to a DNA strand without copying or shifting the strand
+on every edit, so that whole genes and plasmids (10k - 1M bases) can be edited thousands of times per request.
+
+Edits are always addressed in coordinates of the original strand, which is what clients build their
+edit lists against.  The original bases are kept in one bytearray (1 byte per base) and the edits are
+kept as an overlay on top of it: a piece table whose pieces are implied by the edit positions.  A Fenwick
+tree over the original coordinates counts the net inserted/deleted bases in front of every position, so
+the coordinate of an original base in the edited strand is found in O(log n) no matter the edit order.
+The edited strand is only materialized once, in a single linear pass, when it is asked for.
+"""
+
+# Bases accepted in strands, N marks an unknown base
+BASES = frozenset('ACGTN')
+# Bases that edits may introduce
+EDIT_BASES = frozenset('ACGT')
+
+
+class StrandEditor:
+    """
+    StrandEditor
+
+    Attributes:
+        original (bytearray): The original strand, one ASCII byte per base.
+        substitutions (dict): Original position -> substituted base.
+        insertions (dict): Original position -> bytearray of bases inserted in front of that position.
+        deleted (set): Original positions of deleted bases.
+        shift (array): Fenwick tree over original positions holding inserted minus deleted base counts,
+            allocated on the first insertion or deletion.
+    """
+
+    def __init__(self, strand):
+        """
+        Constructor, 1st step in object creation.
+
+        Args:
+            strand (str): The original DNA strand.
+
+        Raises:
+            ValueError: The strand is empty or contains something other than A, C, G, T or N.
+        """
+        if not strand or not isinstance(strand, str):
+            raise ValueError('Strand is empty or not a string')
+        self.original = bytearray(strand.upper(), 'ascii', 'replace')
+        if not BASES.issuperset(self.original.decode('ascii')):
+            raise ValueError('Strand may only contain the bases A, C, G, T and N')
+        self.substitutions = {}
+        self.insertions = {}
+        self.deleted = set()
+        self.shift = None
+        self.length = len(self.original)
+
+    def __len__(self):
+        """
+        Returns:
+            int: The length of the edited strand.
+        """
+        return self.length
+
+    def __str__(self):
+        """
+        Returns:
+            str: The edited strand.
+        """
+        return self.edited_strand()
+
+    def _add_shift(self, pos, delta):
+        if self.shift is None:
+            self.shift = array('i', bytes(4 * (len(self.original) + 2)))
+        i = pos + 1
+        while i < len(self.shift):
+            self.shift[i] += delta
+            i += i & -i
+
+    def _shift_before(self, pos):
+        # Net inserted minus deleted bases at original positions < pos
+        total = 0
+        if self.shift is not None:
+            i = pos
+            while i > 0:
+                total += self.shift[i]
+                i -= i & -i
+        return total
+
+    def _check_base(self, base):
+        if not isinstance(base, str) or len(base) != 1 or base.upper() not in EDIT_BASES:
+            raise ValueError(f'Invalid base {base!r}')
+        return base.upper()
+
+    def _check_position(self, pos, allow_end=False):
+        limit = len(self.original) + (1 if allow_end else 0)
+        if not isinstance(pos, int) or isinstance(pos, bool) or not 0 <= pos < limit:
+            raise ValueError(f'Position {pos!r} is outside the strand (0-{limit - 1})')
+
+    def _check_present(self, pos):
+        if pos in self.deleted:
+            raise ValueError(f'Base at position {pos} was already deleted')
+
+    def edited_position(self, pos):
+        """
+        Maps an original coordinate to its coordinate in the strand as edited so far.
+
+        Args:
+            pos (int): Position in the original strand (len(strand) addresses the end).
+
+        Returns:
+            int: The position of that base, or of the gap where it was, in the edited strand.
+        """
+        return pos + self._shift_before(pos) + len(self.insertions.get(pos, b''))
+
+    def base_at(self, pos):
+        """
+        Args:
+            pos (int): Position in the original strand.
+
+        Returns:
+            str: The current base at that position.
+        """
+        self._check_position(pos)
+        self._check_present(pos)
+        return self.substitutions.get(pos) or chr(self.original[pos])
+
+    def substitute(self, pos, base):
+        """
+        Replaces the base at an original position.
+
+        Args:
+            pos (int): Position in the original strand.
+            base (str): The new base.
+
+        Returns:
+            dict: The edit with its 'position' (original), 'edited_position', 'reference' and 'query' bases.
+        """
+        base = self._check_base(base)
+        reference = self.base_at(pos)
+        self.substitutions[pos] = base
+        return {'position': pos, 'edited_position': self.edited_position(pos), 'reference': reference, 'query': base}
+
+    def insert(self, pos, base):
+        """
+        Inserts a base in front of an original position, after any bases inserted there before.
+
+        Args:
+            pos (int): Position in the original strand, len(strand) appends at the end.
+            base (str): The inserted base.
+
+        Returns:
+            dict: The edit with its 'position' (original), 'edited_position', 'reference' and 'query' bases.
+        """
+        base = self._check_base(base)
+        self._check_position(pos, allow_end=True)
+        edited_pos = self.edited_position(pos)
+        self.insertions.setdefault(pos, bytearray()).append(ord(base))
+        self._add_shift(pos, 1)
+        self.length += 1
+        return {'position': pos, 'edited_position': edited_pos, 'reference': '-', 'query': base}
+
+    def delete(self, pos):
+        """
+        Deletes the base at an original position.
+
+        Args:
+            pos (int): Position in the original strand.
+
+        Returns:
+            dict: The edit with its 'position' (original), 'edited_position', 'reference' and 'query' bases.
+        """
+        reference = self.base_at(pos)
+        edited_pos = self.edited_position(pos)
+        self.deleted.add(pos)
+        self.substitutions.pop(pos, None)
+        self._add_shift(pos, -1)
+        self.length -= 1
+        return {'position': pos, 'edited_position': edited_pos, 'reference': reference, 'query': '-'}
+
+    def apply(self, edit):
+        """
+        Applies one edit given in the mutations API format.
+
+        Args:
+            edit (dict): {'type': 'substitution' | 'insertion' | 'deletion', 'position': int, 'new_base': str}
+
+        Returns:
+            dict: The applied edit, see substitute(), insert() and delete().
+
+        Raises:
+            ValueError: The edit type, position or base is invalid.
+        """
+        m_type = edit.get('type')
+        pos = edit.get('position')
+        if m_type == 'substitution':
+            return self.substitute(pos, edit.get('new_base'))
+        elif m_type == 'insertion':
+            return self.insert(pos, edit.get('new_base'))
+        elif m_type == 'deletion':
+            return self.delete(pos)
+        raise ValueError(f'Invalid mutation type {m_type!r}')
+
+    def edited_bytes(self):
+        """
+        Materializes the edited strand in one linear pass over the edited positions.
+
+        Returns:
+            bytearray: The edited strand.
+        """
+        if not (self.substitutions or self.insertions or self.deleted):
+            return bytearray(self.original)
+        out = bytearray()
+        start = 0
+        for pos in sorted(set(self.substitutions) | set(self.insertions) | self.deleted):
+            # Unchanged run of original bases, then whatever happened at pos
+            out += self.original[start:pos]
+            out += self.insertions.get(pos, b'')
+            if pos < len(self.original) and pos not in self.deleted:
+                out.append(ord(self.substitutions.get(pos) or chr(self.original[pos])))
+            start = pos + 1
+        out += self.original[start:]
+        return out
+
+    def edited_strand(self):
+        """
+        Returns:
+            str: The edited strand.
+        """
+        return self.edited_bytes().decode('ascii')
@@ -0,0 +1,354 @@
+# telemetry.py
+import math
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+
+"""
+Prediction Telemetry
+
+In-process counters for the ML models, cheap enough to record on every prediction batch:
+    - latency histograms per model and stage ('encode', 'predict', 'serialize', 'inference'),
+    - per-feature counters of categories the encoders have never seen (encoded as -1), a sign of drift,
+    - per-feature sketches of the numeric inputs: count, missing values, sum, sum of squares, min and max.
+
+Histograms use HDR-style log-linear buckets: every power of two is split into SUB_BUCKETS linear steps,
+so a value is bucketed with one frexp() and the relative error stays below 1 / SUB_BUCKETS whatever the
+magnitude.
+
+Predictions run in the inference pool processes; their counters are drained after every batch and merged
+into the web worker's counters (see model/executor.py), which render() exposes in Prometheus text format.
+"""
+
+# Bucket layout: SUB_BUCKETS steps per power of two, from 2**MIN_EXPONENT (~1µs) to 2**MAX_EXPONENT (128s)
+SUB_BUCKETS = 2
+MIN_EXPONENT = -20
+MAX_EXPONENT = 7
+BOUNDS = [2.0 ** exponent * (1 + step / SUB_BUCKETS)
+          for exponent in range(MIN_EXPONENT, MAX_EXPONENT) for step in range(SUB_BUCKETS)] + [2.0 ** MAX_EXPONENT]
+
+
+def bucket_index(value):
+    """
+    Args:
+        value (float): A non-negative value, in seconds for latencies.
+
+    Returns:
+        int: Index of the first bucket whose upper bound is >= value, len(BOUNDS) for values above the last bound.
+    """
+    if value <= BOUNDS[0]:
+        return 0
+    mantissa, exponent = math.frexp(value)  # value = mantissa * 2**exponent, 0.5 <= mantissa < 1
+    step = math.ceil((2 * mantissa - 1) * SUB_BUCKETS)  # value <= 2**(exponent - 1) * (1 + step / SUB_BUCKETS)
+    index = (exponent - 1 - MIN_EXPONENT) * SUB_BUCKETS + step
+    return min(max(index, 0), len(BOUNDS))
+
+
+class Histogram:
+    """
+    Histogram
+
+    Attributes:
+        counts (list): Number of values per bucket, the last one counts values above BOUNDS[-1].
+        total (float): Sum of all values.
+        count (int): Number of values.
+    """
+
+    def __init__(self):
+        """
+        Constructor, 1st step in object creation.
+        """
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def record(self, value):
+        """
+        Args:
+            value (float): The value to add.
+        """
+        self.counts[bucket_index(value)] += 1
+        self.total += value
+        self.count += 1
+
+    def merge(self, state):
+        """
+        Args:
+            state (tuple): (counts, total, count) of another histogram with the same buckets.
+        """
+        counts, total, count = state
+        self.counts = [a + b for a, b in zip(self.counts, counts)]
+        self.total += total
+        self.count += count
+
+    def state(self):
+        """
+        Returns:
+            tuple: (counts, total, count), picklable.
+        """
+        return list(self.counts), self.total, self.count
+
+
+class Sketch:
+    """
+    Sketch
+
+    Running moments of one numeric input feature.
+    """
+
+    def __init__(self):
+        """
+        Constructor, 1st step in object creation.
+        """
+        self.count = 0
+        self.missing = 0
+        self.total = 0.0
+        self.squares = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    def merge(self, state):
+        """
+        Args:
+            state (tuple): (count, missing, total, squares, minimum, maximum) of values to add.
+        """
+        count, missing, total, squares, minimum, maximum = state
+        self.count += count
+        self.missing += missing
+        self.total += total
+        self.squares += squares
+        self.minimum = min(self.minimum, minimum)
+        self.maximum = max(self.maximum, maximum)
+
+    def state(self):
+        """
+        Returns:
+            tuple: (count, missing, total, squares, minimum, maximum), picklable.
+        """
+        return self.count, self.missing, self.total, self.squares, self.minimum, self.maximum
+
+
+# Counters of this process, all updated under one lock
+_lock = threading.Lock()
+_local = threading.local()  # per thread 'suspended' flag, see suspended()
+_histograms = {}  # (model, stage) -> Histogram
+_unseen = {}      # (model, feature) -> [unseen, total]
+_sketches = {}    # (model, feature) -> Sketch
+_predictions = {}  # model -> number of predicted records
+
+
+@contextmanager
+def suspended():
+    """
+    Stops recording in the current thread for the body of a with statement, for predictions that are not
+    production traffic (e.g. shadow evaluation).
+    """
+    previous = getattr(_local, 'suspended', False)
+    _local.suspended = True
+    try:
+        yield
+    finally:
+        _local.suspended = previous
+
+
+def _recording():
+    return not getattr(_local, 'suspended', False)
+
+
+def observe(model, stage, seconds):
+    """
+    Records the duration of one stage of a prediction batch.
+
+    Args:
+        model (str): The registry name of the model.
+        stage (str): The stage, e.g. 'encode' or 'predict'.
+        seconds (float): The duration.
+    """
+    if not _recording():
+        return
+    with _lock:
+        histogram = _histograms.get((model, stage))
+        if histogram is None:
+            histogram = _histograms[(model, stage)] = Histogram()
+        histogram.record(seconds)
+
+
+@contextmanager
+def timer(model, stage):
+    """
+    Times the body of a with statement as one stage of a prediction batch, see observe().
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(model, stage, time.perf_counter() - start)
+
+
+def count_predictions(model, records):
+    """
+    Args:
+        model (str): The registry name of the model.
+        records (int): Number of records predicted.
+    """
+    if not _recording():
+        return
+    with _lock:
+        _predictions[model] = _predictions.get(model, 0) + records
+
+
+def count_unseen(model, feature, codes):
+    """
+    Counts the values of an encoded categorical feature that the encoder did not know.
+
+    Args:
+        model (str): The registry name of the model.
+        feature (str): The feature name.
+        codes (numpy.ndarray): Encoded values, -1 for unseen categories.
+    """
+    if not _recording():
+        return
+    unseen = int(np.count_nonzero(codes == -1))
+    with _lock:
+        counter = _unseen.setdefault((model, feature), [0, 0])
+        counter[0] += unseen
+        counter[1] += len(codes)
+
+
+def sketch_inputs(model, features, X):
+    """
+    Adds a batch of numeric inputs to the per-feature sketches.
+
+    Args:
+        model (str): The registry name of the model.
+        features (list): Names of the columns of X.
+        X (numpy.ndarray): Input matrix, shape (records, features), NaN for missing values.
+    """
+    if not _recording():
+        return
+    X = np.asarray(X, dtype=np.float64)
+    present = ~np.isnan(X)
+    counts = present.sum(axis=0)
+    values = np.where(present, X, 0.0)
+    totals = values.sum(axis=0)
+    squares = np.square(values).sum(axis=0)
+    minimums = np.where(present, X, np.inf).min(axis=0, initial=np.inf)
+    maximums = np.where(present, X, -np.inf).max(axis=0, initial=-np.inf)
+    with _lock:
+        for i, feature in enumerate(features):
+            sketch = _sketches.get((model, feature))
+            if sketch is None:
+                sketch = _sketches[(model, feature)] = Sketch()
+            sketch.merge((int(counts[i]), len(X) - int(counts[i]), float(totals[i]), float(squares[i]),
+                          float(minimums[i]), float(maximums[i])))
+
+
+def drain():
+    """
+    Takes the counters of this process and resets them, used by pool processes to ship them to the web worker.
+
+    Returns:
+        dict: Picklable counters for merge().
+    """
+    global _histograms, _unseen, _sketches, _predictions
+    with _lock:
+        state = {
+            'histograms': {key: histogram.state() for key, histogram in _histograms.items()},
+            'unseen': _unseen,
+            'sketches': {key: sketch.state() for key, sketch in _sketches.items()},
+            'predictions': _predictions,
+        }
+        _histograms, _unseen, _sketches, _predictions = {}, {}, {}, {}
+    return state
+
+
+def merge(state):
+    """
+    Adds counters taken by drain() in another process to the counters of this process.
+
+    Args:
+        state (dict): Counters returned by drain().
+    """
+    with _lock:
+        for key, histogram_state in state['histograms'].items():
+            _histograms.setdefault(key, Histogram()).merge(histogram_state)
+        for key, (unseen, total) in state['unseen'].items():
+            counter = _unseen.setdefault(key, [0, 0])
+            counter[0] += unseen
+            counter[1] += total
+        for key, sketch_state in state['sketches'].items():
+            _sketches.setdefault(key, Sketch()).merge(sketch_state)
+        for model, records in state['predictions'].items():
+            _predictions[model] = _predictions.get(model, 0) + records
+
+
+def _labels(**labels):
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for name, value in labels.items()) + '}'
+
+
+def _number(value):
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def render():
+    """
+    Returns:
+        str: All counters of this process in the Prometheus text exposition format.
+    """
+    with _lock:
+        histograms = {key: histogram.state() for key, histogram in _histograms.items()}
+        unseen = {key: tuple(counter) for key, counter in _unseen.items()}
+        sketches = {key: sketch.state() for key, sketch in _sketches.items()}
+        predictions = dict(_predictions)
+
+    lines = [
+        '# HELP ml_predictions_total Records predicted per model.',
+        '# TYPE ml_predictions_total counter',
+    ]
+    for model, records in sorted(predictions.items()):
+        lines.append(f"ml_predictions_total{_labels(model=model)} {records}")
+
+    lines += [
+        '# HELP ml_stage_duration_seconds Duration of the stages of prediction batches.',
+        '# TYPE ml_stage_duration_seconds histogram',
+    ]
+    for (model, stage), (counts, total, count) in sorted(histograms.items()):
+        cumulative = 0
+        for bound, bucket in zip(BOUNDS + [math.inf], counts):
+            cumulative += bucket
+            lines.append(f"ml_stage_duration_seconds_bucket{_labels(model=model, stage=stage, le=_number(bound))} {cumulative}")
+        lines.append(f"ml_stage_duration_seconds_sum{_labels(model=model, stage=stage)} {_number(total)}")
+        lines.append(f"ml_stage_duration_seconds_count{_labels(model=model, stage=stage)} {count}")
+
+    lines += [
+        '# HELP ml_unseen_categories_total Categorical inputs the encoder did not know, encoded as -1.',
+        '# TYPE ml_unseen_categories_total counter',
+    ]
+    for (model, feature), (count, _) in sorted(unseen.items()):
+        lines.append(f"ml_unseen_categories_total{_labels(model=model, feature=feature)} {count}")
+    lines += [
+        '# HELP ml_categorical_inputs_total Categorical inputs encoded.',
+        '# TYPE ml_categorical_inputs_total counter',
+    ]
+    for (model, feature), (_, total) in sorted(unseen.items()):
+        lines.append(f"ml_categorical_inputs_total{_labels(model=model, feature=feature)} {total}")
+
+    sketch_metrics = [
+        ('ml_feature_values_total', 'counter', 'Numeric inputs observed.', 0),
+        ('ml_feature_missing_total', 'counter', 'Numeric inputs that were missing (NaN).', 1),
+        ('ml_feature_value_sum', 'counter', 'Sum of the numeric inputs.', 2),
+        ('ml_feature_value_squares_sum', 'counter', 'Sum of the squares of the numeric inputs.', 3),
+        ('ml_feature_value_min', 'gauge', 'Smallest numeric input.', 4),
+        ('ml_feature_value_max', 'gauge', 'Largest numeric input.', 5),
+    ]
+    for name, kind, description, field in sketch_metrics:
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+        for (model, feature), state in sorted(sketches.items()):
+            lines.append(f"{name}{_labels(model=model, feature=feature)} {_number(state[field])}")
+    return '\n'.join(lines) + '\n'
@@ -1,91 +1,146 @@
 # Python Titanic Model, prepared for a titanic.py file
 
 # Import the required libraries for the TitanicModel class
+import os
+import threading
+from sklearn.compose import ColumnTransformer
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import FunctionTransformer, OneHotEncoder
 from sklearn.tree import DecisionTreeClassifier
 from sklearn.linear_model import LogisticRegression
-from sklearn.metrics import accuracy_score
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import OneHotEncoder
 import pandas as pd
 import numpy as np
-import seaborn as sns
+from model import registry
+
+# Local copy of the titanic dataset, downloaded once (seaborn needs network access) and read from disk afterwards
+data_path = os.environ.get('TITANIC_DATA_PATH') or os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..', 'instance', 'data', 'titanic.csv'))
+
+# Raw passenger fields, as sent to predict(), and the target
+columns = ['pclass', 'sex', 'age', 'sibsp', 'parch', 'fare', 'embarked', 'alone']
+target = 'survived'
+
+# Column transforms, module level functions so that the fitted pipeline can be pickled into the artifact
+def _is_male(X):
+    return (X == 'male').astype(int)
+
+def _is_true(X):
+    return (X == True).astype(int)
+
+def fetch_dataset():
+    """ Copies the titanic dataset to data_path, if it is not there yet.
+
+    Returns:
+        str: the path of the local dataset
+
+    Raises:
+        FileNotFoundError: there is no local copy and the download failed
+    """
+    if not os.path.exists(data_path):
+        try:
+            import seaborn as sns  # large import, only needed the first time
+            titanic_data = sns.load_dataset('titanic')
+        except Exception as e:
+            raise FileNotFoundError(f"Titanic dataset not found at {data_path} and could not be downloaded: {e}")
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        tmp_path = f"{data_path}.{os.getpid()}.tmp"
+        titanic_data[columns + [target]].to_csv(tmp_path, index=False)
+        os.replace(tmp_path, data_path)
+    return data_path
+
+def preprocessor():
+    """ Builds the preprocessing step, raw passenger columns in, model features out.
+
+    Returns:
+        ColumnTransformer: sex and alone as 0/1, embarked one-hot encoded, numeric columns passed through
+    """
+    return ColumnTransformer([
+        ('pclass', 'passthrough', ['pclass']),
+        ('sex', FunctionTransformer(_is_male, feature_names_out='one-to-one'), ['sex']),
+        ('numeric', 'passthrough', ['age', 'sibsp', 'parch', 'fare']),
+        ('alone', FunctionTransformer(_is_true, feature_names_out='one-to-one'), ['alone']),
+        ('embarked', OneHotEncoder(handle_unknown='ignore'), ['embarked']),
+    ], verbose_feature_names_out=False)
+
+# Training: run by the registry build step (train_model.py), or on first use when no artifact exists
+def train():
+    # load the local copy of the titanic dataset, drop rows with missing values
+    data = pd.read_csv(fetch_dataset()).dropna(subset=columns + [target])
+    X = data[columns]
+    y = data[target]
+
+    # logistic regression as key model, preprocessing and model fitted together as one pipeline
+    pipeline = Pipeline([('preprocess', preprocessor()), ('model', LogisticRegression(max_iter=1000))])
+    pipeline.fit(X, y)
+
+    # decision tree on the same features, to show feature importance
+    preprocess = pipeline.named_steps['preprocess']
+    dt = DecisionTreeClassifier()
+    dt.fit(preprocess.transform(X), y)
+
+    return {'estimator': pipeline, 'features': list(preprocess.get_feature_names_out()), 'extras': {'dt': dt}}
+
+# the dataset is fetched by train(), so it is optional for the registry
+registry.register('titanic', [], train, optional=[data_path])
 
 class TitanicModel:
     """A class used to represent the Titanic Model for passenger survival prediction.
     """
     # a singleton instance of TitanicModel, created to train the model only once, while using it for prediction multiple times
     _instance = None
-    
+    # guards the creation of the instance, concurrent first requests wait for one load instead of training twice
+    _lock = threading.Lock()
+
     # constructor, used to initialize the TitanicModel
     def __init__(self):
-        # the titanic ML model
-        self.model = None
-        self.dt = None
         # define ML features and target
-        self.features = ['pclass', 'sex', 'age', 'sibsp', 'parch', 'fare', 'alone']
-        self.target = 'survived'
-        # load the titanic dataset
-        self.titanic_data = sns.load_dataset('titanic')
-        # one-hot encoder used to encode 'embarked' column
-        self.encoder = OneHotEncoder(handle_unknown='ignore')
-
-    # clean the titanic dataset, prepare it for training
-    def _clean(self):
-        # Drop unnecessary columns
-        self.titanic_data.drop(['alive', 'who', 'adult_male', 'class', 'embark_town', 'deck'], axis=1, inplace=True)
-
-        # Convert boolean columns to integers
-        self.titanic_data['sex'] = self.titanic_data['sex'].apply(lambda x: 1 if x == 'male' else 0)
-        self.titanic_data['alone'] = self.titanic_data['alone'].apply(lambda x: 1 if x == True else 0)
-
-        # Drop rows with missing 'embarked' values before one-hot encoding
-        self.titanic_data.dropna(subset=['embarked'], inplace=True)
-        
-        # One-hot encode 'embarked' column
-        onehot = self.encoder.fit_transform(self.titanic_data[['embarked']]).toarray()
-        cols = ['embarked_' + str(val) for val in self.encoder.categories_[0]]
-        onehot_df = pd.DataFrame(onehot, columns=cols)
-        self.titanic_data = pd.concat([self.titanic_data, onehot_df], axis=1)
-        self.titanic_data.drop(['embarked'], axis=1, inplace=True)
-
-        # Add the one-hot encoded 'embarked' features to the features list
-        self.features.extend(cols)
-        
-        # Drop rows with missing values
-        self.titanic_data.dropna(inplace=True)
-
-    # train the titanic model, using logistic regression as key model, and decision tree to show feature importance
-    def _train(self):
-        # split the data into features and target
-        X = self.titanic_data[self.features]
-        y = self.titanic_data[self.target]
-        
-        # perform train-test split
-        self.model = LogisticRegression(max_iter=1000)
-        
-        # train the model
-        self.model.fit(X, y)
-        
-        # train a decision tree classifier
-        self.dt = DecisionTreeClassifier()
-        self.dt.fit(X, y)
-        
+        self.target = target
+        # load the trained pipeline (built and saved by the registry if there is none yet)
+        registry.load('titanic')
+
+    @property
+    def artifact(self):
+        # the registry swaps in a retrained artifact when one is published
+        return registry.load('titanic')
+
+    @property
+    def features(self):
+        return self.artifact.features
+
     @classmethod
     def get_instance(cls):
-        """ Gets, and conditionaly cleans and builds, the singleton instance of the TitanicModel.
+        """ Gets, and conditionaly loads or builds, the singleton instance of the TitanicModel.
         The model is used for analysis on titanic data and predictions on the survival of theoritical passengers.
         
         Returns:
             TitanicModel: the singleton _instance of the TitanicModel, which contains data and methods for prediction.
         """        
-        # check for instance, if it doesn't exist, create it
+        # check for instance, if it doesn't exist, create it under the lock
         if cls._instance is None:
-            cls._instance = cls()
-            cls._instance._clean()
-            cls._instance._train()
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = cls()
         # return the instance, to be used for prediction
         return cls._instance
 
+    def predict_many(self, passengers):
+        """ Predict the survival probabilities of many passengers with one predict_proba call.
+
+        Args:
+            passengers (list or DataFrame): passengers, each with the keys described in predict()
+
+        Returns:
+            list: one dictionary with die and survive probabilities per passenger
+        """
+        if len(passengers) == 0:
+            return []
+        passengers_df = passengers if isinstance(passengers, pd.DataFrame) else pd.DataFrame(list(passengers))
+        missing_cols = [col for col in columns if col not in passengers_df.columns]
+        if missing_cols:
+            raise ValueError(f"Missing columns in input data: {missing_cols}")
+        probabilities = self.artifact.estimator.predict_proba(passengers_df[columns])
+        return [{'die': float(die), 'survive': float(survive)} for die, survive in probabilities]
+
     def predict(self, passenger):
         """ Predict the survival probability of a passenger.
 
@@ -103,20 +158,9 @@ class TitanicModel:
         Returns:
            dictionary : contains die and survive probabilities 
         """
-        # clean the passenger data
-        passenger_df = pd.DataFrame(passenger, index=[0])
-        passenger_df['sex'] = passenger_df['sex'].apply(lambda x: 1 if x == 'male' else 0)
-        passenger_df['alone'] = passenger_df['alone'].apply(lambda x: 1 if x == True else 0)
-        onehot = self.encoder.transform(passenger_df[['embarked']]).toarray()
-        cols = ['embarked_' + str(val) for val in self.encoder.categories_[0]]
-        onehot_df = pd.DataFrame(onehot, columns=cols)
-        passenger_df = pd.concat([passenger_df, onehot_df], axis=1)
-        passenger_df.drop(['embarked', 'name'], axis=1, inplace=True)
-        
-        # predict the survival probability and extract the probabilities from numpy array
-        die, survive = np.squeeze(self.model.predict_proba(passenger_df))
-        # return the survival probabilities as a dictionary
-        return {'die': die, 'survive': survive}
+        # values may be given as one element lists, e.g. {'pclass': [2], ...}
+        passenger = {key: value[0] if isinstance(value, list) else value for key, value in passenger.items()}
+        return self.predict_many([passenger])[0]
     
     def feature_weights(self):
         """Get the feature weights
@@ -125,10 +169,15 @@ class TitanicModel:
         Returns:
             dictionary: contains each feature as a key and its weight of importance as a value
         """
+        artifact = self.artifact
         # extract the feature importances from the decision tree model
-        importances = self.dt.feature_importances_
+        importances = artifact.extras['dt'].feature_importances_
         # return the feature importances as a dictionary, using dictionary comprehension
-        return {feature: importance for feature, importance in zip(self.features, importances)} 
+        return {feature: importance for feature, importance in zip(artifact.features, importances)} 
+
+# Batch prediction interface, used by the inference executor
+def predict_many(records):
+    return TitanicModel.get_instance().predict_many(records)
     
 def initTitanic():
     """ Initialize the Titanic Model.
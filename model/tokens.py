@@ -0,0 +1,225 @@
+# tokens.py
+import os
+import threading
+import time
+import uuid
+import jwt
+from sqlalchemy.exc import IntegrityError
+from __init__ import app, db
+
+"""
+Access Tokens, Refresh Tokens and Revocation
+
+Logins get two JWTs (see UserAPI._Security):
+    - an access token, sent with every request, valid for JWT_ACCESS_TTL seconds (15 minutes by default),
+    - a refresh token, sent only to /api/authenticate, valid for JWT_REFRESH_TTL seconds (14 days), which
+      /api/authenticate/refresh trades for a new pair.  Every refresh token is used once: it is revoked when
+      it is traded, and a trade whose insert of the jti fails on the unique constraint is refused.
+
+Both carry a unique 'jti'.  Logging out revokes the jti of both tokens until they would have expired anyway.
+Revoked jtis are rows of the revoked_tokens table; every process keeps them in a set, so checking a token
+is a set lookup plus one stat() of a stamp file that revoke() touches.  When the stamp changed, the process
+reads only the rows added since its last sync (the autoincrement id is the version counter), so a revocation
+made by one gunicorn worker holds in all of them from their next request.  Every SYNC_INTERVAL seconds the
+whole table is read again, which catches up processes on other hosts (that do not share the stamp) and rows
+committed out of id order.
+"""
+
+ALGORITHM = 'HS256'
+
+
+class TokenRevoked(jwt.InvalidTokenError):
+    """Raised for a token that was revoked."""
+
+
+# Seconds between syncs of the revocation list without a change of the stamp file
+SYNC_INTERVAL = float(os.environ.get('JWT_REVOCATION_SYNC_INTERVAL') or 30)
+
+# Touched whenever a token is revoked, shared by all processes that use the instance folder
+STAMP_PATH = os.path.join(app.instance_path, 'revocations.stamp')
+
+
+def issue(uid, kind='access'):
+    """
+    Args:
+        uid (str): The uid of the user the token authenticates.
+        kind (str, optional): 'access' or 'refresh'.
+
+    Returns:
+        tuple: (token, claims).
+    """
+    now = int(time.time())
+    ttl = app.config['JWT_ACCESS_TTL'] if kind == 'access' else app.config['JWT_REFRESH_TTL']
+    claims = {'_uid': uid, 'jti': uuid.uuid4().hex, 'type': kind, 'iat': now, 'exp': now + ttl}
+    return jwt.encode(claims, app.config['SECRET_KEY'], algorithm=ALGORITHM), claims
+
+
+def decode(token, kind='access'):
+    """
+    Verifies a token: signature, expiry, kind and revocation.
+
+    Args:
+        token (str): The JWT.
+        kind (str, optional): The kind of token expected, 'access' or 'refresh'.
+
+    Returns:
+        dict: The claims.
+
+    Raises:
+        jwt.ExpiredSignatureError: The token has expired.
+        jwt.InvalidTokenError: The token is invalid, of another kind, or revoked.
+    """
+    claims = jwt.decode(token, app.config['SECRET_KEY'], algorithms=[ALGORITHM], options={'require': ['exp', 'jti']})
+    check(claims, kind)
+    return claims
+
+
+def check(claims, kind='access'):
+    """
+    Checks decoded claims, e.g. cached ones, for their kind and revocation.
+
+    Args:
+        claims (dict): The claims of a verified token.
+        kind (str, optional): The kind of token expected.
+
+    Raises:
+        jwt.InvalidTokenError: The token is of another kind, or revoked.
+    """
+    if claims.get('type') != kind:
+        raise jwt.InvalidTokenError(f"Not an {kind} token")
+    if revocations.is_revoked(claims.get('jti')):
+        raise TokenRevoked("Token has been revoked")
+
+
+class RevokedToken(db.Model):
+    """
+    RevokedToken Model
+
+    Attributes:
+        id (db.Column): The primary key, increasing, so processes read only the rows added since their last sync.
+        jti (db.Column): The unique id of the revoked token.
+        expires (db.Column): When the token expires (epoch seconds), after which the row is not needed.
+    """
+    __tablename__ = 'revoked_tokens'
+
+    id = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(64), unique=True, nullable=False)
+    expires = db.Column(db.Float, nullable=False, index=True)
+
+
+def _stamp():
+    try:
+        return os.stat(STAMP_PATH).st_mtime_ns
+    except OSError:
+        return None
+
+
+class RevocationList:
+    """
+    RevocationList
+
+    In-memory copy of the revoked_tokens table of one process.
+    """
+
+    def __init__(self):
+        """
+        Constructor, 1st step in object creation.
+        """
+        self._revoked = {}  # jti -> expiry
+        self._version = 0   # highest row id read
+        self._stamp = None
+        self._synced = None
+        self._lock = threading.Lock()
+
+    def is_revoked(self, jti):
+        """
+        Args:
+            jti (str): The unique id of a token.
+
+        Returns:
+            bool: Whether the token was revoked.
+        """
+        stamp = _stamp()
+        if self._synced is None or time.monotonic() - self._synced > SYNC_INTERVAL:
+            self.sync(stamp, full=True)
+        elif stamp != self._stamp:
+            self.sync(stamp)
+        return jti in self._revoked
+
+    def sync(self, stamp=None, full=False):
+        """
+        Reads the revocations added since the last sync and forgets those of expired tokens.
+
+        Args:
+            stamp (int, optional): The stamp file's modification time read before the sync.
+            full (bool, optional): Read all rows instead, which also catches rows committed out of id order.
+        """
+        table = RevokedToken.__table__
+        with self._lock:
+            if self._synced is None:
+                table.create(db.engine, checkfirst=True)
+            now = time.time()
+            query = table.select().where(table.c.expires > now)
+            if not full:
+                query = query.where(table.c.id > self._version)
+            with db.engine.connect() as connection:
+                rows = connection.execute(query.order_by(table.c.id)).fetchall()
+            revoked = {} if full else {jti: expires for jti, expires in self._revoked.items() if expires > now}
+            for row in rows:
+                revoked[row.jti] = row.expires
+                self._version = max(self._version, row.id)
+            # Swapped, not updated, so that lookups never see a dictionary being changed
+            self._revoked = revoked
+            self._stamp = stamp
+            self._synced = time.monotonic()
+
+    def revoke(self, jti, expires):
+        """
+        Revokes a token in every process.  The unique jti column decides races: of two requests revoking
+        the same token, e.g. two refreshes with one refresh token, only one gets True.
+
+        Args:
+            jti (str): The unique id of the token.
+            expires (float): When the token expires, epoch seconds.
+
+        Returns:
+            bool: Whether this call revoked the token; False if it was revoked already or has expired.
+        """
+        if not jti or expires <= time.time():
+            return False
+        if self._synced is None:
+            self.sync(_stamp(), full=True)
+        table = RevokedToken.__table__
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(table.insert().values(jti=jti, expires=expires))
+        except IntegrityError:
+            return False
+        # Rows of expired tokens are removed by whoever revokes next
+        with db.engine.begin() as connection:
+            connection.execute(table.delete().where(table.c.expires < time.time()))
+        with self._lock:
+            self._revoked = {**self._revoked, jti: expires}
+        try:
+            with open(STAMP_PATH, 'a'):
+                os.utime(STAMP_PATH)
+        except OSError as e:
+            print(f"Could not touch the revocation stamp {STAMP_PATH}: {e}")
+        return True
+
+
+# One list per process
+revocations = RevocationList()
+
+
+def revoke(claims):
+    """
+    Revokes a token given its claims.
+
+    Args:
+        claims (dict): The decoded claims, with 'jti' and 'exp'.
+
+    Returns:
+        bool: Whether this call revoked the token.
+    """
+    return revocations.revoke(claims.get('jti'), claims.get('exp', 0))
@@ -3,11 +3,11 @@ from flask import current_app
 from flask_login import UserMixin
 from datetime import date
 from sqlalchemy.exc import IntegrityError
-from werkzeug.security import generate_password_hash, check_password_hash
 import os
 import json
 
 from __init__ import app, db
+from model import bulk, passwords
 
 """ Helper Functions """
 
@@ -218,14 +218,23 @@ class User(db.Model, UserMixin):
 
     def set_password(self, password):
         """
-        Sets the user's password (hashed).
+        Sets the user's password (hashed, see model/passwords.py).
         
         Args:
             password (str): The new password for the user.
         """
         if not password or password == "":
             password=app.config["DEFAULT_PASSWORD"]
-        self._password = generate_password_hash(password, "pbkdf2:sha256", salt_length=10)
+        self._password = passwords.hash_password(password, block=True)
+
+    def set_password_hash(self, pwhash):
+        """
+        Sets the user's password from a hash made by passwords.hash_password or passwords.hash_many.
+        
+        Args:
+            pwhash (str): The hash of the new password.
+        """
+        self._password = pwhash
 
     def is_password(self, password):
         """
@@ -236,8 +245,27 @@ class User(db.Model, UserMixin):
         
         Returns:
             bool: True if the password matches, False otherwise.
+
+        Raises:
+            passwords.HashingBusy: Too many passwords are being checked at the moment.
         """
-        return check_password_hash(self._password, password)
+        return self.verify_password(password)[0]
+
+    def verify_password(self, password):
+        """
+        Checks a password like is_password, and gives the hash to store when the stored one was made with a
+        former method.  Storing it is left to the caller (see UserAPI._Security.post).
+        
+        Args:
+            password (str): The password to check.
+        
+        Returns:
+            tuple: (True if the password matches, new hash for set_password_hash or None).
+
+        Raises:
+            passwords.HashingBusy: Too many passwords are being checked at the moment.
+        """
+        return passwords.verify(self._password, password)
 
     def __str__(self):
         """
@@ -470,17 +498,86 @@ class User(db.Model, UserMixin):
             if os.path.exists(old_path):
                 os.rename(old_path, new_path)
                 
+    @staticmethod
+    def bulk_create(rows, chunk_size=bulk.CHUNK_SIZE):
+        """
+        Creates many users at once, e.g. a class roster: the rows are validated up front, the uids already taken
+        are found with a few IN queries, the passwords are hashed in parallel and the users are inserted
+        chunk_size at a time, one transaction per chunk.
+
+        Args:
+            rows (list): Dictionaries with 'name', 'uid' and optionally 'password' and 'pfp', as for POST /api/user.
+            chunk_size (int, optional): Users inserted per transaction.
+
+        Returns:
+            dict: 'success_count', 'error_count' and 'errors', a list of {'index', 'uid', 'message'} for the rows
+                that were not created.
+        """
+        errors = []
+        valid = []  # (index, row)
+        seen = set()
+        for index, row in enumerate(rows):
+            if not isinstance(row, dict):
+                errors.append({'index': index, 'uid': None, 'message': 'Expected an object with the user data'})
+                continue
+            name, uid = row.get('name'), row.get('uid')
+            if not isinstance(name, str) or len(name) < 2:
+                errors.append({'index': index, 'uid': uid, 'message': 'Name is missing, or is less than 2 characters'})
+            elif not isinstance(uid, str) or len(uid) < 2:
+                errors.append({'index': index, 'uid': uid, 'message': 'User ID is missing, or is less than 2 characters'})
+            elif uid in seen:
+                errors.append({'index': index, 'uid': uid, 'message': f'User ID {uid} is duplicate'})
+            else:
+                seen.add(uid)
+                valid.append((index, row))
+
+        # Uids already in the database
+        taken = bulk.lookup(User._uid, [row['uid'] for _, row in valid])
+        for index, row in valid:
+            if row['uid'] in taken:
+                errors.append({'index': index, 'uid': row['uid'], 'message': f"User ID {row['uid']} is duplicate"})
+        valid = [(index, row) for index, row in valid if row['uid'] not in taken]
+
+        hashes = passwords.hash_many([row.get('password') or app.config['DEFAULT_PASSWORD'] for _, row in valid])
+        mappings = [{
+            '_name': row['name'],
+            '_uid': row['uid'],
+            '_email': '?',
+            '_password': pwhash,
+            '_role': 'User',
+            '_pfp': row.get('pfp') or '',
+            '_car': '',
+        } for (_, row), pwhash in zip(valid, hashes)]
+
+        # A uid taken meanwhile fails only its own row
+        created = 0
+        for inserted, failed in bulk.insert_chunks(User, mappings, chunk_size):
+            created += inserted
+            for position, message in failed:
+                errors.append({'index': valid[position][0], 'uid': mappings[position]['_uid'],
+                               'message': f"User ID {mappings[position]['_uid']} is duplicate"})
+
+        errors.sort(key=lambda error: error['index'])
+        return {'success_count': created, 'error_count': len(errors), 'errors': errors}
+
     @staticmethod
     def restore(data):
         users = {}
-        for user_data in data:
+        # Hash the given passwords up front, in parallel, instead of one by one while restoring
+        given = [user_data.pop('password', None) for user_data in data]
+        hashed = iter(passwords.hash_many([password for password in given if password]))
+        for user_data, password in zip(data, given):
             _ = user_data.pop('id', None)  # Remove 'id' from user_data and store it in user_id
             uid = user_data.get("uid", None)
             user = User.query.filter_by(_uid=uid).first()
             if user:
+                if password:
+                    user.set_password_hash(next(hashed))
                 user.update(user_data)
             else:
-                user = User(**user_data)
+                user = User(**user_data)  # the default password unless one is given
+                if password:
+                    user.set_password_hash(next(hashed))
                 user.create()
         return users
 
@@ -505,10 +602,14 @@ def initUsers():
         db.create_all()
         """Tester data for table"""
         
-        u1 = User(name='Thomas Edison', uid=app.config['ADMIN_USER'], password=app.config['ADMIN_PASSWORD'], pfp='toby.png', car='toby_car.png', role="Admin")
-        u2 = User(name='Grace Hopper', uid=app.config['DEFAULT_USER'], password=app.config['DEFAULT_PASSWORD'], pfp='hop.png')
-        u3 = User(name='Nicholas Tesla', uid='niko', password='123niko', pfp='niko.png' )
+        u1 = User(name='Thomas Edison', uid=app.config['ADMIN_USER'], pfp='toby.png', car='toby_car.png', role="Admin")
+        u2 = User(name='Grace Hopper', uid=app.config['DEFAULT_USER'], pfp='hop.png')
+        u3 = User(name='Nicholas Tesla', uid='niko', pfp='niko.png' )
         users = [u1, u2, u3]
+        # Users are created with the default password, the others are hashed in parallel
+        hashes = passwords.hash_many([app.config['ADMIN_PASSWORD'], app.config['DEFAULT_PASSWORD'], '123niko'])
+        for user, pwhash in zip(users, hashes):
+            user.set_password_hash(pwhash)
         
         for user in users:
             try:
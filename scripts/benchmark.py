@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+
+""" benchmark.py
+Benchmarks the ML prediction paths and saves the results as JSON, so regressions can be tracked between commits.
+
+Measured:
+- cold start: import time and training time of every model module, each in a fresh interpreter
+- single-call latency of predict_functionality (mutations, editing) and predict_risk (outbreak)
+- batch throughput of predict_many at 1/10/100/1000 records
+- end-to-end /api/mutations latency through the Flask test client, strands from 100 bp to 1 Mbp
+
+Models are trained into a temporary artifact directory, instance/models is not touched.  The API benchmark
+logs in as a 'benchmark' user, created in a temporary SQLite database that is deleted when the run ends, so
+the development database is not touched either.
+
+Usage: Run from the root of the project:
+> scripts/benchmark.py                                  # all benchmarks, saved to instance/benchmarks/
+> scripts/benchmark.py --quick                          # fewer repeats and strands up to 100 kbp
+> scripts/benchmark.py --only batch latency             # only the named groups
+> scripts/benchmark.py --compare instance/benchmarks/<earlier>.json    # also print the change against a run
+"""
+
+import argparse
+import atexit
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+
+# Artifacts of the run and in-process predictions, set before any model module is imported
+os.environ['MODEL_ARTIFACT_DIR'] = tempfile.mkdtemp(prefix='benchmark-models-')
+atexit.register(shutil.rmtree, os.environ['MODEL_ARTIFACT_DIR'], ignore_errors=True)
+# The api group creates its user in a database of its own, not in the development database
+_DATABASE_DIR = tempfile.mkdtemp(prefix='benchmark-db-')
+os.environ['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(_DATABASE_DIR, 'benchmark.db')
+atexit.register(shutil.rmtree, _DATABASE_DIR, ignore_errors=True)
+
+GROUPS = ['cold_start', 'latency', 'batch', 'api']
+MODELS = ['mutations', 'editing', 'outbreak']
+BATCH_SIZES = [1, 10, 100, 1000]
+STRAND_LENGTHS = [100, 1_000, 10_000, 100_000, 1_000_000]
+RESULTS_DIR = os.path.join(ROOT, 'instance', 'benchmarks')
+
+
+def measure(function, repeat=5):
+    """
+    Times a function like timeit: calls per repeat are calibrated to last at least 0.2 seconds.
+
+    Args:
+        function (function): Zero argument function to time.
+        repeat (int, optional): Number of timed repeats.
+
+    Returns:
+        dict: Seconds per call (min, median, mean, max over the repeats) and the calls per repeat.
+    """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    times = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return {
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.fmean(times),
+        'max': max(times),
+        'calls': number,
+    }
+
+
+def cold_start(repeat):
+    """Import and training time of every model module, each in a fresh interpreter."""
+    script = (
+        "import time, json\n"
+        "start = time.perf_counter()\n"
+        "import model.{name}\n"
+        "imported = time.perf_counter() - start\n"
+        "from model import registry\n"
+        "start = time.perf_counter()\n"
+        "try:\n"
+        "    registry.build('{name}')\n"
+        "    trained = time.perf_counter() - start\n"
+        "except FileNotFoundError as e:\n"
+        "    trained = str(e)\n"
+        "print(json.dumps({{'import_seconds': imported, 'train_seconds': trained}}))\n"
+    )
+    results = {}
+    for name in MODELS:
+        runs = []
+        for _ in range(repeat):
+            output = subprocess.run([sys.executable, '-c', script.format(name=name)], cwd=ROOT,
+                                    capture_output=True, text=True, check=True).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        trained = [run['train_seconds'] for run in runs]
+        results[name] = {
+            'import_seconds': statistics.median(run['import_seconds'] for run in runs),
+            'train_seconds': statistics.median(trained) if all(isinstance(t, float) for t in trained) else None,
+        }
+        if not isinstance(trained[0], float):
+            results[name]['skipped'] = trained[0]
+        print(f"  {name}: {results[name]}")
+    return results
+
+
+def sample_records(name, count, seed=0):
+    """
+    Args:
+        name (str): The model name.
+        count (int): Number of records.
+        seed (int, optional): Random seed, the same records are used by every run.
+
+    Returns:
+        list: Input records for the model's predict_many.
+    """
+    import pandas as pd
+    rng = random.Random(seed)
+    if name == 'mutations':
+        data = pd.read_csv(os.path.join(ROOT, 'dna_mutations.csv'), nrows=5000)
+        rows = data[['Reference_Codon', 'Query_Codon', 'Mutation_Type']].to_dict('records')
+    elif name == 'editing':
+        data = pd.read_csv(os.path.join(ROOT, 'gene_editing.csv'), nrows=5000).drop(columns=['PassesQC'])
+        rows = [{key: (None if value != value else value) for key, value in row.items()} for row in data.to_dict('records')]
+    else:
+        rows = []
+        for _ in range(count):
+            distributed = rng.uniform(1e5, 1e7)
+            people = rng.uniform(0, distributed)
+            rows.append({'total_vaccinations': people * 1.4, 'people_vaccinated': people,
+                         'daily_vaccinations': rng.uniform(1e3, 1e5), 'total_distributed': distributed})
+    return [rows[rng.randrange(len(rows))] for _ in range(count)]
+
+
+def _model_functions():
+    from model import mutations, editing, outbreak
+    return {
+        'mutations': (mutations.predict_functionality, mutations.predict_many),
+        'editing': (editing.predict_functionality, editing.predict_many),
+        'outbreak': (outbreak.predict_risk, outbreak.predict_many),
+    }
+
+
+def _available(name):
+    from model import registry
+    try:
+        registry.load(name)
+        return True
+    except FileNotFoundError as e:
+        print(f"  {name}: skipped, {e}")
+        return False
+
+
+def latency(repeat):
+    """Single-call latency of predict_functionality and predict_risk."""
+    results = {}
+    for name, (predict_one, _) in _model_functions().items():
+        if not _available(name):
+            continue
+        records = sample_records(name, 256)
+        calls = itertools.cycle(records)
+        predict_one(records[0])  # warm up caches and lookup tables
+        results[name] = measure(lambda: predict_one(next(calls)), repeat)
+        print(f"  {name}: {results[name]['median'] * 1e6:.1f} µs per call")
+    return results
+
+
+def batch(repeat):
+    """predict_many throughput at every batch size."""
+    results = {}
+    for name, (_, predict_many) in _model_functions().items():
+        if not _available(name):
+            continue
+        results[name] = {}
+        for size in BATCH_SIZES:
+            records = sample_records(name, size)
+            predict_many(records)
+            timing = measure(lambda: predict_many(records), repeat)
+            timing['records_per_second'] = size / timing['median']
+            results[name][str(size)] = timing
+            print(f"  {name} x{size}: {timing['records_per_second']:.0f} records/s")
+    return results
+
+
+def random_strand(length, rng):
+    return ''.join(rng.choice('ACGT') for _ in range(length))
+
+
+def api(repeat, lengths):
+    """End-to-end /api/mutations latency through the Flask test client."""
+    from main import app, db
+    from model import tokens
+    from model.user import User
+
+    with app.app_context():
+        db.create_all()
+        if not User.query.filter_by(_uid='benchmark').first():
+            User(name='Benchmark', uid='benchmark', password=app.config['DEFAULT_PASSWORD']).create()
+    client = app.test_client()
+    client.set_cookie(app.config['JWT_TOKEN_NAME'], tokens.issue('benchmark')[0])
+
+    rng = random.Random(0)
+    results = {}
+    for length in lengths:
+        strand = random_strand(length, rng)
+        # A dozen edits spread over the strand, the same for every run
+        positions = sorted(rng.sample(range(length), 12))
+        edits = [{'type': 'substitution', 'position': pos, 'new_base': rng.choice('ACGT')} for pos in positions[:10]]
+        edits.append({'type': 'insertion', 'position': positions[10], 'new_base': 'G'})
+        edits.append({'type': 'deletion', 'position': positions[11]})
+        body = {'original_strand': strand, 'edits': edits}
+
+        def call():
+            response = client.post('/api/mutations', json=body)
+            if response.status_code != 200:
+                raise RuntimeError(f"/api/mutations returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+
+        call()
+        results[str(length)] = measure(call, repeat)
+        print(f"  {length} bp: {results[str(length)]['median'] * 1e3:.2f} ms per request")
+    return results
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _medians(results, prefix=''):
+    # Flattens the results to {'group.model.size': median seconds}
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict) and 'median' in value:
+            flat[prefix + key] = value['median']
+        elif isinstance(value, dict):
+            flat.update(_medians(value, f"{prefix}{key}."))
+        elif key.endswith('_seconds') and isinstance(value, float):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(results, path):
+    """Prints the change of every median against an earlier run."""
+    with open(path) as f:
+        before = _medians(json.load(f)['results'])
+    after = _medians(results)
+    print(f"\nChange against {os.path.basename(path)} (negative is faster):")
+    for key in sorted(after):
+        if key in before and before[key]:
+            print(f"  {key}: {100 * (after[key] / before[key] - 1):+.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the ML prediction paths')
+    parser.add_argument('--only', nargs='+', choices=GROUPS, default=GROUPS, help='benchmark groups to run')
+    parser.add_argument('--quick', action='store_true', help='fewer repeats, strands up to 100 kbp')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='inference pool processes for the API benchmark (default 0: predictions in the request thread)')
+    parser.add_argument('--output', help='JSON file to write (default instance/benchmarks/<time>-<commit>.json)')
+    parser.add_argument('--compare', help='earlier JSON results to compare against')
+    args = parser.parse_args()
+    os.environ['INFERENCE_WORKERS'] = str(args.workers)
+    repeat = 3 if args.quick else 7
+
+    results = {}
+    for group in GROUPS:
+        if group not in args.only:
+            continue
+        print(f"{group}:")
+        if group == 'cold_start':
+            results[group] = cold_start(1 if args.quick else 3)
+        elif group == 'api':
+            results[group] = api(repeat, [n for n in STRAND_LENGTHS if not args.quick or n <= 100_000])
+        else:
+            results[group] = globals()[group](repeat)
+
+    commit = _commit()
+    report = {
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'workers': args.workers,
+        'results': results,
+    }
+    path = args.output or os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {path}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import itertools
+import random
+import pytest
+from model.alignment import derive_edits
+from model.codons import classify
+from model.fasta import read_sequences, read_reference, compare_records
+from model.strand import StrandEditor
+
+"""
+Streamed alignment regression tests, run from the repository root with: python -m pytest testing
+
+The records of /api/mutations/stream and of the 'mutations' job kind must be the ones /api/mutations gives
+for the same two strands, however the query is split into alignment windows and upload chunks.
+"""
+
+
+def _random_strand(rng, length):
+    return ''.join(rng.choice('ACGT') for _ in range(length))
+
+
+def _whole_records(reference, query):
+    # What /api/mutations reports: derive_edits over the whole strands, classified per codon
+    editor = StrandEditor(reference)
+    applied = [(edit['type'], editor.apply(edit)['position']) for edit in derive_edits(reference, query)]
+    classified = classify(editor)
+    records, seen = [], set()
+    for m_type, pos in applied:
+        codon = classified.get((m_type, pos)) or classified[('deletion', pos)]
+        if id(codon) not in seen:
+            seen.add(id(codon))
+            records.append((pos, codon['mutation_type'], codon['Reference_Codon'], codon['Query_Codon']))
+    return records
+
+
+def _streamed_records(reference, query, chunk_size=997):
+    data = f'>reference\n{reference}\n>query\n{query}\n'.encode('ascii')
+    events = read_sequences(data[i:i + chunk_size] for i in range(0, len(data), chunk_size))
+    _, sequence, header = read_reference(events)
+    records = compare_records(itertools.chain([('header', header)], events), sequence)
+    return [(record['position'], record['mutation_type'], record['reference_codon'], record['query_codon'])
+            for record in records if 'mutation_type' in record]
+
+
+@pytest.mark.parametrize('size', [3, 30, 300, 3000])
+@pytest.mark.parametrize('kind', ['deletion', 'insertion'])
+@pytest.mark.parametrize('position', [100, 2040, 5000, 9000])
+def test_indel_matches_whole_strand_alignment(size, kind, position):
+    rng = random.Random(size * 31 + position)
+    reference = _random_strand(rng, 16000)
+    if kind == 'deletion':
+        query = reference[:position] + reference[position + size:]
+    else:
+        query = reference[:position] + _random_strand(rng, size) + reference[position:]
+    expected = _whole_records(reference, query)
+    assert len(expected) == 1
+    assert _streamed_records(reference, query) == expected
+
+
+@pytest.mark.parametrize('size', [300, 3000])
+def test_substitutions_after_indel_stay_in_sync(size):
+    rng = random.Random(size)
+    reference = _random_strand(rng, 40000)
+    query = list(reference[:999] + reference[999 + size:])
+    substituted = range(4999, len(query), 5001)
+    for pos in substituted:
+        query[pos] = 'A' if query[pos] != 'A' else 'C'
+    streamed = _streamed_records(reference, ''.join(query))
+    assert streamed[0][:2] == (999, 'In-Frame Deletion')
+    # Query positions past the deletion are size bases behind their reference positions
+    assert [(pos, m_type[-12:]) for pos, m_type, _, _ in streamed[1:]] == \
+        [(pos + size, 'Substitution') for pos in substituted]
@@ -1,41 +1,52 @@
-import pandas as pd
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import LabelEncoder
-from joblib import dump
-
-# Load dataset
-df = pd.read_csv('data/us_state_vaccinations.csv')
-
-# Fill missing values
-df.fillna(0, inplace=True)
-
-# Example engineered feature: vaccination rate
-df['vacc_rate'] = df['people_fully_vaccinated'] / (df['total_distributed'] + 1)
-
-# Define target
-def classify_risk(row):
-    if row['vacc_rate'] > 0.7:
-        return 'low'
-    elif row['vacc_rate'] > 0.5:
-        return 'moderate'
-    elif row['vacc_rate'] > 0.3:
-        return 'high'
-    else:
-        return 'extreme'
-
-df['risk'] = df.apply(classify_risk, axis=1)
-
-# Select features and target
-features = ['total_vaccinations', 'people_fully_vaccinated', 'daily_vaccinations', 'vacc_rate']
-X = df[features]
-y = LabelEncoder().fit_transform(df['risk'])
-
-# Train model
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-model = RandomForestClassifier(n_estimators=100)
-model.fit(X_train, y_train)
-
-# Save model
-dump(model, 'model/outbreak_model.pkl')
-print("✅ Model trained and saved as outbreak_model.pkl")
\ No newline at end of file
+#!/usr/bin/env python3
+
+""" train_model.py
+Offline build step for the ML models.
+- Trains every registered model (mutations, editing, outbreak, titanic) once.
+- Saves each one as a versioned artifact in instance/models/<name>/, see model/registry.py.
+- Web workers and CLI commands load these artifacts lazily instead of training at import time.
+
+Usage: Run from the root of the project:
+> python train_model.py              # build all models
+> python train_model.py mutations    # build only the named model(s)
+> python train_model.py --candidate editing    # build a candidate, served in shadow mode until promoted
+> python train_model.py --candidate            # build candidates of every model with a shadow mode
+"""
+import sys
+import os
+
+# Add the project root to the Python path
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+from model import registry, shadow
+# Importing the model modules registers their trainers
+import model.mutations
+import model.editing
+import model.outbreak
+import model.titanic
+
+def main(names):
+    failed = False
+    candidate = '--candidate' in names
+    names = [name for name in names if name != '--candidate']
+    if candidate:
+        # Only models with a shadow mode evaluate candidates and can promote them
+        unshadowed = [name for name in names if name not in shadow.MODELS]
+        if unshadowed:
+            print(f"❌ Model(s) {unshadowed} have no shadow mode, candidates can be built for {list(shadow.MODELS)}")
+            return 1
+        names = names or list(shadow.MODELS)
+    for name in names or registry.registered():
+        try:
+            artifact = registry.build(name, candidate=candidate)
+            kind = 'candidate version' if candidate else 'version'
+            print(f"✅ Model '{name}' trained and saved as {kind} {artifact.version}")
+        except FileNotFoundError as e:
+            print(f"⚠️  Skipped model '{name}': {e}")
+        except KeyError:
+            print(f"❌ Unknown model '{name}', choose from {registry.registered()}")
+            failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))